@@ -0,0 +1,274 @@
+# accuracy_test.py
+# Accuracy + speed evaluation of the mediapipe heuristic and keras mode on data/val/<label>/.
+#   python accuracy_test.py                      # both modes, data/val
+#   python accuracy_test.py --modes mediapipe --data data/val --workers 8
+# Images are decoded and localized in parallel worker processes: FaceMesh landmarks for
+# mediapipe mode, Haar face crops (the same localization EmotionDetector uses) for keras
+# mode. Those intermediate results are cached under cache/eval/, so later runs only pay
+# for scoring: one vectorized LandmarkFeatures call, or batched keras inference.
+# Reports per-class precision/recall, a confusion matrix over EMOTIONS, throughput and
+# latency percentiles for each mode.
+# With --faces the keras mode reads prepare_faces.py's memory-mapped crops directly instead
+# (no decode, no localization); mediapipe mode still needs the full images.
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from emotion_detector import EMOTIONS
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+CACHE_DIR = os.path.join("cache", "eval")
+TARGET_SIZE = (224, 224)
+
+_worker = {}
+
+
+def list_images(data_dir):
+    items = []
+    for label in sorted(os.listdir(data_dir)):
+        folder = os.path.join(data_dir, label)
+        if not os.path.isdir(folder):
+            continue
+        if label.lower() not in EMOTIONS:
+            print(f"skipping {folder}: '{label}' is not one of {EMOTIONS}")
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTS):
+                items.append((os.path.join(folder, name), EMOTIONS.index(label.lower())))
+    return items
+
+
+def _cache_path(mode, items):
+    h = hashlib.sha1(mode.encode())
+    for path, label in items:
+        st = os.stat(path)
+        h.update(f"{path}|{label}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return os.path.join(CACHE_DIR, f"{mode}-{h.hexdigest()[:16]}.npz")
+
+
+def _init_worker(mode):
+    import cv2
+    cv2.setNumThreads(1)
+    if mode == "mediapipe":
+        from emotion_detector import MediapipeHeuristic
+        _worker["model"] = MediapipeHeuristic(static_image_mode=True)
+    else:
+        from emotion_detector import FaceTracker
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        _worker["model"] = FaceTracker(cascade)
+
+
+def _prepare_chunk(args):
+    # returns per-image intermediates for one chunk of paths
+    import cv2
+    mode, paths = args
+    model = _worker["model"]
+    out = []
+    for path in paths:
+        img = cv2.imread(path)
+        t0 = time.perf_counter()
+        if img is None:
+            out.append(None)
+            continue
+        h, w = img.shape[:2]
+        if mode == "mediapipe":
+            points = model.landmarks(img)
+            out.append((points, w, h, 1000.0 * (time.perf_counter() - t0)))
+        else:
+            faces = model.detect_full(img)
+            if faces:
+                x, y, bw, bh = max(faces, key=lambda b: b[2] * b[3])
+                crop = img[y:y+bh, x:x+bw]
+            else:
+                # no face found: classify the whole image, as training did
+                crop = img
+            crop = cv2.resize(crop, TARGET_SIZE)
+            out.append((crop, bool(faces), 1000.0 * (time.perf_counter() - t0)))
+    return out
+
+
+def prepare(mode, items, workers, chunk=32, use_cache=True):
+    path = _cache_path(mode, items)
+    if use_cache and os.path.exists(path):
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}, True
+    chunks = [(mode, [p for p, _ in items[i:i+chunk]]) for i in range(0, len(items), chunk)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mode,)) as pool:
+        results = [r for part in pool.map(_prepare_chunk, chunks) for r in part]
+    valid = np.array([r is not None for r in results])
+    results = [r for r in results if r is not None]
+    labels = np.array([lab for (_, lab), ok in zip(items, valid) if ok], dtype=np.int64)
+    if mode == "mediapipe":
+        k = next((r[0].shape[0] for r in results if r[0] is not None), 0)
+        data = {
+            "points": np.stack([r[0] if r[0] is not None else np.full((k, 2), np.nan, np.float32)
+                                for r in results]) if results else np.zeros((0, k, 2), np.float32),
+            "w": np.array([r[1] for r in results], dtype=np.float32),
+            "h": np.array([r[2] for r in results], dtype=np.float32),
+            "prep_ms": np.array([r[3] for r in results], dtype=np.float32),
+        }
+    else:
+        data = {
+            "faces": np.stack([r[0] for r in results]) if results else np.zeros((0,) + TARGET_SIZE + (3,), np.uint8),
+            "found": np.array([r[1] for r in results], dtype=bool),
+            "prep_ms": np.array([r[2] for r in results], dtype=np.float32),
+        }
+    data["labels"] = labels
+    if use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        np.savez(path, **data)
+    return data, False
+
+
+def faces_from_store(root, split):
+    # keras-mode inputs from prepare_faces.py: memmap + the rows to score, labels over EMOTIONS
+    from prepare_faces import FaceStore
+    store = FaceStore(root, split)
+    rows, labels, found = store.valid_items()
+    classes = store.index["classes"]
+    to_emotion = np.array([EMOTIONS.index(c.lower()) if c.lower() in EMOTIONS else -1 for c in classes],
+                          dtype=np.int64)
+    keep = to_emotion[labels] >= 0 if len(labels) else np.zeros(0, bool)
+    data = {"faces": store.faces(), "rows": rows[keep], "labels": to_emotion[labels[keep]],
+            "found": found[keep], "prep_ms": np.zeros(int(keep.sum()), dtype=np.float32)}
+    return data, classes
+
+
+def score_mediapipe(data):
+    from emotion_detector import LandmarkFeatures
+    feats = LandmarkFeatures()
+    n = len(data["labels"])
+    if n and data["points"].shape[1]:
+        found = ~np.isnan(data["points"]).any(axis=(1, 2))
+    else:
+        # no image had a face, so prepare() could not tell how many landmarks to expect
+        found = np.zeros(n, bool)
+    preds = np.full(n, EMOTIONS.index("neutral"), dtype=np.int64)
+    t0 = time.perf_counter()
+    if found.any():
+        labels, _ = feats.classify(feats.compute(data["points"][found], data["w"][found], data["h"][found]))
+        preds[found] = [EMOTIONS.index(str(l)) for l in labels]
+    score_ms = 1000.0 * (time.perf_counter() - t0)
+    per_image = data["prep_ms"] + score_ms / max(n, 1)
+    return preds, per_image, found
+
+
+def score_keras(data, model_path, batch, class_order):
+    from emotion_detector import load_emotion_model
+    model = load_emotion_model(model_path)
+    if model.model is None:
+        raise RuntimeError(f"no usable model at {model_path}")
+    model.labels = class_order
+    model.warmup()
+    faces = data["faces"]
+    rows = data.get("rows")
+    n = len(faces) if rows is None else len(rows)
+    preds = np.zeros(n, dtype=np.int64)
+    infer_ms = np.zeros(n, dtype=np.float32)
+    for i in range(0, n, batch):
+        t0 = time.perf_counter()
+        results = model.predict_batch(faces[i:i+batch] if rows is None else faces[rows[i:i+batch]])
+        dt = 1000.0 * (time.perf_counter() - t0)
+        infer_ms[i:i+batch] = dt / len(results)
+        preds[i:i+batch] = [EMOTIONS.index(l) if l in EMOTIONS else -1 for l, _ in results]
+    return preds, data["prep_ms"] + infer_ms, data["found"]
+
+
+def confusion(labels, preds, k=len(EMOTIONS)):
+    cm = np.zeros((k, k), dtype=np.int64)
+    ok = preds >= 0
+    np.add.at(cm, (labels[ok], preds[ok]), 1)
+    return cm
+
+
+INPUT_NOTES = {"decoded": "", "cache": "  (cached decode)", "faces": "  (prepare_faces crops)"}
+
+
+def report(mode, labels, preds, per_image_ms, found, wall_s, inputs):
+    # inputs: "decoded" this run, "cache" (decode results from cache/eval/) or "faces" (--faces crops)
+    cm = confusion(labels, preds)
+    tp = np.diag(cm).astype(np.float64)
+    precision = tp / np.maximum(cm.sum(axis=0), 1)
+    recall = tp / np.maximum(cm.sum(axis=1), 1)
+    n = len(labels)
+    pct = np.percentile(per_image_ms, [50, 95, 99]) if n else np.zeros(3)
+    result = {
+        "mode": mode, "images": int(n), "accuracy": float(tp.sum() / max(n, 1)),
+        "face_found": float(found.mean()) if n else 0.0,
+        "precision": dict(zip(EMOTIONS, precision.round(4).tolist())),
+        "recall": dict(zip(EMOTIONS, recall.round(4).tolist())),
+        "confusion": cm.tolist(),
+        "throughput_ips": float(n / wall_s) if wall_s else 0.0,
+        "latency_ms": {"p50": float(pct[0]), "p95": float(pct[1]), "p99": float(pct[2])},
+        "inputs": inputs,
+    }
+    print(f"\n== {mode} ==  {n} images  accuracy {result['accuracy']:.3f}  "
+          f"faces found {result['face_found']:.1%}" + INPUT_NOTES[inputs])
+    print(f"{'class':>10} {'precision':>9} {'recall':>7}   confusion (rows = true, cols = predicted)")
+    print(" " * 32 + " ".join(f"{e[:5]:>6}" for e in EMOTIONS))
+    for i, e in enumerate(EMOTIONS):
+        print(f"{e:>10} {precision[i]:9.3f} {recall[i]:7.3f}   " + " ".join(f"{v:6d}" for v in cm[i]))
+    print(f"throughput {result['throughput_ips']:.1f} img/s  latency p50 {pct[0]:.1f} ms  "
+          f"p95 {pct[1]:.1f} ms  p99 {pct[2]:.1f} ms")
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluate emotion detection accuracy and speed.")
+    ap.add_argument("--data", default="data/val")
+    ap.add_argument("--modes", nargs="+", choices=["mediapipe", "keras"], default=["mediapipe", "keras"])
+    ap.add_argument("--model", default="models/trained_model.h5")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--faces", default=None, help="keras mode: score prepare_faces.py crops from this directory")
+    ap.add_argument("--split", default="val", help="split of --faces to score")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--json", default=None, help="also write the results to this file")
+    args = ap.parse_args()
+
+    needs_images = "mediapipe" in args.modes or not args.faces
+    items, class_order = [], []
+    if needs_images:
+        if not os.path.exists(args.data):
+            print(f"Dataset not found: prepare {args.data}/<label>/ folders as for train_emotion.py.")
+            return
+        items = list_images(args.data)
+        if not items:
+            print("No images found.")
+            return
+        # keras heads trained by train_emotion.py use the sorted class-folder order
+        class_order = sorted(d for d in os.listdir(args.data) if os.path.isdir(os.path.join(args.data, d)))
+
+    results = []
+    for mode in args.modes:
+        if mode == "keras" and not os.path.exists(args.model):
+            print(f"\n== keras ==  skipped: no model at {args.model}")
+            continue
+        t0 = time.perf_counter()
+        if mode == "keras" and args.faces:
+            data, order = faces_from_store(args.faces, args.split)
+            preds, per_image, found = score_keras(data, args.model, args.batch, order)
+            wall = time.perf_counter() - t0
+            results.append(report(mode, data["labels"], preds, per_image, found, wall, "faces"))
+            continue
+        data, cached = prepare(mode, items, args.workers, use_cache=not args.no_cache)
+        if mode == "mediapipe":
+            preds, per_image, found = score_mediapipe(data)
+        else:
+            preds, per_image, found = score_keras(data, args.model, args.batch, class_order)
+        wall = time.perf_counter() - t0
+        results.append(report(mode, data["labels"], preds, per_image, found, wall,
+                              "cache" if cached else "decoded"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
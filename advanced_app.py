@@ -1,24 +1,34 @@
 # advanced_app.py
-# Optional improved app with threaded capture and nicer UI elements.
+# Optional improved app with a multi-stage threaded pipeline and nicer UI elements.
 # This is an alternative to app.py. You can run either: `streamlit run app.py` or `streamlit run advanced_app.py`
+# Capture, inference (N workers) and annotation run on their own threads (see pipeline.py);
+# the pipeline lives in st.session_state so it survives Streamlit reruns.
 import streamlit as st
-import cv2
 import time
-import threading
-import queue
-from emotion_detector import EmotionDetector
-from utils import get_youtube_recommendations
+from detector_registry import get_detector, release_detector
+from emotion_detector import EMOTIONS
+from pipeline import Pipeline
+from catalog import Rotation
+from recommender import get_recommendation_service
+from metrics import metrics, timer
+from render import ChangeSlot, EmotionHistory, Preview
 
 st.set_page_config(page_title="TUNE TRAP (Advanced)", layout="wide")
 st.sidebar.title("TUNE TRAP — Advanced")
-mode = st.sidebar.selectbox("Mode", ["mediapipe (fast)", "keras (accurate)"])
+mode = st.sidebar.selectbox("Mode", ["mediapipe (fast)", "keras (accurate)", "hybrid (FaceMesh crops + keras)"])
 model_path = st.sidebar.text_input("Keras model path", "models/trained_model.h5")
 api_key = st.sidebar.text_input("YouTube API Key (optional)")
+workers = st.sidebar.slider("Inference workers", 1, 4, 2)
+preview_width = st.sidebar.select_slider("Preview width (px)", [320, 480, 640, 800, 960, 1280], value=640)
+preview_quality = st.sidebar.slider("Preview JPEG quality", 40, 95, 75, step=5)
+preview_fps = st.sidebar.slider("Preview fps cap", 5, 30, 15)
 start = st.sidebar.button("Start")
 stop = st.sidebar.button("Stop")
-skip = st.sidebar.slider("Frame skip", 1, 6, 2)
-
-detector = EmotionDetector(mode="keras" if mode.startswith("keras") else "mediapipe", keras_model_path=model_path if mode.startswith("keras") else None)
+stats_placeholder = st.sidebar.empty()
+# this session's panel; collection is process-wide and runs while any session shows timings
+show_timings = st.sidebar.checkbox("Show stage timings", value=metrics.forced)
+timings_placeholder = st.sidebar.empty()
+metrics.request(st.session_state.setdefault("metrics_viewer", metrics.viewer()), show_timings)
 
 col1, col2 = st.columns([2,1])
 frame_placeholder = col1.image([], channels="RGB")
@@ -26,79 +36,82 @@ emotion_placeholder = col2.empty()
 history_placeholder = col2.empty()
 rec_placeholder = col2.empty()
 
-q = queue.Queue(maxsize=2)
-running = threading.Event()
+# without a key, recommendations come from the local catalog (or the built-in fallback links)
+recommender = get_recommendation_service(api_key or None, max_results=5, warm_emotions=EMOTIONS)
+rotation = st.session_state.setdefault("rotation", Rotation())  # this session's recently served tracks
 
-def capture_loop(q, running, skip):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        st.error("Cannot open webcam.")
-        return
-    frame_count = 0
-    try:
-        while running.is_set():
-            ret, frame = cap.read()
-            if not ret:
-                time.sleep(0.05)
-                continue
-            frame_count += 1
-            if frame_count % skip != 0:
-                continue
-            label, conf, bbox = detector.detect(frame)
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if bbox:
-                x,y,w,h = bbox
-                cv2.rectangle(frame_rgb, (x,y), (x+w, y+h), (0,255,0), 2)
-            cv2.putText(frame_rgb, f"{label} ({conf:.2f})", (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,0,0), 2)
-            try:
-                if q.full():
-                    q.get_nowait()
-                q.put_nowait((frame_rgb, label, conf))
-            except:
-                pass
-            time.sleep(0.01)
-    finally:
-        cap.release()
+def make_detector():
+    # one detector per inference worker (FaceMesh tracking state cannot be shared between threads),
+    # all on one shared model that loads in the background and is swapped in when the file changes
+    detector_mode = mode.split()[0]
+    return get_detector(mode=detector_mode, keras_model_path=model_path if detector_mode != "mediapipe" else None,
+                        track=True)
+
+def close_detector(detector):
+    # on stop: the shared model is closed too once no worker or other session still uses it
+    release_detector(detector, close_unused=True)
 
-capture_thread = None
-history = []
+if "pipeline" not in st.session_state:
+    st.session_state.pipeline = None
+    st.session_state.history = EmotionHistory(recent=8)
 
-if start:
-    running.set()
-    capture_thread = threading.Thread(target=capture_loop, args=(q, running, skip), daemon=True)
-    capture_thread.start()
-    st.success("Webcam started")
+if start and (st.session_state.pipeline is None or not st.session_state.pipeline.running):
+    if st.session_state.pipeline is not None:
+        # a pipeline that ended on its own (error, end of file) still holds its worker detectors
+        st.session_state.pipeline.stop()
+    try:
+        st.session_state.pipeline = Pipeline(make_detector, source=0, workers=workers,
+                                             release_detector=close_detector).start()
+        st.success("Webcam started")
+    except RuntimeError as e:
+        st.error(f"Cannot open webcam: {e}")
 
-if stop:
-    running.clear()
+if stop and st.session_state.pipeline is not None:
+    st.session_state.pipeline.stop()
+    st.session_state.pipeline = None
     st.warning("Webcam stopped")
 
+pipeline = st.session_state.pipeline
+history = st.session_state.history
+shown_emotion = None
+panel_at = 0.0
+preview = Preview(frame_placeholder, width=preview_width, quality=preview_quality, max_fps=preview_fps)
+stats_slot = ChangeSlot(stats_placeholder)
+
 try:
-    while True:
-        if not q.empty():
-            frame_rgb, label, conf = q.get_nowait()
-            frame_placeholder.image(frame_rgb)
-            emotion_placeholder.markdown(f"### {label.upper()} ({conf:.2f})")
-            history.append(label)
-            if len(history) > 30:
-                history = history[-30:]
-            history_placeholder.write("Recent: " + ", ".join(history[::-1][:8]))
-            if api_key:
-                recs = get_youtube_recommendations(label, api_key)
-            else:
-                recs = []
+    while pipeline is not None and pipeline.running:
+        out = pipeline.output.take(timeout=0.5)
+        if out is None:
+            continue
+        history.observe(out.label)
+        with timer("app.st_image"):
+            # downscaled, annotated and encoded once, and only for frames under the fps cap
+            shown = preview.show(out.frame, out.label, out.conf, out.bbox)
+        # labels are already smoothed in the pipeline; compare here since output frames may be dropped
+        if out.label != shown_emotion:
+            shown_emotion = out.label
+            emotion_placeholder.markdown(f"### {out.label.upper()} ({out.conf:.2f})")
+            history_placeholder.write("Recent: " + ", ".join(list(history.changes)[::-1]) + "  \n" + history.summary())
+            with timer("app.recommend"):
+                recs = recommender.get(out.label, out.conf, rotation=rotation)
             if recs:
                 md = ""
                 for t,l in recs:
                     md += f"- [{t}]({l})  \n"
                 rec_placeholder.markdown(md)
             else:
-                rec_placeholder.info("Provide YouTube API key for live recommendations.")
-        else:
-            time.sleep(0.05)
-        if not running.is_set():
-            break
+                rec_placeholder.info("No recommendations available.")
+        if shown:
+            s = pipeline.backpressure()
+            stats_slot.markdown(
+                f"captured {s['captured']} · inferred {s['inferred']} · shown {s['emitted']}  \n"
+                f"latency {s['latency_ms']:.0f} ms · inference {s['infer_ms']:.1f} ms  \n"
+                f"dropped: capture {s['capture_dropped']} · render {s['render_dropped']} · late {s['late']}  \n"
+                + preview.format())
+        if show_timings and time.perf_counter() - panel_at > 1.0:
+            panel_at = time.perf_counter()
+            timings_placeholder.markdown(metrics.format())
+    if pipeline is not None and pipeline.error is not None:
+        st.error(f"Error: {pipeline.error}")
 except Exception as e:
     st.error(f"Error: {e}")
-finally:
-    running.clear()
@@ -0,0 +1,247 @@
+# analyze_videos.py
+# Offline batch analysis of recorded sessions (e.g. the demo MP4s) into emotion timelines.
+#   python analyze_videos.py videos/*.mp4 --out timelines --sample-fps 5 --window 2 --workers 4
+# Each file is scored in its own worker process; inside a worker a decoder thread feeds
+# frames through a bounded queue while the main thread runs EmotionDetector. Frames that are
+# not sampled are only grabbed, never decoded. Per-frame timelines are written as columnar
+# NPZ (or CSV), optionally with per-window aggregates, and progress is checkpointed so an
+# interrupted run resumes where it stopped. Outputs mirror the inputs' paths below their common
+# directory, so clips with the same name in different folders do not overwrite each other, and
+# record the frame sampling: a run with another --sample-fps starts those files over.
+import argparse
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from emotion_detector import EMOTIONS
+
+COLUMNS = ("frame", "t", "label", "conf", "x", "y", "w", "h")
+_END = object()
+
+
+def _put(frames, item, stop):
+    # blocks while the queue is full, but gives up once the consumer has stopped
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _decode(path, step, start, frames, stop):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        idx = start
+        while not stop.is_set():
+            if idx % step == 0:  # absolute grid, so a resumed run samples the same frames
+                ok, frame = cap.read()
+                if not ok or not _put(frames, (idx, frame), stop):
+                    break
+            elif not cap.grab():
+                break
+            idx += 1
+    finally:
+        cap.release()
+        _put(frames, _END, stop)
+
+
+def _output_path(out_dir, path, fmt, root=None):
+    # <out_dir>/<path relative to root, without extension>.<fmt>; root=None keys on the basename
+    rel = os.path.relpath(os.path.abspath(path), root) if root else os.path.basename(path)
+    out = os.path.join(out_dir, f"{os.path.splitext(rel)[0]}.{fmt}")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    return out
+
+
+def _stored_sampling(out_path):
+    # the sampling an existing output or checkpoint was made with, or None if unknown
+    try:
+        if out_path.endswith(".npz"):
+            with np.load(out_path) as f:
+                return {"step": int(f["step"]), "sample_fps": float(f["sample_fps"])} if "step" in f else None
+        with open(out_path + ".json") as f:
+            return json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _empty_columns():
+    return {c: [] for c in COLUMNS}
+
+
+def _save_npz(path, cols, **extra):
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp,
+                        frame=np.asarray(cols["frame"], dtype=np.int32),
+                        t=np.asarray(cols["t"], dtype=np.float32),
+                        label=np.asarray(cols["label"], dtype=np.int8),
+                        conf=np.asarray(cols["conf"], dtype=np.float16),
+                        bbox=np.asarray([cols[k] for k in ("x", "y", "w", "h")], dtype=np.int16).T.reshape(-1, 4),
+                        labels=np.asarray(EMOTIONS), **extra)
+    os.replace(tmp, path)
+
+
+def _save_csv(path, cols):
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(COLUMNS)
+        for row in zip(*(cols[c] for c in COLUMNS)):
+            frame, t, label, conf, x, y, bw, bh = row
+            w.writerow((frame, f"{t:.3f}", EMOTIONS[label], f"{conf:.3f}", x, y, bw, bh))
+    os.replace(tmp, path)
+
+
+def windowed(cols, window):
+    # per-window majority label and mean confidence, as columns
+    t = np.asarray(cols["t"], dtype=np.float64)
+    if len(t) == 0:
+        return {"window_start": np.zeros(0, np.float32), "window_label": np.zeros(0, np.int8),
+                "window_conf": np.zeros(0, np.float32)}
+    labels = np.asarray(cols["label"], dtype=np.int64)
+    conf = np.asarray(cols["conf"], dtype=np.float64)
+    win = (t // window).astype(np.int64)
+    uniq, inv = np.unique(win, return_inverse=True)
+    counts = np.zeros((len(uniq), len(EMOTIONS)), dtype=np.int64)
+    np.add.at(counts, (inv, labels), 1)
+    conf_sum = np.bincount(inv, weights=conf)
+    return {"window_start": (uniq * window).astype(np.float32),
+            "window_label": counts.argmax(axis=1).astype(np.int8),
+            "window_conf": (conf_sum / np.bincount(inv)).astype(np.float32)}
+
+
+def analyze_file(path, out_dir, mode="mediapipe", model_path=None, sample_fps=None, window=None,
+                 fmt="npz", checkpoint_every=500, resume=True, root=None):
+    import cv2
+    from emotion_detector import EmotionDetector
+
+    out_path = _output_path(out_dir, path, fmt, root)
+    ckpt_path = _output_path(out_dir, path, "ckpt.npz", root)
+
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    step = max(1, int(round(fps / sample_fps))) if sample_fps else 1
+    sampling = {"step": step, "sample_fps": float(sample_fps or 0.0)}
+
+    if resume and os.path.exists(out_path):
+        if _stored_sampling(out_path) == sampling:
+            return {"file": path, "skipped": True, "output": out_path}
+        print(f"{out_path} was sampled differently; analysing {path} again")
+    if resume and os.path.exists(ckpt_path) and _stored_sampling(ckpt_path) != sampling:
+        print(f"{ckpt_path} was sampled differently; starting {path} over")
+        os.remove(ckpt_path)
+
+    cols, start = _empty_columns(), 0
+    if resume and os.path.exists(ckpt_path):
+        with np.load(ckpt_path) as ck:
+            cols["frame"], cols["t"] = ck["frame"].tolist(), ck["t"].tolist()
+            cols["label"], cols["conf"] = ck["label"].tolist(), ck["conf"].astype(np.float32).tolist()
+            for i, k in enumerate(("x", "y", "w", "h")):
+                cols[k] = ck["bbox"][:, i].tolist()
+            start = int(ck["next_frame"])
+
+    detector = EmotionDetector(mode=mode, keras_model_path=model_path if mode != "mediapipe" else None,
+                               track=True).warmup()
+    frames = queue.Queue(maxsize=64)
+    stop = threading.Event()
+    decoder = threading.Thread(target=_decode, args=(path, step, start, frames, stop), daemon=True)
+    t0 = time.perf_counter()
+    decoder.start()
+    processed = 0
+    next_frame = start
+    try:
+        while True:
+            item = frames.get()
+            if item is _END:
+                break
+            idx, frame = item
+            label, conf, bbox = detector.detect(frame)
+            x, y, w, h = bbox if bbox is not None else (-1, -1, 0, 0)
+            for k, v in zip(COLUMNS, (idx, idx / fps, EMOTIONS.index(label) if label in EMOTIONS else 0,
+                                      conf, x, y, w, h)):
+                cols[k].append(v)
+            processed += 1
+            next_frame = idx + 1
+            if checkpoint_every and processed % checkpoint_every == 0:
+                _save_npz(ckpt_path, cols, next_frame=np.int64(next_frame), step=np.int64(step),
+                          sample_fps=np.float64(sampling["sample_fps"]))
+    finally:
+        # on a detector error the decoder must not keep reading into a queue nobody drains
+        stop.set()
+        decoder.join()
+        detector.close()
+    elapsed = time.perf_counter() - t0
+
+    extra = windowed(cols, window) if window else {}
+    if fmt == "npz":
+        _save_npz(out_path, cols, fps=np.float32(fps), step=np.int64(step),
+                  sample_fps=np.float64(sampling["sample_fps"]), **extra)
+    else:
+        _save_csv(out_path, cols)
+        with open(out_path + ".json", "w") as f:
+            json.dump(sampling, f)
+        if window:
+            with open(_output_path(out_dir, path, "windows.csv", root), "w", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(("window_start", "label", "conf"))
+                for s, l, c in zip(extra["window_start"], extra["window_label"], extra["window_conf"]):
+                    w.writerow((f"{s:.3f}", EMOTIONS[l], f"{c:.3f}"))
+    if os.path.exists(ckpt_path):
+        os.remove(ckpt_path)
+    return {"file": path, "output": out_path, "frames": processed, "resumed_from": start,
+            "seconds": round(elapsed, 3), "fps": round(processed / elapsed, 1) if elapsed else 0.0,
+            "video_fps": fps, "realtime_factor": round(processed * step / fps / elapsed, 2) if elapsed else 0.0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Score video files into emotion timelines.")
+    ap.add_argument("videos", nargs="+")
+    ap.add_argument("--out", default="timelines")
+    ap.add_argument("--mode", choices=["mediapipe", "keras", "hybrid"], default="mediapipe")
+    ap.add_argument("--model", default="models/trained_model.h5")
+    ap.add_argument("--sample-fps", type=float, default=None, help="frames per second to score (default: all)")
+    ap.add_argument("--window", type=float, default=None, help="also aggregate into windows of N seconds")
+    ap.add_argument("--format", choices=["npz", "csv"], default="npz")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--checkpoint-every", type=int, default=500)
+    ap.add_argument("--no-resume", action="store_true")
+    args = ap.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    workers = args.workers or min(len(args.videos), os.cpu_count() or 1)
+    # outputs are keyed on the path below the inputs' common directory
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(v)) for v in args.videos])
+    summary = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_file, v, args.out, args.mode, args.model, args.sample_fps,
+                               args.window, args.format, args.checkpoint_every, not args.no_resume,
+                               root): v
+                   for v in args.videos}
+        for fut in as_completed(futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"file": futures[fut], "error": str(e)}
+            summary.append(res)
+            print(json.dumps(res), flush=True)
+    done = [r for r in summary if "fps" in r]
+    if done:
+        total = sum(r["frames"] for r in done)
+        secs = sum(r["seconds"] for r in done)
+        print(f"{len(done)} files, {total} frames, {total / secs if secs else 0:.1f} frames/s per worker")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# api_server.py
+# Headless asyncio HTTP + WebSocket API for emotion detection and recommendations.
+#   python api_server.py --port 8080 --mode mediapipe
+# Endpoints
+#   POST /detect        body: image/jpeg | image/png, or raw BGR bytes with ?width=&height=
+#                       ?all_faces=1 also returns every face and recommends for the room-level emotion
+#   POST /detect/batch  body: {"frames": ["<base64 jpeg>", ...]}
+#   GET  /ws            binary messages are JPEG frames; each gets a JSON reply
+#   GET  /healthz       counters, limits and each detector's serving model version / load time
+#   GET  /metrics       per-stage latency histograms, Prometheus text (?format=json for JSON);
+#                       empty unless started with --metrics or TUNETRAP_METRICS=1
+# The blocking detector runs on a thread pool over a fixed set of detector instances;
+# requests beyond the concurrency limit queue up to `max_pending`, after which they are
+# rejected with 503 (HTTP) or dropped (WebSocket). Recommendation lookups for the same
+# emotion are coalesced into one backend call.
+import argparse
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from aiohttp import WSMsgType, web
+
+from emotion_detector import EMOTIONS, room_emotion
+from metrics import enable, metrics
+
+
+class Overloaded(Exception):
+    pass
+
+
+def decode_frame(data, width=None, height=None):
+    if width and height:
+        expected = int(width) * int(height) * 3
+        if len(data) != expected:
+            raise ValueError(f"raw frame must be {expected} bytes of BGR, got {len(data)}")
+        return np.frombuffer(data, dtype=np.uint8).reshape(int(height), int(width), 3)
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("could not decode image")
+    return frame
+
+
+class DetectorPool:
+    # a fixed set of detectors shared by all requests; each is used by one thread at a time
+    def __init__(self, detector_factory, size=2):
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="detect")
+        self._detectors = asyncio.Queue()
+        self.detectors = [detector_factory() for _ in range(size)]
+        for detector in self.detectors:
+            self._detectors.put_nowait(detector)
+
+    def status(self):
+        return [d.status() for d in self.detectors if hasattr(d, "status")]
+
+    async def detect(self, frame, all_faces=False):
+        detector = await self._detectors.get()
+        loop = asyncio.get_running_loop()
+        fn = detector.detect_faces if all_faces else detector.detect
+        job = loop.run_in_executor(self.executor, fn, frame)
+        try:
+            return await asyncio.shield(job)
+        finally:
+            # returned exactly once: now if the thread is finished with it, otherwise (the
+            # request was cancelled mid-call) as soon as it is
+            if job.done():
+                self._detectors.put_nowait(detector)
+            else:
+                job.add_done_callback(lambda _: self._detectors.put_nowait(detector))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        while not self._detectors.empty():
+            self._detectors.get_nowait().close()
+
+
+class CoalescingRecommender:
+    # `backend` is anything with a blocking get(emotion, conf) -> [(title, url), ...], e.g.
+    # recommender.RecommendationService or a local stub
+    def __init__(self, backend, executor=None, conf_step=0.1):
+        self.backend = backend
+        self.executor = executor
+        self.conf_step = conf_step  # lookups within one confidence bucket are shared, as in the catalog
+        self._inflight = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def get(self, emotion, conf=1.0):
+        conf = round(round(float(conf) / self.conf_step) * self.conf_step, 3)
+        key = (emotion.lower(), conf)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(fut)
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.executor, self.backend.get, key[0], conf)
+        self._inflight[key] = fut
+        self.stats["calls"] += 1
+        try:
+            return await asyncio.shield(fut)
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+
+class EmotionAPI:
+    def __init__(self, detector_factory, recommender_backend, pool_size=2, max_pending=8,
+                 max_batch=16):
+        self.pool = DetectorPool(detector_factory, size=pool_size)
+        self.recommender = CoalescingRecommender(recommender_backend)
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self._slots = asyncio.Semaphore(pool_size + max_pending)
+        # only model probabilities (keras / hybrid) are calibrated enough to steer the catalog;
+        # the mediapipe heuristic's confidences are landmark ratios of a few hundredths
+        self.calibrated = all(getattr(d, "mode", "mediapipe") != "mediapipe" for d in self.pool.detectors)
+        self.stats = {"frames": 0, "rejected": 0, "ws_dropped": 0, "errors": 0}
+
+    def _admit(self):
+        # requests beyond the pool plus max_pending are turned away instead of queueing
+        if self._slots.locked():
+            self.stats["rejected"] += 1
+            raise Overloaded()
+        return self._slots
+
+    async def analyze(self, frame, with_recs=True, all_faces=False):
+        async with self._admit():
+            detected = await self.pool.detect(frame, all_faces=all_faces)
+        out = self._result(detected, all_faces)
+        if with_recs:
+            recs = await self.recommender.get(out["emotion"], self._rec_conf(out, all_faces))
+            out["recommendations"] = [{"title": t, "url": u} for t, u in recs]
+        return out
+
+    def _rec_conf(self, out, all_faces=False):
+        # the room-level share is a vote like the apps' smoothed share; a raw heuristic score is not
+        return out["confidence"] if all_faces or self.calibrated else 1.0
+
+    def _result(self, detected, all_faces=False):
+        self.stats["frames"] += 1
+        if all_faces:
+            label, conf = room_emotion(detected)
+            bbox = detected[0].bbox if detected else None
+        else:
+            label, conf, bbox = detected
+        out = {"emotion": label, "confidence": round(float(conf), 4),
+               "bbox": [int(v) for v in bbox] if bbox is not None else None}
+        if all_faces:
+            out["faces"] = [{"id": f.face_id, "emotion": f.label, "confidence": round(float(f.conf), 4),
+                             "bbox": [int(v) for v in f.bbox]} for f in detected]
+        return out
+
+    # -- HTTP -----------------------------------------------------------------
+
+    async def handle_detect(self, request):
+        data = await request.read()
+        try:
+            frame = decode_frame(data, request.query.get("width"), request.query.get("height"))
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        try:
+            all_faces = request.query.get("all_faces") in ("1", "true")
+            return web.json_response(await self.analyze(frame, all_faces=all_faces))
+        except Overloaded:
+            raise web.HTTPServiceUnavailable(text="busy", headers={"Retry-After": "1"})
+
+    async def handle_batch(self, request):
+        try:
+            body = await request.json()
+        except (ValueError, UnicodeDecodeError) as e:  # json.JSONDecodeError is a ValueError
+            raise web.HTTPBadRequest(text=f"invalid JSON: {e}")
+        frames = body.get("frames", []) if isinstance(body, dict) else None
+        if not isinstance(frames, list):
+            raise web.HTTPBadRequest(text='expected {"frames": ["<base64 jpeg>", ...]}')
+        if len(frames) > self.max_batch:
+            raise web.HTTPRequestEntityTooLarge(max_size=self.max_batch, actual_size=len(frames))
+        try:
+            decoded = [decode_frame(base64.b64decode(f)) for f in frames]
+        except (ValueError, TypeError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+        try:
+            # a batch counts once against the admission limit; the pool bounds its parallelism
+            async with self._admit():
+                tasks = [asyncio.ensure_future(self.pool.detect(f)) for f in decoded]
+                try:
+                    detected = await asyncio.gather(*tasks)
+                except BaseException:
+                    for t in tasks:
+                        t.cancel()
+                    raise
+        except Overloaded:
+            raise web.HTTPServiceUnavailable(text="busy", headers={"Retry-After": "1"})
+        results = [self._result(d) for d in detected]
+        # lookups for the same emotion are coalesced across the batch
+        recs = await asyncio.gather(*(self.recommender.get(r["emotion"], self._rec_conf(r)) for r in results))
+        for r, videos in zip(results, recs):
+            r["recommendations"] = [{"title": t, "url": u} for t, u in videos]
+        return web.json_response({"results": results})
+
+    async def handle_health(self, request):
+        return web.json_response({"ok": True, "pool_size": self.pool.size, "max_pending": self.max_pending,
+                                  "emotions": EMOTIONS, **self.stats, **self.recommender.stats,
+                                  "detectors": self.pool.status()})
+
+    async def handle_metrics(self, request):
+        if request.query.get("format") == "json":
+            return web.json_response(metrics.snapshot())
+        return web.Response(text=metrics.prometheus_text(), content_type="text/plain")
+
+    # -- WebSocket --------------------------------------------------------------
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        busy = None
+        async for msg in ws:
+            if msg.type == WSMsgType.BINARY:
+                if busy is not None and not busy.done():
+                    # latest-wins per connection: never queue frames behind a slow one
+                    self.stats["ws_dropped"] += 1
+                    await ws.send_json({"dropped": True})
+                    continue
+                busy = asyncio.ensure_future(self._ws_frame(ws, msg.data))
+            elif msg.type == WSMsgType.ERROR:
+                break
+        if busy is not None:
+            busy.cancel()
+        return ws
+
+    async def _ws_frame(self, ws, data):
+        try:
+            await ws.send_json(await self.analyze(decode_frame(data)))
+        except ValueError as e:
+            await ws.send_json({"error": str(e)})
+        except Overloaded:
+            self.stats["ws_dropped"] += 1
+            await ws.send_json({"dropped": True})
+        except Exception as e:
+            self.stats["errors"] += 1
+            if not ws.closed:
+                await ws.send_json({"error": str(e)})
+
+    def make_app(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.add_routes([web.post("/detect", self.handle_detect),
+                        web.post("/detect/batch", self.handle_batch),
+                        web.get("/ws", self.handle_ws),
+                        web.get("/healthz", self.handle_health),
+                        web.get("/metrics", self.handle_metrics)])
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _cleanup(self, app):
+        self.pool.close()
+
+
+class StubRecommender:
+    # local backend for testing without network or an API key
+    def get(self, emotion, conf=1.0):
+        from recommender import fallback_for
+        return fallback_for(emotion)
+
+
+def create_app(detector_factory=None, recommender_backend=None, **kwargs):
+    # must be called with a running event loop (aiohttp's runner / test client do this)
+    if detector_factory is None:
+        from emotion_detector import EmotionDetector
+        detector_factory = lambda: EmotionDetector(mode="mediapipe", static_image_mode=True).warmup()
+    return EmotionAPI(detector_factory, recommender_backend or StubRecommender(), **kwargs).make_app()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Emotion + recommendation HTTP/WebSocket API")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--mode", choices=["mediapipe", "keras", "hybrid"], default="mediapipe")
+    ap.add_argument("--model", default="models/trained_model.h5")
+    ap.add_argument("--pool", type=int, default=2, help="detector instances / detection threads")
+    ap.add_argument("--max-faces", type=int, default=4, help="faces per frame for ?all_faces=1")
+    ap.add_argument("--watch-model", action="store_true", help="hot-swap the model when --model changes on disk")
+    ap.add_argument("--max-pending", type=int, default=8)
+    ap.add_argument("--api-key", default=None, help="YouTube API key; offline fallback when omitted")
+    ap.add_argument("--stub-recommendations", action="store_true")
+    ap.add_argument("--metrics", action="store_true", help="collect per-stage latency histograms for /metrics")
+    args = ap.parse_args()
+    if args.metrics:
+        enable()
+
+    from detector_registry import registry
+    from emotion_detector import EmotionDetector
+    from recommender import get_recommendation_service
+
+    # one model for the whole pool: concurrent requests are micro-batched into shared calls
+    models = registry.models(args.model, watch=args.watch_model).wait() if args.mode != "mediapipe" else None
+
+    def factory():
+        # pooled detectors serve frames from unrelated clients: no FaceMesh tracking between them
+        return EmotionDetector(mode=args.mode, models=models, max_faces=args.max_faces,
+                               static_image_mode=True).warmup()
+
+    backend = StubRecommender() if args.stub_recommendations else \
+        get_recommendation_service(args.api_key, max_results=5, warm_emotions=EMOTIONS)
+
+    async def app_factory():
+        return create_app(factory, backend, pool_size=args.pool, max_pending=args.max_pending)
+
+    web.run_app(app_factory(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,40 @@
 import streamlit as st
-import cv2
 import time
-from emotion_detector import EmotionDetector
-from utils import get_youtube_recommendations, emotion_to_query
+from scheduler import AdaptiveScheduler, LatestFrameReader
+from emotion_detector import EMOTIONS
+from detector_registry import get_detector, registry, release_detector
+from emotion_stream import EmotionStream
+from catalog import Rotation
+from recommender import get_recommendation_service
+from metrics import metrics, timer
+from render import ChangeSlot, EmotionHistory, Preview
+
+# measured from the top of this script run, so a cold start includes detector loading
+_run_started = time.perf_counter()
 
 st.set_page_config(page_title="TUNE TRAP", layout="wide")
 
 st.sidebar.title("TUNE TRAP")
 st.sidebar.markdown("Real-time emotion detection → music recommender")
-mode = st.sidebar.selectbox("Detection mode", ["mediapipe (fast, default)", "keras (accurate, optional)"])
+mode = st.sidebar.selectbox("Detection mode", ["mediapipe (fast, default)", "keras (accurate, optional)",
+                                              "hybrid (FaceMesh crops + keras model)"])
 model_path = st.sidebar.text_input("Keras model path (models/trained_model.h5)", value="models/trained_model.h5")
 api_key = st.sidebar.text_input("YouTube API Key (optional)", value="")
 start = st.sidebar.button("Start Webcam")
 stop = st.sidebar.button("Stop Webcam")
-skip_frames = st.sidebar.slider("Frame skip (1 = every frame, higher = faster)", 1, 6, 2)
+source = st.sidebar.text_input("Video source (camera index or video file)", value="0")
+target_latency = st.sidebar.slider("Target latency (ms)", 50, 500, 150, step=10)
+cpu_budget = st.sidebar.slider("Inference CPU budget", 0.1, 1.0, 0.7, step=0.05)
+max_faces = st.sidebar.slider("Faces (more than 1 = room mode)", 1, 8, 1,
+                              help="Classify every face; recommendations follow the room's overall emotion")
+preview_width = st.sidebar.select_slider("Preview width (px)", [320, 480, 640, 800, 960, 1280], value=640)
+preview_quality = st.sidebar.slider("Preview JPEG quality", 40, 95, 75, step=5)
+preview_fps = st.sidebar.slider("Preview fps cap", 5, 30, 15)
+stats_placeholder = st.sidebar.empty()
+# this session's panel; collection is process-wide and runs while any session shows timings
+show_timings = st.sidebar.checkbox("Show stage timings", value=metrics.forced)
+timings_placeholder = st.sidebar.empty()
+metrics.request(st.session_state.setdefault("metrics_viewer", metrics.viewer()), show_timings)
 
 st.title("🎵 TUNE TRAP — Emotion-aware music recommender")
 
@@ -34,52 +55,106 @@ with col2:
 if 'running' not in st.session_state:
     st.session_state['running'] = False
 
-detector = EmotionDetector(mode="keras" if mode.startswith("keras") else "mediapipe", keras_model_path=model_path if mode.startswith("keras") else None)
+detector_mode = mode.split()[0]
+keras_path = model_path if detector_mode != "mediapipe" else None
+# models are shared per file across sessions and load, warm up and validate in the background
+# (and again when the file changes); the detector itself is per run, see run_webcam. The path is
+# this session's own choice: other sessions keep theirs, and rolling back affects this file only.
+# The session holds the selected model and the one it served last (the fallback while a new one
+# loads); a path it moves away from is dropped, and closed unless another session still uses it.
+held = st.session_state.setdefault("held_model_paths", set())
+wanted = {p for p in (keras_path, st.session_state.get("served_model_path")) if p}
+for path in wanted - held:
+    registry.hold(path)
+for path in held - wanted:
+    registry.drop(path)
+st.session_state["held_model_paths"] = wanted
+models = registry.models(keras_path) if keras_path else None
+model_status = None
+if models is not None:
+    if st.sidebar.button("Roll back model", disabled=models.previous is None):
+        models.rollback()
+    model_status = ChangeSlot(st.sidebar.empty())
+    model_status.caption(models.format())
+
+recommender = get_recommendation_service(api_key, max_results=5, warm_emotions=EMOTIONS)
+# offline tracks rotate per session, not across everyone sharing the recommender
+rotation = st.session_state.setdefault("rotation", Rotation())
 
 def run_webcam():
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    reader = LatestFrameReader(source, ring_slots=6)
+    if not reader.isOpened():
         st.error("Could not open webcam. Make sure your webcam is connected and not used by another app.")
         return
-    history = []
-    frame_count = 0
+    # FaceMesh / face tracking state belongs to this run's stream only; released in `finally`,
+    # which also runs when a widget change interrupts the loop with a rerun
+    # until a newly chosen model is ready, the one this session used before keeps serving
+    detector = get_detector(mode=detector_mode, keras_model_path=keras_path, track=True, max_faces=max_faces,
+                            fallback_model_path=st.session_state.get("served_model_path"))
+    reader.start()
+    sched = AdaptiveScheduler(target_latency=target_latency / 1000.0, cpu_budget=cpu_budget,
+                              realtime=reader.realtime)
+    history = EmotionHistory(recent=10)
+    preview = Preview(frame_placeholder, width=preview_width, quality=preview_quality, max_fps=preview_fps)
+    stats_slot = ChangeSlot(stats_placeholder)
+    stream = EmotionStream(detector, multi_face=max_faces > 1)
+    result = None
+    panel_at = 0.0
+    first_frame = None
     try:
         while st.session_state['running']:
-            ret, frame = cap.read()
-            if not ret:
-                st.write("Failed to read from webcam.")
+            item = reader.read()
+            if item is None:
+                if reader.realtime:
+                    st.write("Failed to read from webcam.")
                 break
-            frame_count += 1
-            if frame_count % skip_frames != 0:
-                continue
-            label, conf, bbox = detector.detect(frame)
-            # annotate frame for display
-            display = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if bbox:
-                x,y,w,h = bbox
-                cv2.rectangle(display, (x,y), (x+w, y+h), (0,255,0), 2)
-            cv2.putText(display, f"{label} ({conf:.2f})", (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,0,0), 2)
-            frame_placeholder.image(display, channels="RGB")
-            emotion_placeholder.markdown(f"#### **{label.upper()}** — confidence: {conf:.2f}")
-            history.append(label)
-            if len(history) > 20:
-                history = history[-20:]
-            history_placeholder.write(", ".join(history[::-1][:10]))
-            # recommendations
-            try:
-                recs = get_youtube_recommendations(label, api_key, max_results=5)
-            except Exception as e:
-                recs = []
-            if recs:
-                md = ""
-                for title, link in recs:
-                    md += f"- [{title}]({link})  \n"
-                rec_placeholder.markdown(md, unsafe_allow_html=True)
-            else:
-                rec_placeholder.info("No recommendations (provide YouTube API key or use offline mode).")
-            time.sleep(0.03)
+            frame, captured_at = item.frame, item.captured_at
+            sched.record("capture", reader.capture_cost)
+            if result is None or sched.should_infer():
+                t0 = time.perf_counter()
+                result = stream.update(frame, rgb=item.rgb)
+                if not result.skipped:
+                    sched.record("detect", time.perf_counter() - t0)
+                history.observe(result.label)
+            label, conf, bbox = result.label, result.conf, result.bbox
+            with sched.stage("render"), timer("app.render"):
+                # downscaled, annotated and JPEG-encoded once; frames over the fps cap are not sent
+                with timer("app.st_image"):
+                    shown = preview.show(frame, label, conf, bbox, faces=result.faces)
+            # emotion, history and recommendations only change when the smoothed label does
+            if result.changed:
+                result = result._replace(changed=False)
+                who = f" — room of {len(result.faces)}" if result.faces else ""
+                emotion_placeholder.markdown(f"#### **{label.upper()}** — confidence: {conf:.2f}{who}")
+                history_placeholder.write(", ".join(list(history.changes)[::-1]) + "  \n" + history.summary())
+                with timer("app.recommend"):
+                    recs = recommender.get(label, conf, rotation=rotation)
+                if recs:
+                    md = ""
+                    for title, link in recs:
+                        md += f"- [{title}]({link})  \n"
+                    rec_placeholder.markdown(md, unsafe_allow_html=True)
+                else:
+                    rec_placeholder.info("No recommendations (provide YouTube API key or use offline mode).")
+            sched.frame_done(captured_at)
+            if first_frame is None:
+                first_frame = time.perf_counter() - _run_started
+                metrics.observe("app.first_frame", first_frame)
+            if shown:
+                if model_status is not None:
+                    model_status.caption(models.format())
+                copied = reader.ring.stats["bytes_copied"] if reader.ring else 0
+                stats_slot.markdown(sched.format() + f"  \ncopied {copied / 1e6:.1f} MB · "
+                                    f"first frame after {first_frame:.2f} s  \n" + preview.format())
+            if show_timings and time.perf_counter() - panel_at > 1.0:
+                panel_at = time.perf_counter()
+                timings_placeholder.markdown(metrics.format())
     finally:
-        cap.release()
+        if models is not None and models.ready:
+            st.session_state["served_model_path"] = keras_path
+        # the session's own hold keeps its models loaded; anything else nobody uses is closed
+        release_detector(detector, close_unused=True)
+        reader.release()
 
 if start:
     st.session_state['running'] = True
@@ -93,6 +168,7 @@ if stop:
 st.markdown("---")
 st.markdown("**Notes:**")
 st.markdown("- Default mode uses Mediapipe landmarks and heuristics (works out-of-the-box).")
-st.markdown("- Keras mode requires you to put a trained model at `models/trained_model.h5` (optional).")
+st.markdown("- Keras mode requires you to put a trained model at `models/trained_model.h5` (optional). "
+            "The model loads in the background and is reloaded when the file changes.")
 st.markdown("- If you do not provide a YouTube API key, the app will use safe offline recommendations.")
 st.markdown("- To run: `pip install -r requirements.txt` then `streamlit run app.py` in this folder.")
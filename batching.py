@@ -0,0 +1,91 @@
+# batching.py
+# Micro-batching front end for KerasEmotionModel.predict_batch.
+# Face crops submitted from any number of frames, faces or camera streams are
+# collected until either `max_batch` items are waiting or `max_latency` seconds
+# have passed since the first one arrived, then classified in a single model call.
+# Results come back through futures, so every caller gets its own answer in order.
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch, max_batch=16, max_latency=0.010):
+        self.predict_batch = predict_batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._q = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()  # orders submit() against close(): nothing lands after _STOP
+        self.stats = {"batches": 0, "items": 0, "max_batch_seen": 0}
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, face):
+        fut = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._q.put((face, fut))
+        return fut
+
+    def predict(self, face):
+        return self.submit(face).result()
+
+    def predict_many(self, faces):
+        futures = [self.submit(f) for f in faces]
+        return [f.result() for f in futures]
+
+    def _collect(self):
+        item = self._q.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._q.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            faces = [face for face, _ in batch]
+            try:
+                results = self.predict_batch(faces)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            results = list(results)
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(result)
+            for _, fut in batch[len(results):]:
+                fut.set_exception(RuntimeError(f"predict_batch returned {len(results)} results "
+                                               f"for {len(batch)} inputs"))
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+
+    def close(self):
+        # everything submitted before close() is still classified
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._q.put(_STOP)
+        self._thread.join()
@@ -0,0 +1,385 @@
+# benchmark.py
+# Reproducible performance benchmarks that need no webcam and no network.
+#   python benchmark.py                          # run everything, compare with benchmarks/baseline.json
+#   python benchmark.py --only haar mediapipe    # just these case groups
+#   python benchmark.py --save-baseline          # record this machine's numbers as the new baseline
+#   python benchmark.py --json results.json --tolerance 0.25
+# Inputs are deterministic: synthetic face-like frames drawn with OpenCV and a short clip
+# (benchmarks/clip.avi) rendered from them on first use, so numbers are comparable across
+# runs and commits. Keras mode uses a tiny generated model (cache/bench/tiny_model.h5) so
+# the measurement covers the detector plumbing rather than MobileNetV2. YouTube lookups run
+# against a stub client. Real inputs can be substituted with --image/--video.
+# Cases that time a model behind face detection only run when the input has a face the
+# detector finds; otherwise they would time detection alone under the model's name.
+# Each case reports p50/p95/mean latency and throughput. With a baseline present, any case
+# whose p50 is slower than baseline * (1 + tolerance), or that the baseline has but this run
+# could not measure (its group raised), is reported and the exit status is 1.
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = "benchmarks"
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+CLIP_PATH = os.path.join(BENCH_DIR, "clip.avi")
+CACHE_DIR = os.path.join("cache", "bench")
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720))
+
+
+def synthetic_frame(w=640, h=480, t=0, seed=0):
+    # a deterministic face-like drawing (skin ellipse, eyes, brows, mouth) on a noisy background
+    import cv2
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(40, 90, size=(h, w, 3), dtype=np.uint8)
+    s = min(w, h) / 480.0
+    cx = int(w / 2 + 40 * s * np.sin(t / 15.0))
+    cy = int(h / 2 + 10 * s * np.cos(t / 20.0))
+    fw, fh = int(110 * s), int(140 * s)
+    cv2.ellipse(frame, (cx, cy), (fw, fh), 0, 0, 360, (150, 180, 225), -1)
+    for dx in (-1, 1):
+        ex, ey = cx + dx * int(45 * s), cy - int(30 * s)
+        cv2.ellipse(frame, (ex, ey), (int(22 * s), int(10 * s)), 0, 0, 360, (250, 250, 250), -1)
+        cv2.circle(frame, (ex, ey), int(7 * s), (40, 30, 20), -1)
+        cv2.line(frame, (ex - int(25 * s), ey - int(25 * s)), (ex + int(25 * s), ey - int(28 * s)),
+                 (40, 50, 60), max(1, int(5 * s)))
+    cv2.line(frame, (cx, cy - int(5 * s)), (cx - int(8 * s), cy + int(30 * s)), (110, 130, 170), max(1, int(3 * s)))
+    mouth_open = int((6 + 6 * np.sin(t / 8.0)) * s)
+    cv2.ellipse(frame, (cx, cy + int(65 * s)), (int(38 * s), max(1, mouth_open)), 0, 0, 360, (60, 40, 120), -1)
+    return frame
+
+
+def ensure_clip(path=CLIP_PATH, frames=90, size=(640, 480), fps=30):
+    # rendered once from synthetic_frame and then reused (commit it to pin the input)
+    import cv2
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    for t in range(frames):
+        writer.write(synthetic_frame(size[0], size[1], t))
+    writer.release()
+    print(f"wrote {path} ({frames} frames)")
+    return path
+
+
+def ensure_tiny_model(path=os.path.join(CACHE_DIR, "tiny_model.h5"), num_classes=5):
+    # a few-kilobyte CNN with the production input shape; weights are seeded, not trained
+    if os.path.exists(path):
+        return path
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(224, 224, 3)),
+        tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu"),
+        tf.keras.layers.Conv2D(16, 3, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(num_classes, activation="softmax"),
+    ])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    model.save(path)
+    return path
+
+
+class StubYouTube:
+    # mimics googleapiclient's youtube.search().list(...).execute() with a fixed delay
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def search(self):
+        return self
+
+    def list(self, q="", maxResults=5, **kwargs):
+        self._q, self._n = q, maxResults
+        return self
+
+    def execute(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return {"items": [{"id": {"videoId": f"vid{i:03d}"}, "snippet": {"title": f"{self._q} #{i}"}}
+                          for i in range(self._n)]}
+
+
+def measure(fn, seconds=2.0, min_iters=5, max_iters=10000, warmup=3, items=1):
+    # calls fn() repeatedly for about `seconds`; items = units of work per call (frames, images)
+    for _ in range(warmup):
+        fn()
+    times = []
+    deadline = time.perf_counter() + seconds
+    while len(times) < max_iters and (len(times) < min_iters or time.perf_counter() < deadline):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    ms = 1000.0 * np.asarray(times)
+    return {"n": len(times), "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "mean_ms": float(ms.mean()), "per_s": float(items * len(ms) / (ms.sum() / 1000.0))}
+
+
+# -- cases -------------------------------------------------------------------------------
+
+def bench_mediapipe(args, frame):
+    from emotion_detector import MediapipeHeuristic
+    out = {}
+    for name, kwargs in (("mediapipe.predict", {}),
+                         ("mediapipe.predict[refine]", {"refine_landmarks": True}),
+                         ("mediapipe.predict[scale0.5]", {"input_scale": 0.5})):
+        model = MediapipeHeuristic(**kwargs)
+        try:
+            out[name] = measure(lambda: model.predict(frame), args.seconds)
+        finally:
+            model.close()
+    return out
+
+
+def bench_haar(args, frame):
+    import cv2
+    from emotion_detector import FaceTracker
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    out = {}
+    for w, h in RESOLUTIONS:
+        img = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+        full = FaceTracker(cascade)
+        out[f"haar.detect_full[{w}x{h}]"] = measure(lambda: full.detect_full(img), args.seconds)
+        # tracking only means something once there is a face to track; on an input without one
+        # locate() is a full detection every frame and would be timed under the wrong name
+        if len(full.detect_full(img)) == 0:
+            continue
+        tracked = FaceTracker(cascade, detect_every=10)
+        out[f"haar.locate_tracked[{w}x{h}]"] = measure(lambda: tracked.locate(img), args.seconds)
+    if not any(name.startswith("haar.locate_tracked") for name in out):
+        print("haar: no face found in the input, tracked cases skipped (pass --image with a real face)")
+    return out
+
+
+def bench_keras(args, frame):
+    from emotion_detector import EmotionDetector, KerasEmotionModel
+    path = args.model or ensure_tiny_model()
+    out = {}
+    model = KerasEmotionModel(model_path=path)
+    if model.model is None:
+        raise RuntimeError(f"could not load {path}")
+    face = frame[frame.shape[0] // 4: 3 * frame.shape[0] // 4, frame.shape[1] // 4: 3 * frame.shape[1] // 4]
+    model.warmup()
+    for batch in (1, 8):
+        faces = [face] * batch
+        out[f"keras.predict_batch[{batch}]"] = measure(lambda: model.predict_batch(faces), args.seconds, items=batch)
+    # detect() returns before the model when no face is found, so those timings would be
+    # detection only: keep a case only if its detector sees a face in the frame
+    for name, mode in (("keras.detect", "keras"), ("hybrid.detect", "hybrid")):
+        # hybrid: same model on FaceMesh-aligned crops instead of Haar boxes
+        detector = EmotionDetector(mode=mode, keras_model_path=path, track=mode == "keras").warmup()
+        try:
+            if detector.detect(frame)[2] is None:
+                print(f"{name}: no face found in the input, skipped (pass --image with a real face)")
+                continue
+            out[name] = measure(lambda: detector.detect(frame), args.seconds)
+        finally:
+            detector.close()
+    return out
+
+
+def clip_face_rate(clip):
+    # fraction of the clip's frames where a full Haar pass finds a face
+    import cv2
+    from emotion_detector import FaceTracker
+    tracker = FaceTracker(cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml"))
+    cap = cv2.VideoCapture(clip)
+    found = total = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        found += len(tracker.detect_full(frame)) > 0
+        total += 1
+    cap.release()
+    return found / max(total, 1)
+
+
+def bench_loop(args, frame):
+    # end-to-end: decode the clip, detect with smoothing, annotate, as app.py does per frame
+    import cv2
+    from emotion_detector import EmotionDetector
+    from emotion_stream import EmotionStream
+    from pipeline import annotate
+    from scheduler import LatestFrameReader
+    clip = args.video or ensure_clip()
+    out = {}
+    for mode in ("mediapipe", "keras"):
+        path = None
+        if mode == "keras":
+            if "keras" not in args.cases:
+                continue
+            path = args.model or ensure_tiny_model()
+            face_rate = clip_face_rate(clip)
+            if face_rate == 0:
+                # every frame would skip the model: this would time a Haar-only loop
+                print("loop.keras: no face found in the clip, skipped (pass --video with a real face)")
+                continue
+        detector = EmotionDetector(mode=mode, keras_model_path=path, track=True).warmup()
+        stream = EmotionStream(detector)
+
+        def run():
+            reader = LatestFrameReader(clip, realtime=False)
+            stream.reset()
+            while True:
+                item = reader.read()
+                if item is None:
+                    break
+                res = stream.update(item.frame)
+                annotate(item.frame, res.label, res.conf, res.bbox)
+            reader.release()
+
+        cap = cv2.VideoCapture(clip)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+        cap.release()
+        out[f"loop.{mode}"] = measure(run, args.seconds, min_iters=2, warmup=1, items=frames)
+        if mode == "keras":
+            # frames without a face skip the model; record how many ran it
+            out["loop.keras"]["face_rate"] = face_rate
+        detector.close()
+    return out
+
+
+def bench_recommendations(args, frame):
+    from recommender import RecommendationService
+    from utils import get_youtube_recommendations
+    stub = StubYouTube()
+    out = {"recommend.youtube_stub": measure(lambda: get_youtube_recommendations("happy", None, youtube=stub),
+                                             args.seconds)}
+    # cache hit path: what the app pays per label change once warmed
+    service = RecommendationService("stub-key", client=StubYouTube())
+    service.get("happy")
+    out["recommend.service_hit"] = measure(lambda: service.get("happy"), args.seconds)
+    return out
+
+
+CASES = {
+    "mediapipe": bench_mediapipe,
+    "haar": bench_haar,
+    "keras": bench_keras,
+    "loop": bench_loop,
+    "recommend": bench_recommendations,
+}
+
+
+# -- baseline comparison ----------------------------------------------------------------
+
+def environment():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    for mod in ("cv2", "mediapipe", "tensorflow", "numpy"):
+        m = sys.modules.get(mod)
+        if m is not None:
+            info[mod] = getattr(m, "__version__", "?")
+    return info
+
+
+def compare(results, baseline, tolerance, groups):
+    # (name, base p50, now p50, ratio) for every case slower than the tolerance allows, and
+    # (name, base p50, None, reason) for baselined cases of the groups that ran but have no result
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        if "p50_ms" not in base or not base["p50_ms"]:
+            continue
+        now = results.get(name)
+        if now is None:
+            group = base.get("group")
+            failed = [r["error"] for g, r in results.items() if g == group and "error" in r]
+            # baselines recorded before cases carried their group only count on a full run
+            if group in groups if group else set(groups) == set(CASES):
+                regressions.append((name, base["p50_ms"], None, failed[0] if failed else "not measured"))
+            continue
+        ratio = now["p50_ms"] / base["p50_ms"]
+        if ratio > 1.0 + tolerance:
+            regressions.append((name, base["p50_ms"], now["p50_ms"], ratio))
+    return regressions
+
+
+def print_table(results, baseline):
+    base = baseline.get("results", {}) if baseline else {}
+    print(f"\n{'case':<34} {'p50 ms':>9} {'p95 ms':>9} {'per s':>9} {'vs base':>8}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<34} skipped: {r['error']}")
+            continue
+        b = base.get(name, {}).get("p50_ms")
+        delta = f"{r['p50_ms'] / b:7.2f}x" if b else "       -"
+        print(f"{name:<34} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['per_s']:9.1f} {delta}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline benchmarks for detection, pipeline and recommendations.")
+    ap.add_argument("--only", nargs="+", default=None, choices=list(CASES), help="case groups to run")
+    ap.add_argument("--seconds", type=float, default=2.0, help="time budget per case")
+    ap.add_argument("--image", default=None, help="use this image instead of the synthetic frame")
+    ap.add_argument("--video", default=None, help="use this clip instead of benchmarks/clip.avi")
+    ap.add_argument("--model", default=None, help="keras model for the keras cases (default: tiny generated model)")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown before failing")
+    ap.add_argument("--json", default=None, help="also write the results to this file")
+    args = ap.parse_args()
+    args.cases = args.only or list(CASES)
+
+    import cv2
+    frame = cv2.imread(args.image) if args.image else synthetic_frame()
+    if frame is None:
+        print(f"could not read {args.image}")
+        return 2
+
+    results = {}
+    for group in args.cases:
+        t0 = time.perf_counter()
+        try:
+            cases = CASES[group](args, frame)
+            for r in cases.values():
+                r["group"] = group
+            results.update(cases)
+        except Exception as e:
+            # a missing optional dependency (e.g. TensorFlow) skips its cases instead of the run
+            results[group] = {"error": f"{type(e).__name__}: {e}"}
+        print(f"{group}: {time.perf_counter() - t0:.1f}s", flush=True)
+
+    report = {"created": time.time(), "environment": environment(), "seconds": args.seconds,
+              "inputs": {"image": args.image or "synthetic", "video": args.video or CLIP_PATH,
+                         "model": args.model or "tiny"},
+              "results": results}
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nsaved baseline to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"\nno baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    if baseline.get("environment", {}).get("platform") != report["environment"]["platform"]:
+        print("\nnote: baseline was recorded on a different platform")
+    regressions = compare(results, baseline, args.tolerance, args.cases)
+    if regressions:
+        print(f"\nREGRESSIONS (p50 slower than baseline by more than {args.tolerance:.0%}, or not measured):")
+        for name, b, n, ratio in regressions:
+            if n is None:
+                print(f"  {name}: {b:.2f} ms -> failed ({ratio})")
+            else:
+                print(f"  {name}: {b:.2f} ms -> {n:.2f} ms ({ratio:.2f}x)")
+        return 1
+    print(f"\nno regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# catalog.py
+# Offline recommendations from a local track catalog.
+#   python catalog.py data/catalog.csv                 # build (or refresh) the index
+#   python catalog.py data/catalog.csv --query happy --conf 0.8
+# The source is a CSV (header row) or JSON / JSON-lines file with title, artist, url and
+# per-track mood features (valence and energy in 0..1, as in common audio-feature exports).
+# It is compiled once into cache/catalog/<name>-<hash>/: a float32 feature matrix plus a
+# UTF-8 text blob with row offsets, all memory-mapped on open, so loading a catalog of
+# millions of rows costs a few page faults rather than a parse.
+# A detected emotion and its confidence map to a target point in mood space; the nearest
+# tracks come from one vectorized distance pass. The candidate pool per (emotion,
+# confidence) is cached, so repeat lookups only filter by artist diversity and skip tracks
+# served recently. The pool is bounded in mood space: once a listener has heard everything
+# close to the target the rotation starts over rather than drifting to other moods.
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+FEATURES = ("valence", "energy")
+# target (valence, energy) per emotion; angry gets calming music, as in utils.emotion_to_query
+MOODS = {
+    "happy": (0.85, 0.75),
+    "sad": (0.25, 0.30),
+    "angry": (0.55, 0.25),
+    "surprise": (0.70, 0.90),
+    "neutral": (0.55, 0.45),
+}
+INDEX_DIR = os.path.join("cache", "catalog")
+DEFAULT_CATALOG = os.environ.get("TUNETRAP_CATALOG", os.path.join("data", "catalog.csv"))
+SAMPLE_CATALOG = os.path.join("assets", "catalog_sample.csv")
+_SEP = "\x1f"
+
+
+def _read_rows(path):
+    if path.lower().endswith((".json", ".jsonl")):
+        with open(path, encoding="utf-8") as f:
+            first = f.read(1)
+            f.seek(0)
+            if first == "[":
+                yield from json.load(f)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def _index_dir_for(src, root=INDEX_DIR):
+    name = os.path.splitext(os.path.basename(src))[0]
+    return os.path.join(root, f"{name}-{hashlib.sha1(os.path.abspath(src).encode()).hexdigest()[:8]}")
+
+
+def build_index(src, index_dir, features=FEATURES, chunk=65536):
+    # streams the source into the on-disk layout; rows missing a feature are skipped
+    os.makedirs(index_dir, exist_ok=True)
+    feats_path = os.path.join(index_dir, "features.f32")
+    text_path = os.path.join(index_dir, "text.bin")
+    rows = skipped = 0
+    offsets = [0]
+    buf = []
+    with open(feats_path + ".tmp", "wb") as ff, open(text_path + ".tmp", "wb") as tf:
+        for row in _read_rows(src):
+            try:
+                vec = [float(row[k]) for k in features]
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            text = _SEP.join(str(row.get(k) or "") for k in ("title", "artist", "url")).encode("utf-8")
+            tf.write(text)
+            offsets.append(offsets[-1] + len(text))
+            buf.append(vec)
+            rows += 1
+            if len(buf) >= chunk:
+                ff.write(np.asarray(buf, dtype=np.float32).tobytes())
+                buf = []
+        if buf:
+            ff.write(np.asarray(buf, dtype=np.float32).tobytes())
+    np.asarray(offsets, dtype=np.int64).tofile(os.path.join(index_dir, "offsets.i64"))
+    os.replace(feats_path + ".tmp", feats_path)
+    os.replace(text_path + ".tmp", text_path)
+    st = os.stat(src)
+    meta = {"source": os.path.abspath(src), "size": st.st_size, "mtime": st.st_mtime_ns,
+            "rows": rows, "features": list(features)}
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    print(f"Indexed {rows} tracks from {src}" + (f" ({skipped} rows without {'/'.join(features)} skipped)"
+                                                   if skipped else ""))
+    return meta
+
+
+class Catalog:
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.features = self.meta["features"]
+        n, d = self.meta["rows"], len(self.features)
+        self.matrix = (np.memmap(os.path.join(index_dir, "features.f32"), dtype=np.float32, mode="r", shape=(n, d))
+                       if n else np.zeros((0, d), dtype=np.float32))
+        self.offsets = np.memmap(os.path.join(index_dir, "offsets.i64"), dtype=np.int64, mode="r")
+        self.text = (np.memmap(os.path.join(index_dir, "text.bin"), dtype=np.uint8, mode="r")
+                     if self.offsets[-1] else np.zeros(0, dtype=np.uint8))
+
+    @classmethod
+    def open(cls, src, root=INDEX_DIR, features=FEATURES):
+        # (re)builds the index when the source file changed since it was compiled
+        index_dir = _index_dir_for(src, root)
+        meta_path = os.path.join(index_dir, "meta.json")
+        st = os.stat(src)
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        if (meta is None or meta["size"] != st.st_size or meta["mtime"] != st.st_mtime_ns
+                or meta["features"] != list(features)):
+            build_index(src, index_dir, features)
+        return cls(index_dir)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def track(self, i):
+        # (title, artist, url) of row i
+        raw = bytes(self.text[self.offsets[i]:self.offsets[i + 1]])
+        title, artist, url = raw.decode("utf-8").split(_SEP)
+        return title, artist, url
+
+    def target(self, emotion, conf=1.0):
+        # low confidence pulls the target towards neutral
+        mood = np.asarray(MOODS.get(emotion.lower(), MOODS["neutral"]), dtype=np.float32)
+        neutral = np.asarray(MOODS["neutral"], dtype=np.float32)
+        c = float(np.clip(conf, 0.0, 1.0))
+        t = neutral + c * (mood - neutral)
+        # feature columns beyond the mood space are left unconstrained
+        out = np.full(len(self.features), np.nan, dtype=np.float32)
+        for j, name in enumerate(FEATURES):
+            if name in self.features:
+                out[self.features.index(name)] = t[j]
+        return out
+
+    def nearest(self, target, n, max_dist=None, min_n=0):
+        # indices of the n rows closest to target, nearest first; with max_dist, rows farther
+        # than that are dropped except for the min_n nearest (so sparse catalogs still answer)
+        cols = ~np.isnan(target)
+        diff = self.matrix[:, cols] - target[cols]
+        dist = np.einsum("ij,ij->i", diff, diff)
+        n = min(n, len(dist))
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        idx = np.argpartition(dist, n - 1)[:n] if n < len(dist) else np.arange(len(dist))
+        idx = idx[np.argsort(dist[idx], kind="stable")]
+        if max_dist is not None:
+            keep = dist[idx] <= max_dist * max_dist
+            keep[:min_n] = True
+            idx = idx[keep]
+        return idx
+
+
+class Rotation:
+    # the tracks one listener was served recently, so the next answer moves on to others. The
+    # recommender is shared by every session; each session keeps its own Rotation.
+    def __init__(self, size=50):
+        self.recent = deque(maxlen=size)
+        self.seen = set()
+
+    def __contains__(self, row):
+        return row in self.seen
+
+    def add(self, row):
+        if len(self.recent) == self.recent.maxlen:
+            self.seen.discard(self.recent[0])
+        self.recent.append(row)
+        self.seen.add(row)
+
+    def clear(self):
+        self.recent.clear()
+        self.seen.clear()
+
+
+class CatalogRecommender:
+    # drop-in offline backend: get(emotion, conf) -> [(title, url), ...] like RecommendationService
+    def __init__(self, catalog, k=5, pool=40, max_distance=0.25, max_per_artist=1, recent=50, conf_step=0.1,
+                 max_pools=64):
+        # pool / max_distance: candidates per lookup, and how far (in valence/energy) from the
+        # target they may be; the k nearest are always candidates
+        self.catalog = catalog
+        self.k = k
+        self.pool = pool
+        self.max_distance = max_distance
+        self.max_per_artist = max_per_artist
+        self.conf_step = conf_step
+        self.max_pools = max_pools
+        self._rotation = Rotation(recent)  # for callers that do not pass their own
+        self._pools = OrderedDict()  # (emotion, conf bucket) -> [(row, title, artist, url)]
+        self._lock = threading.Lock()
+
+    def _candidates(self, emotion, conf):
+        key = (emotion, round(round(conf / self.conf_step) * self.conf_step, 3))
+        pool = self._pools.get(key)
+        if pool is None:
+            rows = self.catalog.nearest(self.catalog.target(emotion, key[1]), self.pool,
+                                        max_dist=self.max_distance, min_n=self.k)
+            pool = [(int(i),) + self.catalog.track(int(i)) for i in rows]
+            self._pools[key] = pool
+            while len(self._pools) > self.max_pools:
+                self._pools.popitem(last=False)
+        else:
+            self._pools.move_to_end(key)
+        return pool
+
+    def recommend(self, emotion, conf=1.0, k=None, rotation=None):
+        k = k or self.k
+        recent = self._rotation if rotation is None else rotation
+        with self._lock:
+            pool = self._candidates(emotion.lower(), conf)
+            picked, per_artist = [], {}
+            for relax, fresh_only in ((False, True), (True, True), (True, False)):
+                # later passes only if diversity, then recency, filtering left fewer than k
+                if not fresh_only:
+                    # everything nearby was served recently: start the rotation over
+                    recent.clear()
+                for row, title, artist, url in pool:
+                    if len(picked) >= k:
+                        break
+                    if (fresh_only and row in recent) or any(row == p[0] for p in picked):
+                        continue
+                    if not relax and artist and per_artist.get(artist, 0) >= self.max_per_artist:
+                        continue
+                    per_artist[artist] = per_artist.get(artist, 0) + 1
+                    picked.append((row, title, artist, url))
+                if len(picked) >= k:
+                    break
+            for p in picked:
+                recent.add(p[0])
+        return [(f"{title} — {artist}" if artist else title, url) for _, title, artist, url in picked]
+
+    def get(self, emotion, conf=1.0, rotation=None):
+        return self.recommend(emotion, conf, rotation=rotation)
+
+
+_recommenders = {}
+_recommenders_lock = threading.Lock()
+
+
+def load_catalog(path=None, **kwargs):
+    # process-wide CatalogRecommender for `path` (default: $TUNETRAP_CATALOG, data/catalog.csv,
+    # then the bundled sample), or None when there is no catalog file
+    if path is None:
+        path = next((p for p in (DEFAULT_CATALOG, SAMPLE_CATALOG) if os.path.exists(p)), None)
+    if not path or not os.path.exists(path):
+        return None
+    with _recommenders_lock:
+        rec = _recommenders.get(path)
+        if rec is None:
+            try:
+                rec = _recommenders[path] = CatalogRecommender(Catalog.open(path), **kwargs)
+            except (OSError, ValueError) as e:
+                print(f"Could not load music catalog {path}: {e}")
+                return None
+        return rec
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build and query the local music catalog index.")
+    ap.add_argument("catalog", nargs="?", default=None)
+    ap.add_argument("--query", default=None, help="emotion to recommend for")
+    ap.add_argument("--conf", type=float, default=1.0)
+    ap.add_argument("-k", type=int, default=5)
+    args = ap.parse_args()
+    rec = load_catalog(args.catalog)
+    if rec is None:
+        print("No catalog found: pass a CSV/JSON file or create data/catalog.csv.")
+        return
+    print(f"{len(rec.catalog)} tracks, features {rec.catalog.features}")
+    if args.query:
+        for title, url in rec.recommend(args.query, args.conf, args.k):
+            print(f"- {title}  {url}")
+
+
+if __name__ == "__main__":
+    main()
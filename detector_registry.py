@@ -0,0 +1,120 @@
+# detector_registry.py
+# Process-wide registry of shared emotion models.
+# Streamlit re-executes the app script on every widget interaction, but imported modules stay
+# loaded, so models kept here survive reruns and are shared by all sessions instead of being
+# loaded again for each one. Only the read-only part is shared: one ModelManager (keras /
+# tflite weights, hot-swapped in place) per model file. Everything with per-stream state --
+# FaceMesh tracking, the Haar face tracker, face ids -- lives in the EmotionDetector a session
+# acquires for itself and releases when it stops. Since several sessions or pipeline workers
+# classify on the same manager, their crops are micro-batched into shared model calls.
+import os
+import threading
+
+from emotion_detector import EmotionDetector
+from model_manager import ModelManager
+
+
+class DetectorRegistry:
+    def __init__(self, batch_latency=0.004):
+        # batch_latency: how long a crop may wait for crops from other streams (see batching.py)
+        self.batch_latency = batch_latency
+        self._models = {}  # abs model path -> [ModelManager, refcount]
+        self._held = {}  # id(detector) -> model paths it holds a reference to
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path):
+        return os.path.abspath(path)
+
+    def _entry(self, path, watch=True):
+        # under self._lock: [ModelManager, refcount] for `path`, created on first use; loading runs
+        # on the manager's own background thread (one per file), so nothing slow happens here
+        key = self.key(path)
+        entry = self._models.get(key)
+        if entry is None:
+            entry = self._models[key] = [ModelManager(path, watch=watch, batch_latency=self.batch_latency), 0]
+            entry[0].request()
+        return entry
+
+    def models(self, path, watch=True):
+        # the shared ModelManager for `path`, without taking a reference to it
+        with self._lock:
+            return self._entry(path, watch)[0]
+
+    def hold(self, path):
+        # like models(), but counted as in use (as a detector on it would be) until drop(path);
+        # for callers that keep a manager across calls, e.g. a session's model status panel
+        with self._lock:
+            entry = self._entry(path)
+            entry[1] += 1
+            return entry[0]
+
+    def drop(self, path, close_unused=True):
+        # undoes hold(path); by default the manager is closed once nothing else uses it
+        self._unref([self.key(path)], close_unused)
+
+    def _unref(self, keys, close_unused):
+        unused = []
+        with self._lock:
+            for key in keys:
+                entry = self._models.get(key)
+                if entry is None:
+                    continue
+                entry[1] = max(0, entry[1] - 1)
+                if close_unused and entry[1] == 0:
+                    unused.append(self._models.pop(key)[0])
+        for models in unused:
+            models.close()
+
+    def acquire(self, mode="mediapipe", keras_model_path=None, fallback_model_path=None, wait=False,
+                **options):
+        # a new detector for one session / stream, on the shared model for keras_model_path.
+        # fallback_model_path (e.g. the session's previous model) keeps serving until that model
+        # is ready; wait=True blocks until it has loaded instead.
+        models = fallback = None
+        paths = []
+        # references are taken up front, so a concurrent drop() cannot close the managers meanwhile
+        if mode != "mediapipe" and keras_model_path:
+            models = self.hold(keras_model_path)
+            paths.append(self.key(keras_model_path))
+            if fallback_model_path and self.key(fallback_model_path) != paths[0] and not wait:
+                fallback = self.hold(fallback_model_path)
+                paths.append(self.key(fallback_model_path))
+        try:
+            if wait and models is not None:
+                models.wait()
+            detector = EmotionDetector(mode=mode, models=models, fallback_models=fallback, **options).warmup()
+        except BaseException:
+            self._unref(paths, close_unused=False)
+            raise
+        with self._lock:
+            self._held[id(detector)] = paths
+        return detector
+
+    def release(self, detector, close_unused=False):
+        # closes the session's detector; shared models stay loaded for the next session unless
+        # close_unused is set and nobody else uses them
+        detector.close()
+        with self._lock:
+            keys = self._held.pop(id(detector), ())
+        self._unref(keys, close_unused)
+
+    def close(self):
+        with self._lock:
+            entries, self._models, self._held = list(self._models.values()), {}, {}
+        for models, _ in entries:
+            models.close()
+
+    def __len__(self):
+        return len(self._models)
+
+
+registry = DetectorRegistry()
+
+
+def get_detector(mode="mediapipe", keras_model_path=None, **options):
+    return registry.acquire(mode=mode, keras_model_path=keras_model_path, **options)
+
+
+def release_detector(detector, close_unused=False):
+    registry.release(detector, close_unused=close_unused)
@@ -1,110 +1,627 @@
+# Heavy dependencies load on first use: MediaPipe when a MediapipeHeuristic is built,
+# TensorFlow (or tflite_runtime) when a model file is loaded. Importing this module only
+# costs OpenCV and NumPy.
 import cv2
 import numpy as np
-import mediapipe as mp
 import os
+import threading
+import weakref
+from collections import namedtuple
+
+from metrics import timer
+from model_manager import GOLDEN_DIR, ModelManager
 
 EMOTIONS = ["neutral", "happy", "sad", "surprise", "angry"]
 
+# distance features as (landmark a, landmark b, normalise by "w" or "h")
+LANDMARK_FEATURES = {
+    "mouth_open": (13, 14, "h"),    # top lip / bottom lip
+    "eye_open": (159, 145, "h"),    # left eye top / bottom
+    "brow_dist": (10, 338, "w"),    # brow inner / outer
+}
+
+# one face of a multi-face detection; face_id is stable across frames while the face stays in view
+FaceResult = namedtuple("FaceResult", "label conf bbox face_id")
+
+# forehead, chin, left / right cheek: enough for a face box without reading all 468 landmarks
+BBOX_LANDMARKS = (10, 152, 234, 454)
+# outer / inner corner of the eye on the image left, then the image right: the eye line for crops
+EYE_LANDMARKS = (33, 133, 362, 263)
+
+class LandmarkFeatures:
+    # Gathers every landmark the features need into one (K, 2) array in a single pass and
+    # computes all distances in one vectorized step. `compute` also accepts stacked
+    # (N, K, 2) arrays, so offline scoring of many frames is one NumPy call.
+    def __init__(self, features=LANDMARK_FEATURES):
+        self.names = list(features)
+        self.indices = sorted({i for a, b, _ in features.values() for i in (a, b)})
+        pos = {idx: k for k, idx in enumerate(self.indices)}
+        self._a = np.array([pos[a] for a, _, _ in features.values()])
+        self._b = np.array([pos[b] for _, b, _ in features.values()])
+        self._by_h = np.array([axis == "h" for _, _, axis in features.values()])
+
+    def gather(self, landmarks):
+        # landmarks: a mediapipe NormalizedLandmarkList.landmark sequence -> normalized (K, 2)
+        return np.array([(landmarks[i].x, landmarks[i].y) for i in self.indices], dtype=np.float32)
+
+    def compute(self, points, w, h):
+        # points: (..., K, 2) normalized coordinates -> (..., F) features in self.names order
+        # w, h: frame size, either scalars or arrays matching the leading dims of points
+        w = np.asarray(w, dtype=np.float32)
+        h = np.asarray(h, dtype=np.float32)
+        size = np.stack([w, h], axis=-1)[..., None, :]
+        px = np.trunc(np.asarray(points, dtype=np.float32) * size)
+        d = px[..., self._a, :] - px[..., self._b, :]
+        dist = np.sqrt(np.einsum("...i,...i->...", d, d))
+        return dist / np.where(self._by_h, h[..., None], w[..., None])
+
+    def classify(self, features):
+        # vectorized heuristic thresholds (tuned for typical webcams); returns (labels, confidences)
+        f = np.atleast_2d(features)
+        mouth_open = f[:, self.names.index("mouth_open")]
+        eye_open = f[:, self.names.index("eye_open")]
+        brow_dist = f[:, self.names.index("brow_dist")]
+        conds = [mouth_open > 0.035,
+                 (eye_open < 0.007) & (brow_dist > 0.02),
+                 (mouth_open > 0.02) & (eye_open > 0.008)]
+        labels = np.select(conds, ["surprise", "angry", "happy"], default="neutral")
+        confs = np.select(conds, [mouth_open, 1.0 - eye_open, mouth_open], default=0.35)
+        return labels, confs
+
+    def score(self, points, w, h):
+        labels, confs = self.classify(self.compute(points, w, h))
+        return [(str(l), float(c)) for l, c in zip(labels, confs)]
+
 class MediapipeHeuristic:
-    def __init__(self):
+    def __init__(self, refine_landmarks=False, input_scale=1.0, static_image_mode=False, max_faces=1):
+        # refine_landmarks adds the iris model, which none of the features use
+        # input_scale < 1 runs FaceMesh on a downscaled frame; landmarks are normalized so features are unchanged
+        # static_image_mode=True for unrelated still images (evaluation), False for video tracking
+        import mediapipe as mp
+        self.input_scale = input_scale
+        self.features = LandmarkFeatures()
         self.mp_face = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face.FaceMesh(static_image_mode=False, max_num_faces=1,
-                                               refine_landmarks=True, min_detection_confidence=0.5,
+        self.face_mesh = self.mp_face.FaceMesh(static_image_mode=static_image_mode, max_num_faces=max_faces,
+                                               refine_landmarks=refine_landmarks, min_detection_confidence=0.5,
                                                min_tracking_confidence=0.5)
 
-    def predict(self, frame):
+    def _faces(self, frame, rgb=None):
+        # FaceMesh landmark lists of every face found (possibly empty)
+        # rgb: an already converted copy of `frame` (e.g. from a FrameRing slot) to skip cvtColor
+        with timer("mediapipe.convert"):
+            if rgb is None:
+                small = frame
+                if self.input_scale != 1.0:
+                    small = cv2.resize(frame, None, fx=self.input_scale, fy=self.input_scale, interpolation=cv2.INTER_AREA)
+                rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+            elif self.input_scale != 1.0:
+                rgb = cv2.resize(rgb, None, fx=self.input_scale, fy=self.input_scale, interpolation=cv2.INTER_AREA)
+        with timer("mediapipe.facemesh"):
+            res = self.face_mesh.process(rgb)
+        return res.multi_face_landmarks or []
+
+    def landmarks(self, frame, rgb=None):
+        # normalized (K, 2) feature landmarks of the first face, or None
+        faces = self._faces(frame, rgb)
+        if not faces:
+            return None
+        return self.features.gather(faces[0].landmark)
+
+    def predict(self, frame, rgb=None):
         h, w = frame.shape[:2]
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        res = self.face_mesh.process(rgb)
-        if not res.multi_face_landmarks:
+        points = self.landmarks(frame, rgb)
+        if points is None:
             return "neutral", 0.0
+        with timer("mediapipe.features"):
+            return self.features.score(points, w, h)[0]
+
+    def analyze(self, frame, rgb=None):
+        # one FaceMesh pass -> [(label, conf, bbox, geometry)] for every face: the heuristic result
+        # plus BBOX_LANDMARKS + EYE_LANDMARKS in pixels, enough for align_face() to cut a crop
+        h, w = frame.shape[:2]
+        faces = self._faces(frame, rgb)
+        if not faces:
+            return []
+        with timer("mediapipe.features"):
+            points = np.stack([self.features.gather(f.landmark) for f in faces])
+            labels, confs = self.features.classify(self.features.compute(points, w, h))
+            geo = np.array([[(f.landmark[i].x, f.landmark[i].y) for i in BBOX_LANDMARKS + EYE_LANDMARKS]
+                            for f in faces], dtype=np.float32) * np.array([w, h], dtype=np.float32)
+            ext = geo[:, :len(BBOX_LANDMARKS)]
+            lo = np.clip(ext.min(axis=1), 0, [w - 1, h - 1]).astype(int)
+            hi = np.clip(ext.max(axis=1), 0, [w - 1, h - 1]).astype(int)
+        return [(str(l), float(c), (int(x0), int(y0), int(x1 - x0), int(y1 - y0)), g)
+                for l, c, (x0, y0), (x1, y1), g in zip(labels, confs, lo, hi, geo)]
+
+    def predict_all(self, frame, rgb=None):
+        # [(label, conf, bbox)] for every face; features for all faces are scored in one NumPy call
+        return [(label, conf, bbox) for label, conf, bbox, _ in self.analyze(frame, rgb)]
 
-        lm = res.multi_face_landmarks[0].landmark
-        def p(i):
-            return np.array([int(lm[i].x * w), int(lm[i].y * h)])
-
-        # Simple heuristics using mediapipe face mesh indices
-        top_lip = p(13)
-        bottom_lip = p(14)
-        mouth_open = np.linalg.norm(top_lip - bottom_lip) / h
-
-        left_eye_top = p(159)
-        left_eye_bottom = p(145)
-        eye_open = np.linalg.norm(left_eye_top - left_eye_bottom) / h
-
-        brow_inner = p(10)
-        brow_outer = p(338)
-        brow_dist = np.linalg.norm(brow_inner - brow_outer) / w
-
-        # heuristics thresholds (tuned for typical webcams)
-        if mouth_open > 0.035:
-            return "surprise", float(mouth_open)
-        if eye_open < 0.007 and brow_dist > 0.02:
-            return "angry", 1.0 - float(eye_open)
-        if mouth_open > 0.02 and eye_open > 0.008:
-            return "happy", float(mouth_open)
-        # fallback neutral
-        return "neutral", 0.35
+    def warmup(self, shape=(480, 640, 3)):
+        self.predict(np.zeros(shape, dtype=np.uint8))
+
+    def close(self):
+        self.face_mesh.close()
+
+_keras_models = {}  # abs path -> (mtime, weak reference to the model)
+_keras_models_lock = threading.Lock()
+
+def load_keras_model(model_path):
+    # loaded models are read-only at inference time, so one instance per file is shared process-wide.
+    # The cache only holds them weakly: once every KerasEmotionModel using one is closed (e.g. by
+    # ModelManager.close or a hot swap) the weights can be freed.
+    key = os.path.abspath(model_path)
+    mtime = os.path.getmtime(model_path)
+    with _keras_models_lock:
+        cached = _keras_models.get(key)
+        model = cached[1]() if cached is not None and cached[0] == mtime else None
+        if model is not None:
+            return model
+        from tensorflow.keras.models import load_model
+        model = load_model(model_path)
+        _keras_models[key] = (mtime, weakref.ref(model))
+        print("Loaded Keras model:", model_path)
+        return model
 
 class KerasEmotionModel:
+    kind, runtime = "Keras", "TensorFlow"  # for log messages
+
     def __init__(self, model_path=None, target_size=(224,224), labels=EMOTIONS):
         self.model_path = model_path
         self.target_size = target_size
         self.labels = labels
         self.model = None
+        self.load_error = None  # why self.model is None, for status displays
+        self._batch_buf = None
+        self._batch_lock = threading.Lock()
         try:
-            from tensorflow.keras.models import load_model
             if model_path and os.path.exists(model_path):
-                self.model = load_model(model_path)
-                print("Loaded Keras model:", model_path)
+                self.model = self._load(model_path)
             else:
-                print("Keras model path not found or not provided. Keras mode will not run.")
+                self.load_error = f"model file not found: {model_path}"
+                print(f"{self.kind} model path not found or not provided. Keras mode will not run.")
         except Exception as e:
-            print("TensorFlow not available or failed to load model:", e)
+            print(f"{self.runtime} not available or failed to load model:", e)
+            self.load_error = str(e)
             self.model = None
 
+    def _load(self, model_path):
+        # loader hook: the model object for an existing file, or raise
+        return load_keras_model(model_path)
+
     def preprocess_face(self, face_bgr):
-        import cv2
-        from tensorflow.keras.preprocessing.image import img_to_array
         face_rgb = cv2.cvtColor(face_bgr, cv2.COLOR_BGR2RGB)
         face_resized = cv2.resize(face_rgb, self.target_size)
-        face_array = img_to_array(face_resized)
-        face_array = face_array.astype("float") / 255.0
+        face_array = face_resized.astype(np.float32) * (1.0 / 255.0)
         return np.expand_dims(face_array, axis=0)
 
-    def predict(self, face_bgr):
-        if self.model is None:
-            return "neutral", 0.0
-        x = self.preprocess_face(face_bgr)
-        preds = self.model.predict(x)
+    def preprocess_batch(self, faces):
+        # writes straight into a reused float32 tensor instead of allocating per face
+        n = len(faces)
+        w, h = self.target_size
+        if self._batch_buf is None or self._batch_buf.shape[0] < n:
+            self._batch_buf = np.empty((max(n, 8), h, w, 3), dtype=np.float32)
+        x = self._batch_buf[:n]
+        for i, face_bgr in enumerate(faces):
+            resized = cv2.resize(face_bgr, self.target_size)
+            x[i] = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+        x *= 1.0 / 255.0
+        return x
+
+    def _decode(self, preds):
         idx = int(np.argmax(preds))
-        prob = float(np.max(preds))
+        prob = float(preds[idx])
         label = self.labels[idx] if idx < len(self.labels) else str(idx)
         return label, prob
 
+    def predict_proba(self, faces):
+        # raw (N, classes) model outputs for a non-empty batch; the model must be loaded
+        with self._batch_lock:
+            with timer("keras.preprocess"):
+                x = self.preprocess_batch(faces)
+            with timer("keras.infer"):
+                # a direct call skips the per-call overhead of model.predict (callbacks, tf.data wrapping)
+                return np.asarray(self.model(x, training=False))
+
+    def predict_batch(self, faces):
+        if self.model is None:
+            return [("neutral", 0.0)] * len(faces)
+        if len(faces) == 0:
+            return []
+        return [self._decode(p) for p in self.predict_proba(faces)]
+
+    def predict(self, face_bgr):
+        return self.predict_batch([face_bgr])[0]
+
+    def warmup(self):
+        # one dummy inference traces the graph so the first real face does not pay for it
+        if self.model is not None:
+            self.predict(np.zeros((self.target_size[1], self.target_size[0], 3), dtype=np.uint8))
+
+    def close(self):
+        self.model = None
+
+def _load_tflite_interpreter(model_path, num_threads=None):
+    # prefer the standalone runtime (a few MB) over importing all of TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+class TFLiteEmotionModel(KerasEmotionModel):
+    # same preprocessing and labels as KerasEmotionModel, backed by a (optionally int8) TFLite file
+    kind, runtime = "TFLite", "TFLite runtime"
+
+    def __init__(self, model_path=None, target_size=(224,224), labels=EMOTIONS, num_threads=None):
+        self.num_threads = num_threads
+        self._batch_size = None
+        super().__init__(model_path, target_size=target_size, labels=labels)
+
+    def _load(self, model_path):
+        model = _load_tflite_interpreter(model_path, num_threads=self.num_threads)
+        model.allocate_tensors()
+        self._input = model.get_input_details()[0]
+        self._output = model.get_output_details()[0]
+        print("Loaded TFLite model:", model_path)
+        return model
+
+    def _quantize(self, x):
+        scale, zero_point = self._input["quantization"]
+        if self._input["dtype"] == np.float32 or scale == 0:
+            return x
+        info = np.iinfo(self._input["dtype"])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(self._input["dtype"])
+
+    def _dequantize(self, y):
+        scale, zero_point = self._output["quantization"]
+        if self._output["dtype"] == np.float32 or scale == 0:
+            return y
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict_proba(self, faces):
+        with self._batch_lock:
+            with timer("tflite.preprocess"):
+                x = self.preprocess_batch(faces)
+            if self._batch_size != len(faces):
+                self.model.resize_tensor_input(self._input["index"], x.shape)
+                self.model.allocate_tensors()
+                self._batch_size = len(faces)
+            with timer("tflite.infer"):
+                self.model.set_tensor(self._input["index"], self._quantize(x))
+                self.model.invoke()
+                return self._dequantize(self.model.get_tensor(self._output["index"]))
+
+def tflite_path_for(model_path):
+    return os.path.splitext(model_path)[0] + ".tflite"
+
+def _exported_from(tflite_path, model_path):
+    # True if the .tflite is at least as new as the .h5, i.e. not left over from an older model
+    try:
+        return os.path.getmtime(tflite_path) >= os.path.getmtime(model_path)
+    except OSError:
+        return os.path.exists(tflite_path)
+
+def load_emotion_model(model_path):
+    # a .tflite artifact next to the .h5 (written by export_model.py) wins -- it avoids importing
+    # TensorFlow -- unless the .h5 was retrained after the export
+    if model_path and model_path.endswith(".tflite"):
+        return TFLiteEmotionModel(model_path=model_path)
+    tflite = tflite_path_for(model_path) if model_path else None
+    if tflite and os.path.exists(tflite) and _exported_from(tflite, model_path):
+        model = TFLiteEmotionModel(model_path=tflite)
+        if model.model is not None:
+            return model
+    return KerasEmotionModel(model_path=model_path)
+
+def align_face(frame, geometry, size=(224, 224), pad=0.1):
+    # geometry: one face's BBOX_LANDMARKS + EYE_LANDMARKS pixel points (see MediapipeHeuristic.analyze)
+    # Rotates about the face centre so the eye line is level and cuts a padded square straight
+    # into a size[0] x size[1] crop: one warpAffine instead of rotate + crop + resize. The square
+    # side comes from forehead-chin and cheek-cheek distances, so head roll does not shrink the face.
+    top, chin, left, right = geometry[:4]
+    eyes = geometry[4:]
+    dx, dy = eyes[2:].mean(axis=0) - eyes[:2].mean(axis=0)
+    angle = float(np.degrees(np.arctan2(dy, dx)))
+    cx, cy = geometry[:4].mean(axis=0)
+    side = max(float(np.linalg.norm(chin - top)), float(np.linalg.norm(right - left)), 1.0) * (1.0 + 2 * pad)
+    M = cv2.getRotationMatrix2D((float(cx), float(cy)), angle, size[0] / side)
+    M[0, 2] += size[0] / 2.0 - cx
+    M[1, 2] += size[1] / 2.0 - cy
+    return cv2.warpAffine(frame, M, tuple(size), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+class FaceTracker:
+    # Detect-then-track face localization for keras mode.
+    # A full Haar pass (optionally on a downscaled frame) runs every `detect_every` frames
+    # or after `max_misses` failed tracking steps; in between only a padded ROI around the
+    # last box is searched, resized so the face is about `track_face_size` pixels wide.
+    # The last box and miss count describe one stream: never share a tracker between streams.
+    def __init__(self, cascade, detect_every=10, detect_width=None, roi_pad=0.5,
+                 track_face_size=96, min_size=60, max_misses=2, min_iou=0.3):
+        self.cascade = cascade
+        self.detect_every = max(1, detect_every)
+        self.detect_width = detect_width
+        self.roi_pad = roi_pad
+        self.track_face_size = track_face_size
+        self.min_size = min_size
+        self.max_misses = max_misses
+        self.min_iou = min_iou
+        self.reset()
+
+    def reset(self):
+        self.bbox = None
+        self.misses = 0
+        self.since_detect = 0
+        self.stats = {"full": 0, "tracked": 0, "lost": 0}
+
+    def _run_cascade(self, bgr, scale, min_size):
+        if scale != 1.0:
+            bgr = cv2.resize(bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        m = max(20, int(min_size * scale))
+        with timer("haar.detect"):
+            faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(m, m))
+        inv = 1.0 / scale
+        return [tuple(int(round(v * inv)) for v in b) for b in faces]
+
+    def detect_full(self, frame):
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.detect_width / w) if self.detect_width else 1.0
+        self.stats["full"] += 1
+        return self._run_cascade(frame, scale, self.min_size)
+
+    def _track(self, frame):
+        return self.track(frame, self.bbox)
+
+    def track(self, frame, bbox):
+        # searches the padded ROI around `bbox` only; the box it most overlaps, or None if lost
+        H, W = frame.shape[:2]
+        x, y, w, h = bbox
+        px, py = int(w * self.roi_pad), int(h * self.roi_pad)
+        x0, y0 = max(0, x - px), max(0, y - py)
+        x1, y1 = min(W, x + w + px), min(H, y + h + py)
+        roi = frame[y0:y1, x0:x1]
+        scale = min(1.0, self.track_face_size / max(w, 1))
+        min_size = int(min(w, h) * 0.6)
+        boxes = [(bx + x0, by + y0, bw, bh) for bx, by, bw, bh in self._run_cascade(roi, scale, min_size)]
+        self.stats["tracked"] += 1
+        if not boxes:
+            return None
+        best = max(boxes, key=lambda b: _iou(b, bbox))
+        return best if _iou(best, bbox) >= self.min_iou else None
+
+    def locate(self, frame):
+        # returns (x, y, w, h) of the tracked face or None
+        self.since_detect += 1
+        need_full = (self.bbox is None or self.misses > self.max_misses
+                     or self.since_detect >= self.detect_every)
+        if not need_full:
+            box = self._track(frame)
+            if box is not None:
+                self.bbox, self.misses = box, 0
+                return box
+            self.misses += 1
+            if self.misses <= self.max_misses:
+                # keep the last box for a couple of frames rather than flickering to "no face"
+                return self.bbox
+            self.stats["lost"] += 1
+        faces = self.detect_full(frame)
+        self.since_detect = 0
+        if not faces:
+            self.bbox, self.misses = None, 0
+            return None
+        self.bbox = max(faces, key=lambda b: b[2] * b[3])
+        self.misses = 0
+        return self.bbox
+
+class FaceIds:
+    # stable face ids across frames: greedy IoU matching against the previous frame's boxes
+    def __init__(self, min_iou=0.3, max_age=5):
+        self.min_iou = min_iou
+        self.max_age = max_age
+        self.tracks = {}  # id -> [bbox, frames since last match]
+        self._next = 1
+
+    def reset(self):
+        self.tracks.clear()
+
+    def assign(self, boxes):
+        pairs = sorted(((_iou(b, t[0]), i, tid) for i, b in enumerate(boxes) for tid, t in self.tracks.items()),
+                       reverse=True)
+        ids = [None] * len(boxes)
+        used = set()
+        for iou, i, tid in pairs:
+            if iou < self.min_iou:
+                break
+            if ids[i] is None and tid not in used:
+                ids[i] = tid
+                used.add(tid)
+        for tid in list(self.tracks):
+            if tid not in used:
+                self.tracks[tid][1] += 1
+                if self.tracks[tid][1] > self.max_age:
+                    del self.tracks[tid]
+        for i, b in enumerate(boxes):
+            if ids[i] is None:
+                ids[i] = self._next
+                self._next += 1
+            self.tracks[ids[i]] = [b, 0]
+        return ids
+
+def room_emotion(faces, min_weight=0.1):
+    # room-level (label, share): confidence-weighted vote over all faces, like EmotionStream's smoothing
+    scores = {}
+    for f in faces:
+        scores[f.label] = scores.get(f.label, 0.0) + max(f.conf, min_weight)
+    if not scores:
+        return "neutral", 0.0
+    label = max(scores, key=scores.get)
+    return label, scores[label] / sum(scores.values())
+
 class EmotionDetector:
-    def __init__(self, mode="mediapipe", keras_model_path=None):
+    def __init__(self, mode="mediapipe", keras_model_path=None, track=False, detect_every=10,
+                 detect_width=None, refine_landmarks=False, input_scale=1.0, max_faces=1,
+                 load_async=False, watch_model=False, golden_dir=GOLDEN_DIR, models=None, fallback_models=None,
+                 static_image_mode=False):
+        # max_faces > 1 enables detect_faces() for group settings; detect() still reports one face
+        # mode "hybrid": FaceMesh finds and aligns the face for the keras/tflite model, and its
+        # heuristic result from the same pass is used while no model is loaded
+        # keras / hybrid models live in self.models (model_manager.ModelManager): load_async loads
+        # in the background instead of in the constructor, watch_model reloads on file changes.
+        # models: a ModelManager shared with other detectors (see detector_registry), used instead
+        # of loading keras_model_path and not closed with this detector; fallback_models serves
+        # until it is ready. Everything else here is per-stream state and is never shared.
+        # static_image_mode=True: consecutive frames are unrelated (e.g. a pool serving many
+        # clients), so nothing is tracked from one frame to the next.
         self.mode = mode
-        if mode == "mediapipe":
-            self.detector = MediapipeHeuristic()
-        elif mode == "keras":
-            self.detector = KerasEmotionModel(model_path=keras_model_path)
-        else:
-            raise ValueError("mode must be 'mediapipe' or 'keras'")
-        # Haar cascade for face crop (used in keras mode)
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-
-    def detect(self, frame):
+        self.max_faces = max_faces
+        self.static_image_mode = static_image_mode
+        track = track and not static_image_mode
+        self.track = track
+        self.detect_every = max(1, detect_every)
+        self.face_ids = FaceIds()
+        self._boxes = []
+        self._since_detect = 0
+        self.detector = None
+        self.models = models
+        self.fallback_models = fallback_models
+        self._owns_models = False
+        if mode in ("mediapipe", "hybrid"):
+            self.detector = MediapipeHeuristic(refine_landmarks=refine_landmarks, input_scale=input_scale,
+                                               static_image_mode=static_image_mode, max_faces=max_faces)
+        elif mode != "keras":
+            raise ValueError("mode must be 'mediapipe', 'keras' or 'hybrid'")
+        if mode in ("keras", "hybrid") and self.models is None:
+            self._owns_models = True
+            self.models = ModelManager(keras_model_path, loader=load_emotion_model, golden_dir=golden_dir,
+                                       watch=watch_model)
+            if load_async:
+                if keras_model_path:
+                    self.models.request()
+            else:
+                self.models.load_now()
+        # Haar cascade for face crop (keras mode only; loading the XML is not free)
+        self.face_cascade = None
+        self.tracker = None
+        if mode == "keras":
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            self.tracker = FaceTracker(self.face_cascade, detect_every=detect_every if track else 1,
+                                       detect_width=detect_width)
+        # one stream per detector, but pools (api_server) hand a detector to several threads in turn
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        # models are warmed up by the ModelManager before they are swapped in
+        with self._lock:
+            if self.detector is not None:
+                self.detector.warmup()
+        return self
+
+    def close(self):
+        with self._lock:
+            if self.detector is not None:
+                self.detector.close()
+            if self.models is not None and self._owns_models:
+                self.models.close()
+
+    def reset(self):
+        # forget per-stream tracking state (Haar face track, face ids, reused multi-face boxes)
+        # before this detector is pointed at another stream; a detector follows one stream at a
+        # time, so sessions each get their own (detector_registry.acquire)
+        with self._lock:
+            if self.tracker is not None:
+                self.tracker.reset()
+            self.face_ids.reset()
+            self._boxes = []
+            self._since_detect = 0
+
+    def _active_models(self):
+        # the model this detector was set up with once it is ready; until then the fallback
+        fallback = self.fallback_models
+        if fallback is not None:
+            if self.models.ready or not fallback.ready:
+                self.fallback_models = None
+            else:
+                return fallback
+        return self.models
+
+    def status(self):
+        # for status panels and /healthz: the serving model's version, load time and any load error
+        out = {"mode": self.mode, "max_faces": self.max_faces}
+        if self.models is not None:
+            out["model"] = self._active_models().status()
+        return out
+
+    def detect(self, frame, rgb=None):
+        with self._lock, timer("detector.detect"):
+            return self._detect(frame, rgb)
+
+    def _detect(self, frame, rgb=None):
         if self.mode == "mediapipe":
-            label, conf = self.detector.predict(frame)
+            label, conf = self.detector.predict(frame, rgb=rgb)
             return label, conf, None
+        if self.mode == "hybrid":
+            found = self._hybrid(frame, rgb, limit=1)
+            return found[0] if found else ("neutral", 0.0, None)
         # keras mode: detect face and run model (if present)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(60,60))
-        if len(faces) == 0:
+        bbox = self.tracker.locate(frame)
+        if bbox is None:
             return "neutral", 0.0, None
-        faces = sorted(faces, key=lambda b: b[2]*b[3], reverse=True)
-        (x, y, w, h) = faces[0]
-        face = frame[y:y+h, x:x+w].copy()
-        label, conf = self.detector.predict(face)
+        (x, y, w, h) = bbox
+        face = frame[y:y+h, x:x+w]
+        label, conf = self._active_models().predict_batch([face])[0]
         return label, conf, (x, y, w, h)
+
+    def detect_faces(self, frame, rgb=None):
+        # [FaceResult] for up to max_faces faces, largest first
+        with self._lock, timer("detector.detect_faces"):
+            if self.mode == "mediapipe":
+                found = self.detector.predict_all(frame, rgb=rgb)
+            elif self.mode == "hybrid":
+                found = self._hybrid(frame, rgb, limit=self.max_faces)
+            else:
+                boxes = self._multi_boxes(frame)
+                # one batched model call for all crops
+                preds = self._active_models().predict_batch([frame[y:y+h, x:x+w] for x, y, w, h in boxes])
+                found = [(label, conf, box) for (label, conf), box in zip(preds, boxes)]
+            found.sort(key=lambda r: -r[2][2] * r[2][3])
+            found = found[:self.max_faces]
+            if self.static_image_mode:
+                self.face_ids = FaceIds()
+            ids = self.face_ids.assign([r[2] for r in found])
+            return [FaceResult(label, conf, bbox, fid) for (label, conf, bbox), fid in zip(found, ids)]
+
+    def _hybrid(self, frame, rgb=None, limit=1):
+        # [(label, conf, bbox)] of the `limit` largest faces from a single FaceMesh pass
+        faces = sorted(self.detector.analyze(frame, rgb), key=lambda r: -r[2][2] * r[2][3])[:limit]
+        models = self._active_models()
+        if not faces or not models.ready:
+            # no model (missing file / not loaded yet): the heuristic result costs nothing extra
+            return [(label, conf, bbox) for label, conf, bbox, _ in faces]
+        with timer("hybrid.align"):
+            crops = [align_face(frame, geo, models.target_size) for _, _, _, geo in faces]
+        preds = models.predict_batch(crops)
+        return [(label, conf, bbox) for (label, conf), (_, _, bbox, _) in zip(preds, faces)]
+
+    def _multi_boxes(self, frame):
+        # with track=True the full Haar pass runs every detect_every frames; in between each face
+        # is re-located in a small ROI around its last box, like FaceTracker.locate does for one.
+        # Losing any face falls back to a full pass, which also picks up faces that came into view.
+        self._since_detect += 1
+        if self.track and self._boxes and self._since_detect < self.detect_every:
+            boxes = [self.tracker.track(frame, box) for box in self._boxes]
+            if all(b is not None for b in boxes):
+                self._boxes = boxes
+                return boxes
+        self._boxes = self.tracker.detect_full(frame)
+        self._since_detect = 0
+        return self._boxes
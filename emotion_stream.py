@@ -0,0 +1,104 @@
+# emotion_stream.py
+# Stream-level state machine around EmotionDetector.detect.
+# - skips inference when a tiny grayscale probe of the frame has barely changed
+# - smooths raw labels with a confidence-weighted majority over a deque window
+# - only emits a new label after it has won `hysteresis` consecutive updates
+# - with multi_face=True every face is classified (EmotionDetector.detect_faces) and the
+#   room-level aggregate is what gets smoothed; per-face results ride along in result.faces
+# Downstream code (recommendations, UI) should react to `result.changed` only.
+from collections import deque, namedtuple
+
+import cv2
+import numpy as np
+
+from emotion_detector import room_emotion
+
+StreamResult = namedtuple("StreamResult", "label conf bbox changed skipped raw_label raw_conf faces",
+                          defaults=(None,))
+
+
+class EmotionStream:
+    def __init__(self, detector, window=8, hysteresis=3, motion_threshold=3.0, max_skip=10,
+                 probe_size=(32, 24), min_weight=0.1, multi_face=False):
+        self.detector = detector
+        self.multi_face = multi_face
+        self.window = deque(maxlen=window)
+        self.hysteresis = hysteresis
+        self.motion_threshold = motion_threshold
+        self.max_skip = max_skip
+        self.probe_size = probe_size
+        self.min_weight = min_weight
+        self.reset()
+
+    def reset(self):
+        self.window.clear()
+        self.label = None
+        self.conf = 0.0
+        self._candidate = None
+        self._candidate_runs = 0
+        self._probe = None
+        self._skipped_in_row = 0
+        self._last = ("neutral", 0.0, None, None)
+        self.stats = {"frames": 0, "inferences": 0, "skipped": 0, "changes": 0}
+        # tracking state in the detector belongs to the stream too
+        if self.detector is not None and hasattr(self.detector, "reset"):
+            self.detector.reset()
+
+    def _motion(self, frame):
+        # mean absolute difference of a tiny grayscale thumbnail; inf when there is nothing to compare
+        small = cv2.resize(frame, self.probe_size, interpolation=cv2.INTER_AREA)
+        probe = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+        prev, self._probe = self._probe, probe
+        if prev is None:
+            return float("inf")
+        return float(np.mean(np.abs(probe - prev)))
+
+    def _smoothed(self):
+        scores = {}
+        for label, conf in self.window:
+            scores[label] = scores.get(label, 0.0) + max(conf, self.min_weight)
+        label = max(scores, key=scores.get)
+        total = sum(scores.values())
+        return label, scores[label] / total
+
+    def update(self, frame, rgb=None):
+        self.stats["frames"] += 1
+        still = (self.motion_threshold > 0 and self._motion(frame) < self.motion_threshold
+                 and self._skipped_in_row < self.max_skip)
+        if still:
+            self._skipped_in_row += 1
+            self.stats["skipped"] += 1
+        else:
+            self._skipped_in_row = 0
+            self.stats["inferences"] += 1
+            if self.multi_face:
+                faces = self.detector.detect_faces(frame, rgb=rgb)
+                raw_label, raw_conf = room_emotion(faces, self.min_weight)
+                self._last = (raw_label, raw_conf, faces[0].bbox if faces else None, faces)
+            else:
+                self._last = self.detector.detect(frame, rgb=rgb) + (None,)
+        raw_label, raw_conf, bbox, faces = self._last
+        return self.observe(raw_label, raw_conf, bbox, skipped=still, faces=faces)
+
+    def observe(self, raw_label, raw_conf, bbox=None, skipped=False, faces=None):
+        # feed an externally computed detection (e.g. from a pipeline worker) through the smoother
+        self.window.append((raw_label, raw_conf))
+        top, share = self._smoothed()
+
+        changed = False
+        if self.label is None:
+            self.label, changed = top, True
+        elif top != self.label:
+            if top == self._candidate:
+                self._candidate_runs += 1
+            else:
+                self._candidate, self._candidate_runs = top, 1
+            if self._candidate_runs >= self.hysteresis:
+                self.label, changed = top, True
+        else:
+            self._candidate, self._candidate_runs = None, 0
+        if changed:
+            self._candidate, self._candidate_runs = None, 0
+            self.stats["changes"] += 1
+        self.conf = share if top == self.label else self.conf
+        return StreamResult(self.label, self.conf, bbox, changed, skipped, raw_label, raw_conf, faces)
@@ -0,0 +1,170 @@
+# export_model.py
+# Export the trained Keras model to TFLite (optionally int8-quantized) and, when
+# tf2onnx is installed, to ONNX. EmotionDetector picks up `<model>.tflite` next to
+# the .h5 automatically, so keras mode no longer needs full TensorFlow at runtime.
+#   python export_model.py --model models/trained_model.h5 --int8 --check
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from emotion_detector import KerasEmotionModel, TFLiteEmotionModel, tflite_path_for
+
+VAL_DIR = "data/val"
+IMG_SIZE = (224,224)
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def iter_labeled_images(data_dir, limit=None):
+    # yields (path, class_index), class indices in the order flow_from_directory uses (sorted
+    # folders). Classes are interleaved round-robin, so a `limit` takes a balanced, deterministic
+    # sample instead of the first class or two.
+    classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    per_class = []
+    for label in classes:
+        folder = os.path.join(data_dir, label)
+        per_class.append([os.path.join(folder, n) for n in sorted(os.listdir(folder))
+                          if n.lower().endswith(IMAGE_EXTS)])
+    count = 0
+    for i in range(max(map(len, per_class), default=0)):
+        for idx, paths in enumerate(per_class):
+            if i >= len(paths):
+                continue
+            yield paths[i], idx
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+def load_rgb(path, size=IMG_SIZE):
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    return cv2.cvtColor(cv2.resize(img, size), cv2.COLOR_BGR2RGB)
+
+
+def representative_dataset(data_dir=VAL_DIR, samples=100):
+    def gen():
+        for path, _ in iter_labeled_images(data_dir, limit=samples):
+            img = load_rgb(path)
+            if img is not None:
+                yield [np.expand_dims(img.astype(np.float32) / 255.0, axis=0)]
+    return gen
+
+
+def export_tflite(model, out_path, int8=False, data_dir=VAL_DIR, samples=100):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if int8:
+        if not os.path.exists(data_dir):
+            raise FileNotFoundError(f"int8 quantization needs representative images in {data_dir}")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(data_dir, samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    with open(out_path, "wb") as f:
+        f.write(converter.convert())
+    print("Saved TFLite model to", out_path, "(int8)" if int8 else "(float32)")
+    return out_path
+
+
+def export_onnx(model, out_path):
+    try:
+        import tf2onnx
+    except ImportError:
+        print("tf2onnx not installed; skipping ONNX export.")
+        return None
+    import tensorflow as tf
+    spec = (tf.TensorSpec((None, IMG_SIZE[1], IMG_SIZE[0], 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=out_path)
+    print("Saved ONNX model to", out_path)
+    return out_path
+
+
+def export_all(model, h5_path, int8=False, onnx=False, data_dir=VAL_DIR):
+    paths = [export_tflite(model, tflite_path_for(h5_path), int8=int8, data_dir=data_dir)]
+    if onnx:
+        paths.append(export_onnx(model, os.path.splitext(h5_path)[0] + ".onnx"))
+    return paths
+
+
+def _evaluate(backend, data_dir, limit, batch):
+    correct = total = 0
+    elapsed = 0.0
+    preds = []
+    images, targets = [], []
+
+    def flush():
+        nonlocal correct, total, elapsed
+        t0 = time.perf_counter()
+        results = backend.predict_batch(images)
+        elapsed += time.perf_counter() - t0
+        for (label, _), target in zip(results, targets):
+            idx = backend.labels.index(label) if label in backend.labels else -1
+            preds.append(idx)
+            correct += int(idx == target)
+            total += 1
+        images.clear()
+        targets.clear()
+
+    for path, target in iter_labeled_images(data_dir, limit=limit):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        images.append(img)
+        targets.append(target)
+        if len(images) == batch:
+            flush()
+    if images:
+        flush()
+    return {"accuracy": correct / max(total, 1), "ms_per_image": 1000.0 * elapsed / max(total, 1),
+            "n": total, "preds": preds}
+
+
+def parity_check(h5_path, tflite_path=None, data_dir=VAL_DIR, limit=500, batch=16):
+    # labels are class indices in sorted-folder order, matching how train_emotion.py trained the head
+    classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    reference = KerasEmotionModel(model_path=h5_path, labels=classes)
+    candidate = TFLiteEmotionModel(model_path=tflite_path or tflite_path_for(h5_path), labels=classes)
+    if reference.model is None or candidate.model is None:
+        raise RuntimeError("parity check needs both the .h5 and the .tflite model")
+    reference.warmup()
+    candidate.warmup()
+    ref = _evaluate(reference, data_dir, limit, batch)
+    cand = _evaluate(candidate, data_dir, limit, batch)
+    agree = sum(a == b for a, b in zip(ref["preds"], cand["preds"])) / max(ref["n"], 1)
+    report = {
+        "images": ref["n"],
+        "h5_accuracy": ref["accuracy"], "tflite_accuracy": cand["accuracy"],
+        "accuracy_delta": cand["accuracy"] - ref["accuracy"],
+        "h5_ms_per_image": ref["ms_per_image"], "tflite_ms_per_image": cand["ms_per_image"],
+        "latency_delta_ms": cand["ms_per_image"] - ref["ms_per_image"],
+        "agreement": agree,
+    }
+    for k, v in report.items():
+        print(f"{k:>22}: {v:.4f}" if isinstance(v, float) else f"{k:>22}: {v}")
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export the emotion model to lightweight runtimes.")
+    ap.add_argument("--model", default="models/trained_model.h5")
+    ap.add_argument("--int8", action="store_true", help="full-integer quantization using data/val images")
+    ap.add_argument("--onnx", action="store_true", help="also export ONNX (requires tf2onnx)")
+    ap.add_argument("--data", default=VAL_DIR)
+    ap.add_argument("--check", action="store_true", help="report accuracy/latency deltas against the .h5")
+    ap.add_argument("--limit", type=int, default=500)
+    args = ap.parse_args()
+
+    from tensorflow.keras.models import load_model
+    model = load_model(args.model)
+    export_all(model, args.model, int8=args.int8, onnx=args.onnx, data_dir=args.data)
+    if args.check:
+        parity_check(args.model, data_dir=args.data, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# frame_ring.py
+# Preallocated shared-memory frame ring between capture and its consumers.
+# Capture decodes straight into a slot (cv2.VideoCapture.read(image=...)) and does the
+# single BGR->RGB conversion into the same slot; the detector (MediaPipe wants RGB) and the
+# renderer both reuse it. Consumers get read-only views; a consumer that keeps a frame past the
+# next write lease()s it, and the writer skips leased slots until they are released. A per-slot
+# sequence number still tells a consumer whether the writer lapped an unleased slot. Leases are
+# per process: an attached ring in another process only has the sequence check.
+# `bytes_copied` counts every full-frame copy the ring had to make (ideally zero).
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+RingFrame = namedtuple("RingFrame", "seq slot bgr rgb captured_at")
+
+_HEADER_FIELDS = 2  # seq, captured_at (float64 bits)
+
+
+def _readonly(a):
+    v = a.view()
+    v.flags.writeable = False
+    return v
+
+
+class FrameRing:
+    def __init__(self, shape, slots=4, name=None, create=True):
+        # shape is (H, W, 3); pass name/create=False to attach from another process
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.shape))
+        header_bytes = slots * _HEADER_FIELDS * 8
+        size = header_bytes + 2 * slots * frame_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.owner = create
+        buf = self.shm.buf
+        self._header = np.ndarray((slots, _HEADER_FIELDS), dtype=np.float64, buffer=buf)
+        self._bgr = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=header_bytes)
+        self._rgb = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf,
+                               offset=header_bytes + slots * frame_bytes)
+        if create:
+            self._header[:] = 0
+        self._seq = 0
+        self._next = 0
+        self._leased = [0] * slots  # lease count per slot
+        self._lock = threading.Lock()
+        self.stats = {"writes": 0, "conversions": 0, "bytes_copied": 0, "torn": 0}
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def attach(cls, name, shape, slots):
+        return cls(shape, slots=slots, name=name, create=False)
+
+    def _publish(self, slot, captured_at):
+        self._seq += 1
+        self._header[slot] = (self._seq, captured_at)
+        self.stats["writes"] += 1
+        return self._seq
+
+    def _claim(self):
+        # next slot in round-robin order that no consumer holds; marked as being rewritten.
+        # With every slot leased the oldest is reused and its readers see is_current() fail.
+        with self._lock:
+            slot = self._next
+            for i in range(self.slots):
+                candidate = (self._next + i) % self.slots
+                if not self._leased[candidate]:
+                    slot = candidate
+                    break
+            self._next = (slot + 1) % self.slots
+            self._header[slot, 0] = 0
+        return slot
+
+    def write_from(self, cap, captured_at):
+        # decode the next frame from `cap` directly into the ring; returns the new seq or None
+        slot = self._claim()
+        bgr = self._bgr[slot]
+        ret, frame = cap.read(image=bgr)
+        if not ret or frame is None:
+            return None
+        if frame.shape != self.shape:
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=bgr)
+        elif frame.ctypes.data != bgr.ctypes.data:
+            # backend ignored the output buffer (some do); fall back to one copy
+            np.copyto(bgr, frame)
+            self.stats["bytes_copied"] += bgr.nbytes
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=self._rgb[slot])
+        self.stats["conversions"] += 1
+        return self._publish(slot, captured_at)
+
+    def write(self, frame, captured_at):
+        # for producers that already hold a decoded frame (costs one copy)
+        slot = self._claim()
+        np.copyto(self._bgr[slot], frame)
+        self.stats["bytes_copied"] += frame.nbytes
+        cv2.cvtColor(self._bgr[slot], cv2.COLOR_BGR2RGB, dst=self._rgb[slot])
+        self.stats["conversions"] += 1
+        return self._publish(slot, captured_at)
+
+    def get(self, seq):
+        slot = self.slot_of(seq)
+        if slot is None:
+            return None
+        return RingFrame(seq, slot, _readonly(self._bgr[slot]), _readonly(self._rgb[slot]),
+                         float(self._header[slot, 1]))
+
+    def latest(self):
+        seq = int(self._header[:, 0].max())
+        return self.get(seq) if seq else None
+
+    def slot_of(self, seq):
+        # slot currently holding `seq`, or None once it has been overwritten
+        hits = np.flatnonzero(self._header[:, 0] == seq) if seq else ()
+        return int(hits[0]) if len(hits) else None
+
+    def is_current(self, seq):
+        # False if the writer reused the slot while the consumer was reading it
+        ok = self.slot_of(seq) is not None
+        if not ok:
+            self.stats["torn"] += 1
+        return ok
+
+    def lease(self, seq):
+        # the frame for `seq`, pinned until release(); None if it was already overwritten
+        with self._lock:
+            slot = self.slot_of(seq)
+            if slot is None:
+                return None
+            self._leased[slot] += 1
+        return self.get(seq)
+
+    def release(self, frame):
+        with self._lock:
+            self._leased[frame.slot] = max(0, self._leased[frame.slot] - 1)
+
+    def close(self):
+        self._header = self._bgr = self._rgb = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,189 @@
+# metrics.py
+# Per-stage latency instrumentation shared by the detectors, the recommender and the app loops.
+#   from metrics import timer
+#   with timer("mediapipe.facemesh"):
+#       res = face_mesh.process(rgb)
+# Every stage name gets a fixed-bucket histogram (log-spaced, 50 us .. ~100 s) from which
+# p50/p95/p99 are read; exports are a JSON snapshot or Prometheus text (api_server.py serves
+# both at /metrics). Collection is off unless TUNETRAP_METRICS=1 or enable() is called, or
+# some viewer (one Streamlit session's "Show stage timings") asks for it via request();
+# while off, timer() returns one shared no-op context manager, so an instrumented call costs
+# an attribute check. The histograms themselves are process-wide: every session sees the same
+# numbers, and one session turning its panel off does not stop collection for the others.
+import bisect
+import json
+import os
+import threading
+import time
+import weakref
+
+# upper bounds in milliseconds: 0.05 ms * 2^(i/2), about 41% apart
+BUCKETS_MS = tuple(round(0.05 * 2 ** (i / 2), 4) for i in range(43))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def quantile(self, q):
+        # linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                hi = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(self.max, lo + (hi - lo) * (rank - seen) / c)
+            seen += c
+        return self.max
+
+    def snapshot(self):
+        out = {"count": self.count, "mean_ms": self.total / self.count if self.count else 0.0,
+               "max_ms": self.max}
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}_ms"] = self.quantile(q)
+        return out
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "t0")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Viewer:
+    # a token for one party that wants timings collected; see Metrics.request
+    __slots__ = ("__weakref__",)
+
+
+class Metrics:
+    def __init__(self, enabled=False, bounds=BUCKETS_MS):
+        self.enabled = enabled
+        self.forced = enabled  # set by the environment / enable(), independent of viewers
+        self._viewers = weakref.WeakSet()
+        self.bounds = bounds
+        self._hists = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def viewer(self):
+        return Viewer()
+
+    def request(self, viewer, on=True):
+        # collection runs while it is forced or any live viewer wants it. Viewers are held
+        # weakly, so a session that is gone stops counting at the next request from anyone.
+        with self._lock:
+            if on:
+                self._viewers.add(viewer)
+            else:
+                self._viewers.discard(viewer)
+            self.enabled = self.forced or len(self._viewers) > 0
+        return self.enabled
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else NULL_TIMER
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._hists.get(name)
+            if hist is None:
+                hist = self._hists[name] = Histogram(self.bounds)
+            hist.observe(1000.0 * seconds)
+
+    def reset(self):
+        with self._lock:
+            self._hists.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            stages = {name: h.snapshot() for name, h in sorted(self._hists.items())}
+        return {"enabled": self.enabled, "since": self.started, "stages": stages}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def prometheus_text(self, metric="tunetrap_stage_seconds"):
+        lines = [f"# HELP {metric} Latency of instrumented pipeline stages.", f"# TYPE {metric} histogram"]
+        with self._lock:
+            hists = sorted(self._hists.items())
+            for name, h in hists:
+                cum = 0
+                for bound, c in zip(h.bounds, h.counts):
+                    cum += c
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{bound / 1000.0:g}"}} {cum}')
+                lines.append(f'{metric}_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {h.total / 1000.0:.6f}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    def format(self, prefix=None):
+        # markdown table for the Streamlit overlay panel
+        stages = self.snapshot()["stages"]
+        rows = [(n, s) for n, s in stages.items() if prefix is None or n.startswith(prefix)]
+        if not rows:
+            return "no samples yet" if self.enabled else "stage timings are off"
+        lines = ["| stage | n | p50 ms | p95 ms | p99 ms |", "|---|---:|---:|---:|---:|"]
+        for name, s in rows:
+            lines.append(f"| {name} | {s['count']} | {s['p50_ms']:.1f} | {s['p95_ms']:.1f} | {s['p99_ms']:.1f} |")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.to_json(indent=2))
+        os.replace(tmp, path)
+
+
+metrics = Metrics(enabled=os.environ.get("TUNETRAP_METRICS", "") not in ("", "0"))
+
+
+def timer(name):
+    return metrics.timer(name)
+
+
+def enable(on=True):
+    metrics.forced = on
+    metrics.enabled = on or len(metrics._viewers) > 0
+    return metrics
@@ -0,0 +1,350 @@
+# model_manager.py
+# Versioned, hot-swappable emotion models for EmotionDetector (keras and hybrid modes).
+# A new model file -- another path picked in the sidebar, or models/trained_model.h5 rewritten
+# by train_emotion.py and noticed by the file watcher -- is loaded on a background thread:
+# load, warm up, check the outputs, score a small golden set, then swap the reference in a
+# single assignment, so a frame in flight finishes on the model it started with and the next
+# frame uses the new one. Until then the current version keeps serving. A load or validation
+# failure leaves it in place, with the reason in status(); the previous version is kept for
+# rollback(), which also happens automatically if a freshly swapped-in model raises.
+#   python model_manager.py models/trained_model.h5 --golden data/golden
+import argparse
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+GOLDEN_DIR = os.path.join("data", "golden")  # data/golden/<label>/*.jpg, like data/val
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_golden(root=GOLDEN_DIR, per_class=8):
+    # [(bgr image, label)], a few per class folder; empty when the directory does not exist
+    items = []
+    if not root or not os.path.isdir(root):
+        return items
+    for label in sorted(os.listdir(root)):
+        folder = os.path.join(root, label)
+        if not os.path.isdir(folder):
+            continue
+        names = sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTS))[:per_class]
+        for name in names:
+            img = cv2.imread(os.path.join(folder, name))
+            if img is not None:
+                items.append((img, label))
+    return items
+
+
+def file_signature(path):
+    # (mtime_ns, size) of the model file and of the .tflite next to it, which load_emotion_model prefers
+    from emotion_detector import tflite_path_for
+    sig = []
+    for p in (path, tflite_path_for(path)) if path else ():
+        try:
+            st = os.stat(p)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+class ModelManager:
+    def __init__(self, path=None, loader=None, golden_dir=GOLDEN_DIR, per_class=8, max_drop=0.1,
+                 min_accuracy=0.0, watch=False, poll=2.0, probation=100, batch_latency=None, max_batch=16):
+        # max_drop: reject a model scoring this much below the current one on the golden set
+        # probation: inference calls after a swap during which an exception rolls back
+        # batch_latency: for a manager shared by several detectors, crops submitted by all of them
+        # within this many seconds go through one model call (batching.MicroBatcher)
+        if loader is None:
+            from emotion_detector import load_emotion_model as loader
+        self.path = path
+        self.loader = loader
+        self.golden_dir = golden_dir
+        self.per_class = per_class
+        self.max_drop = max_drop
+        self.min_accuracy = min_accuracy
+        self.poll = poll
+        self.probation = probation
+        self.current = None
+        self.version = None  # dict describing self.current, see _load
+        self.previous = None  # (model, version) kept for rollback
+        self.state = "empty"
+        self.last_error = None
+        self._versions = 0
+        self._calls = 0
+        self._golden = None
+        self._pending = None
+        self._rejected = set()  # file signatures that failed validation or were rolled back
+        self._loader_thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.batcher = None
+        if batch_latency is not None:
+            from batching import MicroBatcher
+            self.batcher = MicroBatcher(self._predict_batch, max_batch=max_batch, max_latency=batch_latency)
+        if watch:
+            self.watch()
+
+    # -- loading ------------------------------------------------------------------------------
+
+    def request(self, path=None, force=False):
+        # loads `path` (default: the current path) in the background; returns immediately.
+        # Requests made while a load runs collapse into one: the latest path wins. A file that
+        # was rejected or rolled back, or is already serving, is only reloaded with force=True
+        # (or once it changes on disk).
+        path = path or self.path
+        sig = file_signature(path)
+        with self._lock:
+            serving = self.version is not None and self.version["path"] == path and self.version["signature"] == sig
+            if not force and (sig in self._rejected or serving):
+                return self
+            self.path = path
+            self._pending = path
+            if self._loader_thread is None or not self._loader_thread.is_alive():
+                self._loader_thread = threading.Thread(target=self._drain, name="model-loader", daemon=True)
+                self._loader_thread.start()
+        return self
+
+    def load_now(self, path=None):
+        # synchronous load, for scripts and the first load when nothing is serving yet
+        path = path or self.path
+        with self._lock:
+            self.path = path
+        self._load(path)
+        return self
+
+    def wait(self, timeout=None):
+        thread = self._loader_thread
+        if thread is not None:
+            thread.join(timeout)
+        return self
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                path, self._pending = self._pending, None
+                if path is None:
+                    self._loader_thread = None
+                    return
+            self._load(path)
+
+    def _load(self, path):
+        with self._lock:
+            self.state = "loading"
+        t0 = time.perf_counter()
+        try:
+            model = self.loader(path)
+            if model.model is None:
+                raise RuntimeError(model.load_error or f"could not load {path}")
+            load_s = time.perf_counter() - t0
+            t1 = time.perf_counter()
+            model.warmup()
+            warmup_s = time.perf_counter() - t1
+            accuracy = self._validate(model)
+        except Exception as e:
+            with self._lock:
+                self._rejected.add(file_signature(path))
+                self.last_error = f"{os.path.basename(path or '')}: {e}"
+                self.state = "failed" if self.current is None else "ready"
+            print(f"Model {path} rejected, keeping {self.describe()}: {e}")
+            return False
+        displaced = None
+        with self._lock:
+            self._versions += 1
+            version = {"version": self._versions, "path": path, "signature": file_signature(path),
+                       "load_s": round(load_s, 3), "warmup_s": round(warmup_s, 3),
+                       "golden_accuracy": accuracy, "loaded_at": time.time()}
+            if self.current is not None:
+                displaced = self.previous[0] if self.previous else None
+                self.previous = (self.current, self.version)
+            # the swap: frames read self.current once per call
+            self.current, self.version = model, version
+            self._calls = 0
+            self.state = "ready"
+            self.last_error = None
+        if displaced is not None and displaced is not model:
+            displaced.close()
+        print(f"Serving {self.describe()} (loaded in {load_s:.2f} s, warm-up {warmup_s:.2f} s)")
+        return True
+
+    def _validate(self, model):
+        # outputs must be finite probabilities over model.labels; with a golden set, accuracy must
+        # reach min_accuracy and stay within max_drop of the serving model
+        h, w = model.target_size[1], model.target_size[0]
+        probs = np.asarray(model.predict_proba([np.zeros((h, w, 3), dtype=np.uint8)]))
+        if probs.shape[-1] != len(model.labels):
+            raise ValueError(f"model has {probs.shape[-1]} outputs for {len(model.labels)} labels")
+        if not np.all(np.isfinite(probs)):
+            raise ValueError("model outputs are not finite")
+        if self._golden is None:
+            self._golden = load_golden(self.golden_dir, self.per_class)
+        if not self._golden:
+            return None
+        accuracy = self.golden_accuracy(model)
+        with self._lock:
+            current, version = self.current, self.version
+        baseline = None
+        if current is not None:
+            baseline = version.get("golden_accuracy")
+            if baseline is None:
+                # the serving model was loaded without a golden set: score it once, off the lock
+                baseline = self.golden_accuracy(current)
+                with self._lock:
+                    version["golden_accuracy"] = baseline
+        if accuracy < self.min_accuracy:
+            raise ValueError(f"golden accuracy {accuracy:.2f} below {self.min_accuracy:.2f}")
+        if baseline is not None and accuracy < baseline - self.max_drop:
+            raise ValueError(f"golden accuracy {accuracy:.2f} vs {baseline:.2f} for the serving model")
+        return accuracy
+
+    def golden_accuracy(self, model):
+        preds = model.predict_batch([img for img, _ in self._golden])
+        return round(sum(p[0] == label for p, (_, label) in zip(preds, self._golden)) / len(self._golden), 4)
+
+    # -- serving ------------------------------------------------------------------------------
+
+    @property
+    def ready(self):
+        model = self.current
+        return model is not None and model.model is not None
+
+    @property
+    def target_size(self):
+        model = self.current
+        return model.target_size if model is not None else (224, 224)
+
+    def predict_batch(self, faces):
+        batcher = self.batcher
+        if batcher is not None and faces:
+            return batcher.predict_many(faces)
+        return self._predict_batch(faces)
+
+    def _predict_batch(self, faces, retry=True):
+        model = self.current
+        if model is None:
+            return [("neutral", 0.0)] * len(faces)
+        try:
+            out = model.predict_batch(faces)
+        except Exception as e:
+            if not retry or not self._rollback_after(model, e):
+                raise
+            return self._predict_batch(faces, retry=False)
+        with self._lock:
+            self._calls += 1
+        return out
+
+    def _rollback_after(self, model, error):
+        # a model that fails right after being swapped in is replaced by the one before it
+        with self._lock:
+            if model is not self.current:
+                return True  # another thread swapped meanwhile: retry on the new model
+            if self.previous is None or self._calls >= self.probation:
+                return False
+            reason = f"v{self.version['version']} failed at inference: {error}"
+        print(f"Model {self.describe()} failed ({error}); rolling back")
+        return self.rollback(reason)
+
+    def rollback(self, reason=None):
+        # swaps the previous version back in; the rolled-back one becomes `previous`, and neither
+        # the watcher nor request() reload its file until it changes again
+        with self._lock:
+            if self.previous is None:
+                return False
+            model, version = self.previous
+            self._rejected.add(self.version["signature"])
+            self.previous = (self.current, self.version)
+            self.current, self.version = model, version
+            self.path = version["path"]
+            self._calls = 0
+            self.last_error = reason
+        print(f"Rolled back to {self.describe()}")
+        return True
+
+    # -- watching -----------------------------------------------------------------------------
+
+    def watch(self):
+        # polls the model file; a change that has stopped growing for one poll triggers a reload
+        if self._watcher is None or not self._watcher.is_alive():
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+            self._watcher.start()
+        return self
+
+    def _watch(self):
+        seen = file_signature(self.path)
+        candidate = None
+        while not self._stop.wait(self.poll):
+            sig = file_signature(self.path)
+            version = self.version
+            if version is not None and version["path"] == self.path and sig == version["signature"]:
+                seen = sig
+            if sig == seen or sig in self._rejected or all(s is None for s in sig):
+                candidate = None
+                continue
+            if sig != candidate:
+                candidate = sig  # just changed, maybe still being written: check again next poll
+                continue
+            seen, candidate = sig, None
+            print(f"Model file {self.path} changed; reloading")
+            self.request(self.path)
+
+    def status(self):
+        with self._lock:
+            version = dict(self.version or {})
+        return {"state": self.state, "version": version.get("version"), "path": version.get("path"),
+                "load_s": version.get("load_s"), "warmup_s": version.get("warmup_s"),
+                "golden_accuracy": version.get("golden_accuracy"), "loaded_at": version.get("loaded_at"),
+                "loading": self._loader_thread is not None, "rollback": self.previous is not None,
+                "watching": self._watcher is not None and self._watcher.is_alive(), "error": self.last_error}
+
+    def describe(self):
+        if self.version is None:
+            return "no model"
+        return f"v{self.version['version']} {os.path.basename(self.version['path'])}"
+
+    def format(self):
+        # one line for status panels
+        s = self.status()
+        text = self.describe()
+        if s["load_s"] is not None:
+            text += f" · loaded in {s['load_s']:.1f} s"
+        if s["golden_accuracy"] is not None:
+            text += f" · golden {100 * s['golden_accuracy']:.0f}%"
+        if s["loading"]:
+            text += f" · loading {os.path.basename(self.path or '')}…"
+        if s["error"]:
+            text += f" · {s['error']}"
+        return text
+
+    def close(self):
+        self._stop.set()
+        batcher, self.batcher = self.batcher, None
+        if batcher is not None:
+            batcher.close()
+        with self._lock:
+            models = [self.current, self.previous[0] if self.previous else None]
+            self.current = self.version = self.previous = None
+            self.state = "closed"
+        for model in models:
+            if model is not None:
+                model.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load, warm up and validate an emotion model like the apps do.")
+    ap.add_argument("model")
+    ap.add_argument("--golden", default=GOLDEN_DIR, help="folder of <label>/ images to validate against")
+    ap.add_argument("--per-class", type=int, default=8)
+    ap.add_argument("--min-accuracy", type=float, default=0.0)
+    args = ap.parse_args()
+    manager = ModelManager(golden_dir=args.golden, per_class=args.per_class, min_accuracy=args.min_accuracy)
+    manager.load_now(args.model)
+    print(manager.format())
+    return 0 if manager.ready else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,20 +1,14 @@
 # modern_app_clean.py — Premium UI with proper placeholder control + visible Start/Stop buttons
 import streamlit as st
-import cv2
 import time
 
-from emotion_detector import EmotionDetector
-
-try:
-    from utils import get_youtube_recommendations, FALLBACK
-except:
-    FALLBACK = {
-        "happy": [("Upbeat Pop Mix", "https://www.youtube.com/watch?v=dQw4w9WgXcQ")],
-        "sad": [("Chill Vibes", "https://www.youtube.com/watch?v=dQw4w9WgXcQ")],
-        "angry": [("Aggressive Beats", "https://www.youtube.com/watch?v=dQw4w9WgXcQ")],
-        "surprise": [("Surprise Mix", "https://www.youtube.com/watch?v=dQw4w9WgXcQ")],
-        "neutral": [("Chill Vibes", "https://www.youtube.com/watch?v=dQw4w9WgXcQ")],
-    }
+from detector_registry import get_detector, release_detector
+from emotion_stream import EmotionStream
+from scheduler import AdaptiveScheduler, LatestFrameReader
+from metrics import metrics, timer
+from catalog import Rotation
+from recommender import get_recommendation_service
+from render import EMOJI, ChangeSlot, EmotionHistory, Preview
 
 st.set_page_config(page_title="TUNE TRAP — Premium", layout="wide")
 
@@ -97,6 +91,13 @@ with col1:
     start_btn = st.button("▶ Start Webcam")
 with col2:
     stop_btn = st.button("⛔ Stop Webcam")
+with st.expander("Preview & diagnostics"):
+    preview_width = st.select_slider("Preview width (px)", [320, 480, 640, 800, 960, 1280], value=640)
+    preview_quality = st.slider("JPEG quality", 40, 95, 75, step=5)
+    preview_fps = st.slider("Preview fps cap", 5, 30, 15)
+    show_timings = st.checkbox("Show stage timings", value=metrics.forced)
+# this session's panel; collection is process-wide and runs while any session shows timings
+metrics.request(st.session_state.setdefault("metrics_viewer", metrics.viewer()), show_timings)
 
 if "running" not in st.session_state:
     st.session_state.running = False
@@ -132,6 +133,8 @@ with left:
 
     # space where webcam frames will appear
     frame_display = st.empty()
+    stats_box = st.empty()
+    timings_box = st.empty()
     st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------------------------------------------------------
@@ -152,72 +155,92 @@ with right:
     st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------------------------------------------------------
-# Emotion Detector
+# Recommendations
 # ---------------------------------------------------------------
-detector = EmotionDetector(mode="mediapipe")
+# offline: the local music catalog (catalog.py) if present, else the built-in fallback links
+recommender = get_recommendation_service(None, max_results=5)
+rotation = st.session_state.setdefault("rotation", Rotation())  # this session's recently served tracks
 
-if "history" not in st.session_state:
-    st.session_state.history = []
+# bounded: a ring of recent labels with running per-emotion counts
+if not isinstance(st.session_state.get("history"), EmotionHistory):
+    st.session_state.history = EmotionHistory()
+history = st.session_state.history
 
 # ---------------------------------------------------------------
 # WEBCAM LOOP
 # ---------------------------------------------------------------
 if st.session_state.running:
-    cap = cv2.VideoCapture(0)
+    reader = LatestFrameReader(0, ring_slots=6)
 
-    if not cap.isOpened():
+    if not reader.isOpened():
         st.error("Camera not available.")
     else:
-        frame_count = 0
-        skip = 2
-
-        while st.session_state.running:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame_count += 1
-            if frame_count % skip != 0:
-                continue
-
-            label, conf, bbox = detector.detect(frame)
-
-            display = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-            if bbox:
-                x, y, w, h = bbox
-                cv2.rectangle(display, (x, y), (x+w, y+h), (124, 58, 237), 2)
-
-            text = f"{label.upper()} ({conf:.2f})"
-            cv2.putText(display, text, (12, 36), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                        (0, 0, 0), 4)
-            cv2.putText(display, text, (12, 36), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                        (255, 255, 255), 2)
-
-            frame_display.image(display, caption="Live Camera", channels="RGB")
-
-            emoji_map = {"happy": "😊", "sad": "😢", "angry": "😡", "neutral": "😐", "surprise": "😯"}
-            emoji = emoji_map.get(label.lower(), "🙂")
-
-            emotion_box.markdown(
-                f'<div class="emotion-badge">{emoji} {label.upper()} ({conf:.2f})</div>',
-                unsafe_allow_html=True,
-            )
-
-            st.session_state.history.append(label)
-            history_box.write(", ".join(st.session_state.history[-15:]))
-
-            recs = FALLBACK.get(label, FALLBACK["neutral"])
-            html = ""
-            for title, link in recs:
-                html += f"""
-                <div class="rec-card">
-                    <b>{title}</b><br>
-                    <a class="btn-play" href="{link}" target="_blank">Play ▶</a>
-                </div>
-                """
-            rec_box.markdown(html, unsafe_allow_html=True)
-
-            time.sleep(0.03)
-
-        cap.release()
+        reader.start()
+        # a FaceMesh of its own for this run's stream; released below, also when a rerun interrupts
+        detector = get_detector(mode="mediapipe")
+        sched = AdaptiveScheduler(target_latency=0.15, cpu_budget=0.7)
+        stream = EmotionStream(detector)
+        result = None
+        panel_at = 0.0
+        rec_label = None
+        # each UI element is only re-sent when what it shows changes
+        preview = Preview(frame_display, width=preview_width, quality=preview_quality,
+                          max_fps=preview_fps, color=(237, 58, 124))
+        badge = ChangeSlot(emotion_box)
+        history_slot = ChangeSlot(history_box)
+        stats_slot = ChangeSlot(stats_box)
+
+        try:
+            while st.session_state.running:
+                item = reader.read()
+                if item is None:
+                    break
+                frame, captured_at = item.frame, item.captured_at
+                sched.record("capture", reader.capture_cost)
+
+                if result is None or sched.should_infer():
+                    t0 = time.perf_counter()
+                    result = stream.update(frame, rgb=item.rgb)
+                    if not result.skipped:
+                        sched.record("detect", time.perf_counter() - t0)
+                    history.observe(result.label)
+                label, conf, bbox = result.label, result.conf, result.bbox
+
+                with timer("app.render"):
+                    # downscaled + JPEG-encoded once, at most preview_fps times a second
+                    shown = preview.show(frame, label, conf, bbox, caption="Live Camera")
+
+                emoji = EMOJI.get(label.lower(), "🙂")
+                # confidence shown to one decimal so the badge does not re-render on every jitter
+                badge.markdown(
+                    f'<div class="emotion-badge">{emoji} {label.upper()} ({conf:.1f})</div>',
+                    unsafe_allow_html=True,
+                )
+
+                history_slot.write(", ".join(list(history.changes)[::-1]) + "  \n" + history.summary())
+
+                # the catalog rotates through tracks on every lookup: only ask when the emotion changes
+                if label != rec_label:
+                    rec_label = label
+                    with timer("app.recommend"):
+                        recs = recommender.get(label, conf, rotation=rotation)
+                    html = ""
+                    for title, link in recs:
+                        html += f"""
+                        <div class="rec-card">
+                            <b>{title}</b><br>
+                            <a class="btn-play" href="{link}" target="_blank">Play ▶</a>
+                        </div>
+                        """
+                    rec_box.markdown(html, unsafe_allow_html=True)
+
+                sched.frame_done(captured_at)
+                if shown:
+                    stats_slot.caption(sched.format() + " · " + preview.format())
+                if show_timings and time.perf_counter() - panel_at > 1.0:
+                    panel_at = time.perf_counter()
+                    timings_box.markdown(metrics.format())
+
+        finally:
+            release_detector(detector)
+            reader.release()
@@ -0,0 +1,219 @@
+# pipeline.py
+# Multi-stage threaded capture -> inference -> annotate pipeline (used by advanced_app.py).
+# - capture runs at full camera rate and never waits on inference
+# - N inference workers each own a detector (FaceMesh tracking state is per instance)
+#   and always take the newest frame; older unclaimed frames are dropped
+# - the annotate stage restores capture order using frame sequence numbers, smooths
+#   labels with EmotionStream and publishes the BGR frame with its result to a latest-wins
+#   output; drawing is left to the renderer (render.Preview), which does it once on the
+#   downscaled copy it actually sends
+# Stages talk through LatestBuffer slots, so a slow consumer only ever costs dropped
+# frames, never growing queues or extra latency. A finite source (video file) drains: once
+# it ends, the workers finish what they claimed and every result is still emitted in order.
+import heapq
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+from emotion_stream import EmotionStream
+from metrics import metrics
+from scheduler import LatestFrameReader, is_live_source
+
+Packet = namedtuple("Packet", "seq frame captured_at")
+Detection = namedtuple("Detection", "seq frame captured_at label conf bbox infer_ms")
+Output = namedtuple("Output", "seq frame captured_at label conf bbox changed raw_label")
+_WORKERS_DONE = object()
+
+
+class LatestBuffer:
+    # single-slot, latest-wins handoff; put() never blocks, take() claims the item
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.puts = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self.puts += 1
+            self._cond.notify()
+
+    def take(self, timeout=None, on_take=None):
+        # on_take runs under the buffer lock, so bookkeeping (e.g. in-flight seqs) is atomic with the claim
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._item is not None or self._closed, timeout=timeout):
+                return None
+            item, self._item = self._item, None
+            if item is not None and on_take is not None:
+                on_take(item)
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        # closed and nothing left to take
+        with self._cond:
+            return self._closed and self._item is None
+
+
+def annotate(frame, label, conf, bbox):
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if bbox:
+        x,y,w,h = bbox
+        cv2.rectangle(frame_rgb, (x,y), (x+w, y+h), (0,255,0), 2)
+    cv2.putText(frame_rgb, f"{label} ({conf:.2f})", (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,0,0), 2)
+    return frame_rgb
+
+
+class Pipeline:
+    def __init__(self, detector_factory, source=0, workers=2, stream_factory=None, release_detector=None):
+        # release_detector(det) runs for every worker detector on stop (default: det.close())
+        self.detector_factory = detector_factory
+        self.release_detector = release_detector or (lambda det: det.close())
+        self.source = source
+        self.n_workers = max(1, workers)
+        self.stream_factory = stream_factory or (lambda: EmotionStream(None, motion_threshold=0))
+        self.frames = LatestBuffer()
+        self.output = LatestBuffer()
+        self._results = queue.Queue()
+        self._inflight = set()
+        self._stop = threading.Event()
+        self._threads = []
+        self._detectors = []
+        self._workers_left = 0
+        self.reader = None
+        self.error = None
+        self.stats = {"captured": 0, "inferred": 0, "emitted": 0, "late": 0, "infer_ms": 0.0,
+                      "latency_ms": 0.0}
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stop.is_set()
+
+    def start(self):
+        self.reader = LatestFrameReader(self.source, realtime=False)
+        if not self.reader.isOpened():
+            raise RuntimeError(f"Cannot open video source {self.source!r}")
+        self._detectors = [self.detector_factory() for _ in range(self.n_workers)]
+        self._workers_left = len(self._detectors)
+        self._spawn("capture", self._capture)
+        for i, det in enumerate(self._detectors):
+            self._spawn(f"infer-{i}", self._infer, det)
+        self._spawn("annotate", self._annotate)
+        return self
+
+    def _spawn(self, name, target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                self.error = e
+                self._stop.set()
+        t = threading.Thread(target=run, name=f"pipeline-{name}", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _capture(self):
+        # LatestFrameReader in non-realtime mode is a plain blocking read: this thread is the capture stage
+        while not self._stop.is_set():
+            item = self.reader.read()
+            if item is None:
+                if is_live_source(self.source):
+                    time.sleep(0.01)
+                    continue
+                break
+            self.stats["captured"] += 1
+            self.frames.put(Packet(item.seq, item.frame, item.captured_at))
+        # end of a finite source: workers drain the buffer, the annotate stage then stops the pipeline
+        self.frames.close()
+
+    def _infer(self, detector):
+        claim = lambda pkt: self._inflight.add(pkt.seq)
+        try:
+            while not self._stop.is_set():
+                pkt = self.frames.take(timeout=0.2, on_take=claim)
+                if pkt is None:
+                    if self.frames.closed:
+                        break
+                    continue
+                t0 = time.perf_counter()
+                label, conf, bbox = detector.detect(pkt.frame)
+                ms = 1000.0 * (time.perf_counter() - t0)
+                self._results.put(Detection(pkt.seq, pkt.frame, pkt.captured_at, label, conf, bbox, ms))
+        finally:
+            with self.frames._cond:
+                self._workers_left -= 1
+                last = self._workers_left == 0
+            if last:
+                self._results.put(_WORKERS_DONE)
+
+    def _annotate(self):
+        stream = self.stream_factory()
+        pending = []
+        self._last_seq = 0
+        while not self._stop.is_set():
+            try:
+                det = self._results.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if det is _WORKERS_DONE:
+                # nothing is in flight any more: emit what is left, in order, and finish
+                while pending:
+                    self._emit(stream, heapq.heappop(pending)[1])
+                break
+            with self.frames._cond:
+                self._inflight.discard(det.seq)
+                oldest_inflight = min(self._inflight) if self._inflight else None
+            self.stats["inferred"] += 1
+            self.stats["infer_ms"] = 0.8 * self.stats["infer_ms"] + 0.2 * det.infer_ms
+            heapq.heappush(pending, (det.seq, det))
+            # emit in capture order: only release results no older frame can still overtake
+            while pending and (oldest_inflight is None or pending[0][0] < oldest_inflight):
+                self._emit(stream, heapq.heappop(pending)[1])
+        self._stop.set()
+
+    def _emit(self, stream, det):
+        if det.seq <= self._last_seq:
+            self.stats["late"] += 1
+            return
+        self._last_seq = det.seq
+        res = stream.observe(det.label, det.conf, det.bbox)
+        self.output.put(Output(det.seq, det.frame, det.captured_at, res.label, res.conf,
+                               det.bbox, res.changed, det.label))
+        self.stats["emitted"] += 1
+        latency = 1000.0 * (time.perf_counter() - det.captured_at)
+        metrics.observe("frame.latency", latency / 1000.0)
+        self.stats["latency_ms"] = 0.8 * self.stats["latency_ms"] + 0.2 * latency
+
+    def backpressure(self):
+        return {"capture_dropped": self.frames.dropped, "render_dropped": self.output.dropped,
+                "inflight": len(self._inflight), **self.stats}
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        self.frames.close()
+        self.output.close()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        stuck = any(t.is_alive() for t in self._threads)
+        self._threads = []
+        if self.reader is not None:
+            self.reader.release()
+        if stuck:
+            # a worker still inside detect(): leave its detector to the garbage collector
+            print("Pipeline.stop: a worker did not finish in time; its detector was not closed")
+        else:
+            for det in self._detectors:
+                self.release_detector(det)
+        self._detectors = []
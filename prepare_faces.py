@@ -0,0 +1,207 @@
+# prepare_faces.py
+# Build a pre-cropped face dataset so training sees the same Haar-localized face crops that
+# EmotionDetector feeds the model at inference time, with zero decode cost per epoch.
+#   python prepare_faces.py                       # data/train + data/val -> cache/faces/
+#   python prepare_faces.py --splits val --size 224 --workers 8
+# For every split, crops are written to <out>/<split>/faces.u8 (a raw uint8 array of shape
+# (rows, size, size, 3), BGR, memory-mapped) and described by <out>/<split>/index.json
+# (classes, source path/size/mtime, label and row for every image). Re-running only
+# processes new or changed images; rows of deleted/changed files are marked invalid and
+# skipped by readers.
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+OUT_DIR = os.path.join("cache", "faces")
+SIZE = 224
+
+_worker = {}
+
+
+def _init_worker():
+    import cv2
+    from emotion_detector import FaceTracker
+    cv2.setNumThreads(1)
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    _worker["tracker"] = FaceTracker(cascade)
+
+
+def _crop_chunk(args):
+    # same localization as EmotionDetector in keras mode: largest Haar face, whole image if none
+    import cv2
+    paths, size = args
+    tracker = _worker["tracker"]
+    crops = np.zeros((len(paths), size, size, 3), dtype=np.uint8)
+    found = np.zeros(len(paths), dtype=bool)
+    ok = np.zeros(len(paths), dtype=bool)
+    for i, path in enumerate(paths):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        faces = tracker.detect_full(img)
+        if faces:
+            x, y, w, h = max(faces, key=lambda b: b[2] * b[3])
+            img = img[y:y+h, x:x+w]
+            found[i] = True
+        crops[i] = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+        ok[i] = True
+    return crops, found, ok
+
+
+class FaceStore:
+    # one split (train or val) of the pre-cropped dataset. size=None opens an existing store at
+    # whatever size its index records (readers); writers pass --size and get an error on mismatch.
+    def __init__(self, root, split, size=None):
+        self.dir = os.path.join(root, split)
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.data_path = os.path.join(self.dir, "faces.u8")
+        self.index = {"size": size or SIZE, "classes": [], "rows": 0, "items": {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+            if size is not None and self.index["size"] != size:
+                raise ValueError(f"{self.dir} holds {self.index['size']}px crops, not {size}px; use another --out")
+        self.size = self.index["size"]
+
+    @property
+    def row_bytes(self):
+        return self.size * self.size * 3
+
+    def faces(self, mode="r"):
+        rows = self.index["rows"]
+        if rows == 0:
+            return np.zeros((0, self.size, self.size, 3), dtype=np.uint8)
+        return np.memmap(self.data_path, dtype=np.uint8, mode=mode, shape=(rows, self.size, self.size, 3))
+
+    def valid_items(self):
+        # (rows, label indices, face found) of usable crops, in row order
+        items = sorted((v["row"], v["label"], v["face"]) for v in self.index["items"].values() if v["row"] >= 0)
+        rows = np.array([r for r, _, _ in items], dtype=np.int64)
+        labels = np.array([l for _, l, _ in items], dtype=np.int64)
+        found = np.array([f for _, _, f in items], dtype=bool)
+        return rows, labels, found
+
+    def fingerprint(self):
+        # rows are append-only, so (row, label) pairs identify the content
+        rows, labels, _ = self.valid_items()
+        h = hashlib.sha1(f"{self.index['rows']}|{self.size}".encode())
+        h.update(rows.tobytes())
+        h.update(labels.tobytes())
+        return h.hexdigest()[:16]
+
+    def load(self):
+        # zero-decode access for training/evaluation: memmap + valid rows + labels + class names
+        rows, labels, _ = self.valid_items()
+        return self.faces(), rows, labels, self.index["classes"]
+
+    def update(self, data_dir, workers=None, chunk=64):
+        classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+        if self.index["classes"] and self.index["classes"] != classes:
+            # new classes change label indices; existing rows stay valid but are relabelled below
+            print(f"classes changed: {self.index['classes']} -> {classes}")
+        self.index["classes"] = classes
+        items = self.index["items"]
+        seen, todo = set(), []
+        for label, cls in enumerate(classes):
+            folder = os.path.join(data_dir, cls)
+            for name in sorted(os.listdir(folder)):
+                if not name.lower().endswith(IMAGE_EXTS):
+                    continue
+                path = os.path.join(folder, name)
+                st = os.stat(path)
+                seen.add(path)
+                entry = items.get(path)
+                if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+                    entry["label"] = label
+                    continue
+                items[path] = {"size": st.st_size, "mtime": st.st_mtime_ns, "label": label, "row": -1,
+                               "face": False}
+                todo.append(path)
+        removed = [p for p in items if p not in seen]
+        for p in removed:
+            del items[p]
+        if todo:
+            self._append(todo, workers, chunk)
+        self._save()
+        print(f"{self.dir}: {len(todo)} new/changed, {len(removed)} removed, "
+              f"{sum(v['row'] >= 0 for v in items.values())} usable rows")
+
+    def _append(self, paths, workers, chunk):
+        os.makedirs(self.dir, exist_ok=True)
+        start = self.index["rows"]
+        # grow the backing file first, then map only the new region
+        with open(self.data_path, "ab") as f:
+            f.truncate((start + len(paths)) * self.row_bytes)
+        out = np.memmap(self.data_path, dtype=np.uint8, mode="r+", offset=start * self.row_bytes,
+                        shape=(len(paths), self.size, self.size, 3))
+        chunks = [(paths[i:i+chunk], self.size) for i in range(0, len(paths), chunk)]
+        items = self.index["items"]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            pos = 0
+            for (chunk_paths, _), (crops, found, ok) in zip(chunks, pool.map(_crop_chunk, chunks)):
+                out[pos:pos+len(chunk_paths)] = crops
+                for j, path in enumerate(chunk_paths):
+                    items[path]["row"] = start + pos + j if ok[j] else -1
+                    items[path]["face"] = bool(found[j])
+                pos += len(chunk_paths)
+        out.flush()
+        del out
+        self.index["rows"] = start + len(paths)
+
+    def _save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    def compact(self):
+        # rewrite without rows of deleted/changed images
+        rows, _, _ = self.valid_items()
+        if len(rows) == self.index["rows"]:
+            return
+        src = self.faces()
+        tmp = self.data_path + ".tmp"
+        dst = np.memmap(tmp, dtype=np.uint8, mode="w+", shape=(max(len(rows), 1), self.size, self.size, 3))
+        remap = {}
+        for new, old in enumerate(rows):
+            dst[new] = src[old]
+            remap[int(old)] = new
+        dst.flush()
+        del dst, src
+        os.replace(tmp, self.data_path)
+        for v in self.index["items"].values():
+            if v["row"] >= 0:
+                v["row"] = remap[v["row"]]
+        self.index["rows"] = len(rows)
+        self._save()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-crop faces into a memory-mapped dataset.")
+    ap.add_argument("--data", default="data")
+    ap.add_argument("--splits", nargs="+", default=["train", "val"])
+    ap.add_argument("--out", default=OUT_DIR)
+    ap.add_argument("--size", type=int, default=SIZE)
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--compact", action="store_true", help="drop rows of removed/changed images")
+    args = ap.parse_args()
+
+    for split in args.splits:
+        data_dir = os.path.join(args.data, split)
+        if not os.path.isdir(data_dir):
+            print(f"skipping {data_dir}: not found")
+            continue
+        store = FaceStore(args.out, split, size=args.size)
+        store.update(data_dir, workers=args.workers)
+        if args.compact:
+            store.compact()
+
+
+if __name__ == "__main__":
+    main()
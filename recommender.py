@@ -0,0 +1,267 @@
+# recommender.py
+# Cached, deduplicated recommendation layer around utils.get_youtube_recommendations.
+# YouTube clients are built once per service and thread (the httplib2 transport underneath
+# is not thread-safe) and reused, results are kept in a small
+# per-emotion TTL/LRU cache, and concurrent callers asking for the same emotion
+# share a single in-flight request.
+# An optional SQLite store persists results across restarts and replicas: stale
+# entries are served immediately while a background worker refreshes them.
+# Without an API key (or while YouTube is failing) answers come from the local music
+# catalog (catalog.py) when one is available, else from utils.FALLBACK.
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils import FALLBACK, build_youtube_client, emotion_to_query, search_youtube
+
+DEFAULT_STORE_PATH = os.path.join("cache", "recommendations.sqlite3")
+
+
+def fallback_for(emotion):
+    return FALLBACK.get(emotion.lower(), FALLBACK["neutral"])
+
+
+class RecommendationStore:
+    # keyed by (query string from emotion_to_query, max_results)
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS recommendations ("
+                " query TEXT NOT NULL, max_results INTEGER NOT NULL,"
+                " fetched_at REAL NOT NULL, videos TEXT NOT NULL,"
+                " PRIMARY KEY (query, max_results))")
+
+    def load(self, query, max_results):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, videos FROM recommendations WHERE query = ? AND max_results = ?",
+                (query, max_results)).fetchone()
+        if row is None:
+            return None
+        fetched_at, videos = row
+        return fetched_at, [tuple(v) for v in json.loads(videos)]
+
+    def save(self, query, max_results, videos, fetched_at):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations (query, max_results, fetched_at, videos)"
+                " VALUES (?, ?, ?, ?)",
+                (query, max_results, fetched_at, json.dumps(videos)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class RecommendationService:
+    def __init__(self, api_key=None, max_results=5, ttl=600.0, max_entries=32,
+                 client=None, client_factory=build_youtube_client, store=None, retry_after=60.0,
+                 clock=time.time, local=None):
+        # `client` lets tests (or other backends) pass a stub exposing search().list().execute()
+        # `local`: offline backend with get(emotion), e.g. catalog.CatalogRecommender
+        self.api_key = api_key
+        self.max_results = max_results
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store
+        self.retry_after = retry_after
+        self.clock = clock
+        self.local = local
+        self._client = client
+        self._client_factory = client_factory
+        self._local = threading.local()  # .client: this thread's YouTube client
+        self._cache = OrderedDict()  # emotion -> (fetched_at, videos)
+        self._inflight = {}
+        self._retry_at = {}  # emotion -> earliest time to retry a failed refresh
+        self._lock = threading.Lock()
+        self._refresh_q = None
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "fetches": 0, "errors": 0, "shared": 0}
+
+    @property
+    def online(self):
+        return self._client is not None or bool(self.api_key)
+
+    def client(self):
+        # an injected client is used as given; built ones are per thread
+        if self._client is not None:
+            return self._client
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._client_factory(self.api_key)
+        return client
+
+    def _fallback(self, key, conf=1.0, rotation=None):
+        # conf picks the catalog's neighbourhood (bucketed by the catalog); rotation is the
+        # caller's own catalog.Rotation, so sessions do not advance each other's picks
+        if self.local is not None:
+            videos = self.local.get(key, conf, rotation=rotation)
+            if videos:
+                return videos
+        return fallback_for(key)
+
+    def _lookup(self, key):
+        # returns (videos, fresh) or None; falls through to the persistent store on a memory miss
+        entry = self._cache.get(key)
+        if entry is None and self.store is not None:
+            entry = self.store.load(emotion_to_query(key), self.max_results)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        fetched_at, videos = entry
+        self._cache.move_to_end(key)
+        return videos, self.clock() - fetched_at < self.ttl
+
+    def _remember(self, key, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _fetch(self, emotion):
+        # failures are never cached; the caller keeps serving whatever it already had
+        with self._lock:
+            self.stats["fetches"] += 1
+        try:
+            videos = search_youtube(self.client(), emotion, self.max_results)
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            print("Could not fetch YouTube results:", e)
+            return None
+        return videos or None
+
+    def _run_flight(self, key, flight):
+        try:
+            videos = self._fetch(key)
+            if videos is not None:
+                fetched_at = self.clock()
+                with self._lock:
+                    self._remember(key, (fetched_at, videos))
+                if self.store is not None:
+                    try:
+                        self.store.save(emotion_to_query(key), self.max_results, videos, fetched_at)
+                    except sqlite3.Error as e:
+                        print("Could not persist recommendations:", e)
+            else:
+                with self._lock:
+                    self._retry_at[key] = self.clock() + self.retry_after
+                    cached = self._lookup(key)
+                # nothing to share: each caller falls back with its own confidence and rotation
+                videos = cached[0] if cached else None
+            flight.result = videos
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+        return videos
+
+    def get(self, emotion, conf=1.0, rotation=None):
+        key = emotion.lower()
+        if not self.online:
+            cached = self._lookup(key) if self.store is not None else None
+            return cached[0] if cached else self._fallback(key, conf, rotation)
+        with self._lock:
+            cached = self._lookup(key)
+            if cached is not None:
+                videos, fresh = cached
+                if fresh:
+                    self.stats["hits"] += 1
+                else:
+                    self.stats["stale"] += 1
+                    self._schedule_refresh(key)
+                return videos
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.stats["misses"] += 1
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.stats["shared"] += 1
+        if not leader:
+            flight.done.wait()
+            videos = flight.result
+        else:
+            videos = self._run_flight(key, flight)
+        return videos or self._fallback(key, conf, rotation)
+
+    def _schedule_refresh(self, key):
+        # caller holds self._lock
+        if key in self._inflight or self.clock() < self._retry_at.get(key, 0.0):
+            return
+        self._inflight[key] = _Flight()
+        if self._refresh_q is None:
+            self._refresh_q = queue.Queue()
+            threading.Thread(target=self._refresh_worker, name="recommendation-refresh",
+                             daemon=True).start()
+        self._refresh_q.put(key)
+
+    def _refresh_worker(self):
+        while True:
+            key = self._refresh_q.get()
+            with self._lock:
+                flight = self._inflight.get(key)
+            if flight is not None:
+                self._run_flight(key, flight)
+
+    def warm(self, emotions):
+        # preload persisted entries so the first frame is served from disk; anything
+        # stale or missing is refreshed in the background
+        if not self.online:
+            return
+        with self._lock:
+            for emotion in emotions:
+                key = emotion.lower()
+                cached = self._lookup(key)
+                if cached is None or not cached[1]:
+                    self._schedule_refresh(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_services = {}
+_services_lock = threading.Lock()
+_stores = {}
+
+
+def get_recommendation_service(api_key=None, max_results=5, store_path=DEFAULT_STORE_PATH,
+                               warm_emotions=None, catalog_path=None, **kwargs):
+    # process-wide: module globals survive Streamlit reruns, so the client and cache do too
+    # catalog_path: local catalog for offline answers (None = catalog.load_catalog's default, False = none)
+    key = (api_key or None, max_results, store_path, catalog_path)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            store = None
+            if store_path:
+                store = _stores.get(store_path)
+                if store is None:
+                    store = _stores[store_path] = RecommendationStore(store_path)
+            local = None
+            if catalog_path is not False:
+                from catalog import load_catalog
+                local = load_catalog(catalog_path, k=max_results)
+            service = _services[key] = RecommendationService(api_key=api_key or None,
+                                                             max_results=max_results,
+                                                             store=store, local=local, **kwargs)
+            if warm_emotions:
+                service.warm(warm_emotions)
+        return service
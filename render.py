@@ -0,0 +1,154 @@
+# render.py
+# Change-driven UI updates for the Streamlit frontends.
+# - ChangeSlot wraps an st.empty() placeholder and only re-sends when the content differs
+#   from what the browser already shows.
+# - Preview downscales each shown frame once, draws the overlay on the small copy, JPEG-
+#   encodes it at a set quality and pushes the bytes to st.image, at most `max_fps` times a
+#   second regardless of how often inference runs.
+# - EmotionHistory is a fixed-size ring of recent labels with running per-emotion counts,
+#   so long sessions stay constant in memory.
+import time
+from collections import deque
+
+import cv2
+
+from emotion_detector import EMOTIONS
+
+EMOJI = {"happy": "😊", "sad": "😢", "angry": "😡", "neutral": "😐", "surprise": "😯"}
+
+
+class ChangeSlot:
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self._last = None
+        self.sent = 0
+        self.skipped = 0
+
+    def _send(self, key, fn, *args, **kwargs):
+        if key == self._last:
+            self.skipped += 1
+            return False
+        self._last = key
+        fn(*args, **kwargs)
+        self.sent += 1
+        return True
+
+    def markdown(self, body, **kwargs):
+        return self._send(("markdown", body), self.placeholder.markdown, body, **kwargs)
+
+    def write(self, body):
+        return self._send(("write", body), self.placeholder.write, body)
+
+    def caption(self, body):
+        return self._send(("caption", body), self.placeholder.caption, body)
+
+    def info(self, body):
+        return self._send(("info", body), self.placeholder.info, body)
+
+    def reset(self):
+        self._last = None
+
+
+class Preview:
+    def __init__(self, placeholder, width=640, quality=80, max_fps=15.0, color=(0, 255, 0)):
+        # color is BGR, like the frames
+        self.placeholder = placeholder
+        self.width = width
+        self.quality = quality
+        self.max_fps = max_fps
+        self.color = color
+        self._next = 0.0
+        self.shown = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+
+    def due(self, now=None):
+        now = time.perf_counter() if now is None else now
+        if self.max_fps and now < self._next:
+            return False
+        self._next = now + (1.0 / self.max_fps if self.max_fps else 0.0)
+        return True
+
+    def encode(self, frame, label=None, conf=0.0, bbox=None, rgb=False, faces=None):
+        # JPEG bytes of the downscaled, annotated frame; `frame` itself is never written to
+        # faces: per-face results (emotion_detector.FaceResult) drawn instead of the single bbox
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.width / w) if self.width else 1.0
+        if scale < 1.0:
+            small = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            small = frame.copy()
+        if rgb:
+            small = cv2.cvtColor(small, cv2.COLOR_RGB2BGR)
+        if faces:
+            fs = max(0.35, small.shape[1] / 1280.0)
+            for f in faces:
+                x, y, bw, bh = (int(v * scale) for v in f.bbox)
+                cv2.rectangle(small, (x, y), (x + bw, y + bh), self.color, 2)
+                cv2.putText(small, f"#{f.face_id} {f.label}", (x, max(12, y - 6)), cv2.FONT_HERSHEY_SIMPLEX,
+                            fs, self.color, 1)
+        elif bbox:
+            x, y, bw, bh = (int(v * scale) for v in bbox)
+            cv2.rectangle(small, (x, y), (x + bw, y + bh), self.color, 2)
+        if label is not None:
+            text = f"{label.upper()} ({conf:.2f})"
+            fs = max(0.4, small.shape[1] / 640.0)
+            org = (int(12 * fs), int(36 * fs))
+            cv2.putText(small, text, org, cv2.FONT_HERSHEY_SIMPLEX, fs, (0, 0, 0), 4)
+            cv2.putText(small, text, org, cv2.FONT_HERSHEY_SIMPLEX, fs, (255, 255, 255), 2)
+        ok, buf = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)])
+        return buf.tobytes() if ok else None
+
+    def show(self, frame, label=None, conf=0.0, bbox=None, rgb=False, caption=None, now=None, faces=None):
+        # returns True if a frame was sent; frames over the fps cap are skipped before any work
+        if not self.due(now):
+            self.dropped += 1
+            return False
+        data = self.encode(frame, label, conf, bbox, rgb=rgb, faces=faces)
+        if data is None:
+            return False
+        self.placeholder.image(data, caption=caption, output_format="JPEG")
+        self.shown += 1
+        self.bytes_sent += len(data)
+        return True
+
+    def format(self):
+        return f"preview {self.shown} sent · {self.dropped} capped · {self.bytes_sent / 1e6:.1f} MB"
+
+
+class EmotionHistory:
+    def __init__(self, window=300, recent=15, labels=EMOTIONS):
+        # window: observations kept for the per-emotion shares; recent: label changes listed
+        self._ring = deque(maxlen=window)
+        self.counts = dict.fromkeys(labels, 0)
+        self.changes = deque(maxlen=recent)
+
+    def __len__(self):
+        return len(self._ring)
+
+    def observe(self, label):
+        if len(self._ring) == self._ring.maxlen:
+            self.counts[self._ring[0]] -= 1
+        self._ring.append(label)
+        self.counts[label] = self.counts.get(label, 0) + 1
+        if not self.changes or self.changes[-1] != label:
+            self.changes.append(label)
+
+    def shares(self):
+        n = len(self._ring)
+        return {k: v / n for k, v in self.counts.items() if v} if n else {}
+
+    def dominant(self):
+        return max(self.counts, key=self.counts.get) if self._ring else None
+
+    def summary(self, step=5):
+        # shares rounded to `step` percent, so the text (and the UI) only changes meaningfully
+        shares = sorted(self.shares().items(), key=lambda kv: -kv[1])
+        parts = [f"{k} {int(round(100 * v / step) * step)}%" for k, v in shares]
+        return " · ".join(p for p in parts if not p.endswith(" 0%"))
+
+    def clear(self):
+        self._ring.clear()
+        self.changes.clear()
+        for k in self.counts:
+            self.counts[k] = 0
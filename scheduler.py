@@ -0,0 +1,216 @@
+# scheduler.py
+# Adaptive frame scheduling driven by measured pipeline latency.
+# LatestFrameReader keeps only the newest camera frame (stale frames are dropped
+# instead of queueing up inside the driver), and AdaptiveScheduler measures the
+# per-stage cost of capture / detect / render to decide how often inference runs:
+# often enough to use the CPU budget, rarely enough to stay under the target
+# end-to-end latency. File input is read sequentially and runs as fast as the
+# detector allows.
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+
+from metrics import metrics
+
+
+def is_live_source(source):
+    # webcams (device indices) and network streams produce frames in real time; files do not
+    if isinstance(source, int) or str(source).isdigit():
+        return True
+    return str(source).lower().startswith(("rtsp://", "rtmp://", "http://", "https://"))
+
+
+CapturedFrame = namedtuple("CapturedFrame", "seq frame captured_at rgb")
+
+
+class LatestFrameReader:
+    # ring_slots > 0 decodes into a FrameRing (see frame_ring.py): frames come back as read-only
+    # views with the RGB conversion already done, instead of fresh arrays per frame. The frame
+    # returned by read() stays leased -- capture will not overwrite it -- until the next read().
+    def __init__(self, source=0, realtime=None, ring_slots=0):
+        self.source = int(source) if str(source).isdigit() else source
+        self.realtime = is_live_source(self.source) if realtime is None else realtime
+        self.cap = cv2.VideoCapture(self.source)
+        self.ring_slots = ring_slots
+        self.ring = None
+        self._cond = threading.Condition()
+        self._latest = None  # CapturedFrame
+        self._consumed = 0
+        self._leased = None  # RingFrame handed out by the last read()
+        self._seq = 0
+        self._ended = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.dropped = 0
+        self.capture_cost = 0.0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        if self.realtime and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="frame-reader", daemon=True)
+            self._thread.start()
+        return self
+
+    def _grab(self):
+        t0 = time.perf_counter()
+        if self.ring is not None:
+            seq = self.ring.write_from(self.cap, t0)
+            now = time.perf_counter()
+            if seq is None:
+                return None
+            rf = self.ring.get(seq)
+            item = CapturedFrame(seq, rf.bgr, now, rf.rgb)
+        else:
+            ret, frame = self.cap.read()
+            now = time.perf_counter()
+            if not ret:
+                return None
+            if self.ring_slots:
+                # first frame tells us the shape; from here on decode straight into the ring
+                from frame_ring import FrameRing
+                self.ring = FrameRing(frame.shape, slots=self.ring_slots)
+                seq = self.ring.write(frame, now)
+                rf = self.ring.get(seq)
+                item = CapturedFrame(seq, rf.bgr, now, rf.rgb)
+            else:
+                self._seq += 1
+                item = CapturedFrame(self._seq, frame, now, None)
+        self.capture_cost = now - t0
+        metrics.observe("capture.read", self.capture_cost)
+        return item
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self._grab()
+            with self._cond:
+                if item is None:
+                    self._ended = True
+                    self._cond.notify_all()
+                    return
+                if self._latest is not None and self._latest.seq > self._consumed:
+                    self.dropped += 1
+                self._latest = item
+                self._cond.notify_all()
+
+    def read(self, timeout=1.0):
+        # returns a CapturedFrame newer than the last one returned, or None
+        self._unlease()
+        if not self.realtime:
+            return self._grab()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                ok = self._cond.wait_for(lambda: self._ended or (self._latest and self._latest.seq > self._consumed),
+                                         timeout=max(0.0, deadline - time.monotonic()))
+                if not ok or self._latest is None or self._latest.seq <= self._consumed:
+                    return None
+                item = self._latest
+                self._consumed = item.seq
+                if self.ring is None:
+                    return item
+                # pin the slot so capture writes around it while the caller uses the views
+                self._leased = self.ring.lease(item.seq)
+                if self._leased is not None:
+                    return item
+                # lapped between capture and now: wait for the next frame
+
+    def _unlease(self):
+        if self._leased is not None:
+            if self.ring is not None:
+                self.ring.release(self._leased)
+            self._leased = None
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self.cap.release()
+        self._unlease()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class AdaptiveScheduler:
+    def __init__(self, target_latency=0.15, cpu_budget=0.7, alpha=0.2, max_interval=1.0, realtime=True):
+        # target_latency: seconds from capture to rendered frame; cpu_budget: max fraction of wall
+        # time spent in inference. realtime=False (file input) always infers.
+        self.target_latency = target_latency
+        self.cpu_budget = cpu_budget
+        self.alpha = alpha
+        self.max_interval = max_interval
+        self.realtime = realtime
+        self.costs = {}
+        self.latency = 0.0
+        self._latency_interval = 0.0
+        self._last_infer = 0.0
+        self._last_frame = None
+        self._frame_dt = 0.0
+        self._infer_dt = 0.0
+
+    def _ema(self, old, new):
+        return new if old == 0.0 else (1 - self.alpha) * old + self.alpha * new
+
+    def record(self, name, seconds):
+        self.costs[name] = self._ema(self.costs.get(name, 0.0), seconds)
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    @property
+    def infer_interval(self):
+        if not self.realtime:
+            return 0.0
+        detect = self.costs.get("detect", 0.0)
+        by_cpu = detect / self.cpu_budget if self.cpu_budget else 0.0
+        return min(self.max_interval, max(by_cpu, self._latency_interval))
+
+    def should_infer(self, now=None):
+        now = time.perf_counter() if now is None else now
+        if now - self._last_infer >= self.infer_interval:
+            if self._last_infer:
+                self._infer_dt = self._ema(self._infer_dt, now - self._last_infer)
+            self._last_infer = now
+            return True
+        return False
+
+    def frame_done(self, captured_at, now=None):
+        now = time.perf_counter() if now is None else now
+        metrics.observe("frame.latency", now - captured_at)
+        self.latency = self._ema(self.latency, now - captured_at)
+        if self._last_frame is not None:
+            self._frame_dt = self._ema(self._frame_dt, now - self._last_frame)
+        self._last_frame = now
+        # AIMD on the inference interval: back off quickly when over the latency target,
+        # creep back towards every-frame inference when there is headroom
+        if self.realtime and self.target_latency:
+            detect = self.costs.get("detect", 0.0)
+            if self.latency > self.target_latency:
+                self._latency_interval = min(self.max_interval, max(self._latency_interval * 1.5, detect))
+            else:
+                self._latency_interval *= 0.9
+
+    def snapshot(self):
+        return {
+            "fps": 1.0 / self._frame_dt if self._frame_dt else 0.0,
+            "infer_fps": 1.0 / self._infer_dt if self._infer_dt else 0.0,
+            "latency_ms": 1000.0 * self.latency,
+            "infer_interval_ms": 1000.0 * self.infer_interval,
+            **{f"{k}_ms": 1000.0 * v for k, v in self.costs.items()},
+        }
+
+    def format(self):
+        s = self.snapshot()
+        return (f"{s['fps']:.1f} fps · inference {s['infer_fps']:.1f}/s · latency {s['latency_ms']:.0f} ms  \n"
+                + " · ".join(f"{k[:-3]} {v:.1f} ms" for k, v in s.items() if k.endswith("_ms")
+                             and k not in ("latency_ms", "infer_interval_ms")))
@@ -0,0 +1,309 @@
+# serve.py
+# Headless multi-stream emotion server backed by a pool of worker processes.
+# Each worker process owns its detectors (MediapipeHeuristic / KerasEmotionModel) and
+# every stream is pinned to one worker, so FaceMesh / face-tracking / smoothing state
+# stays in one place. Frames travel through per-stream shared-memory slots; only small
+# (stream, slot, seq) messages are pickled, so throughput scales with cores.
+#   python serve.py --workers 4 cam0=0 lobby=rtsp://10.0.0.5/stream demo=videos/demo.mp4
+# Any source can be a local video file standing in for a camera or RTSP feed (--loop).
+# A frame that fails in a worker is reported and its slot freed; a worker process that dies
+# is restarted (its streams reopened, their slots reclaimed) up to --max-restarts times.
+import argparse
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from scheduler import is_live_source
+
+StreamEvent = namedtuple("StreamEvent", "stream seq captured_at label conf bbox changed latency_ms worker")
+
+
+def attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # the creating process owns (and unlinks) the block; stop this process's tracker from doing it too
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _worker_main(worker_id, tasks, results, mode, keras_model_path, options):
+    from emotion_detector import EmotionDetector
+    from emotion_stream import EmotionStream
+
+    streams = {}  # name -> (stream, shm, frames view)
+    while True:
+        msg = tasks.get()
+        if msg is None:
+            break
+        kind, name = msg[0], msg[1]
+        if kind == "open":
+            shm_name, shape, slots = msg[2:]
+            try:
+                shm = attach_shared_memory(shm_name)
+                view = np.ndarray((slots,) + tuple(shape), dtype=np.uint8, buffer=shm.buf)
+                detector = EmotionDetector(mode=mode, keras_model_path=keras_model_path, **options).warmup()
+                streams[name] = (EmotionStream(detector), shm, view)
+            except Exception as e:
+                # its frames are answered with errors below, so their slots still come back
+                print(f"[worker {worker_id}] cannot open stream {name!r}: {e}", flush=True)
+        elif kind == "frame":
+            slot, seq, captured_at, epoch = msg[2:]
+            try:
+                stream, _, view = streams[name]
+                res = stream.update(view[slot])
+                bbox = tuple(int(v) for v in res.bbox) if res.bbox is not None else None
+                results.put((name, slot, seq, captured_at, res.label, float(res.conf), bbox, res.changed,
+                             worker_id, epoch, None))
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}" if name in streams else f"stream {name!r} is not open"
+                results.put((name, slot, seq, captured_at, None, 0.0, None, False, worker_id, epoch, error))
+        elif kind == "close":
+            stream, shm, view = streams.pop(name)
+            del view
+            stream.detector.close()
+            shm.close()
+    for stream, shm, view in streams.values():
+        del view
+        stream.detector.close()
+        shm.close()
+
+
+class _Stream:
+    def __init__(self, name, source, loop, worker, slots):
+        self.name = name
+        self.source = source
+        self.loop = loop
+        self.worker = worker
+        self.slots = slots
+        self.shm = None
+        self.view = None
+        self.free = list(range(slots))
+        self.epoch = 0  # bumped when its worker is restarted; results from before are stale
+        self.lock = threading.Lock()
+        self.stats = {"captured": 0, "dropped": 0, "processed": 0, "errors": 0}
+
+
+class EmotionServer:
+    def __init__(self, workers=None, mode="mediapipe", keras_model_path=None, slots=4, on_event=None,
+                 max_restarts=3, **detector_options):
+        self.n_workers = workers or max(1, os.cpu_count() - 1)
+        self.mode = mode
+        self.keras_model_path = keras_model_path
+        self.slots = slots
+        self.on_event = on_event
+        self.detector_options = detector_options
+        self.max_restarts = max_restarts
+        self.restarts = {}  # worker index -> times restarted
+        self.error = None  # why run() gave up, if it did
+        self.streams = {}
+        self._ctx = mp.get_context("spawn")
+        self._tasks = []
+        self._results = self._ctx.Queue()
+        self._procs = []
+        self._threads = []
+        self._stop = threading.Event()
+
+    def worker_for(self, name):
+        # stable affinity: the same stream name always lands on the same worker
+        return zlib.crc32(name.encode()) % self.n_workers
+
+    def add_stream(self, name, source, loop=False):
+        if name in self.streams:
+            raise ValueError(f"stream {name!r} already exists")
+        source = int(source) if str(source).isdigit() else source
+        self.streams[name] = _Stream(name, source, loop, self.worker_for(name), self.slots)
+        if self._procs:
+            self._start_capture(self.streams[name])
+
+    def _start_worker(self, i):
+        q = self._ctx.Queue()
+        p = self._ctx.Process(target=_worker_main, name=f"emotion-worker-{i}", daemon=True,
+                              args=(i, q, self._results, self.mode, self.keras_model_path,
+                                    self.detector_options))
+        p.start()
+        return q, p
+
+    def start(self):
+        for i in range(self.n_workers):
+            q, p = self._start_worker(i)
+            self._tasks.append(q)
+            self._procs.append(p)
+        self._spawn(self._collect, "results")
+        for s in self.streams.values():
+            self._start_capture(s)
+        return self
+
+    def _spawn(self, target, name, *args):
+        t = threading.Thread(target=target, args=args, name=f"serve-{name}", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _start_capture(self, s):
+        self._spawn(self._capture, s.name, s)
+
+    def _capture(self, s):
+        cap = cv2.VideoCapture(s.source)
+        if not cap.isOpened():
+            print(f"[{s.name}] cannot open source {s.source!r}")
+            return
+        live = is_live_source(s.source)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        seq = 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if s.loop and not live:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                if not live:
+                    # file stand-ins are paced like the camera they replace
+                    time.sleep(1.0 / fps)
+                seq += 1
+                s.stats["captured"] += 1
+                if s.shm is None:
+                    self._open_slots(s, frame.shape)
+                if frame.shape != s.view.shape[1:]:
+                    frame = cv2.resize(frame, (s.view.shape[2], s.view.shape[1]))
+                with s.lock:
+                    # held while the slot is filled and sent, so a worker restart cannot hand the
+                    # same slot out twice
+                    slot = s.free.pop() if s.free else None
+                    if slot is not None:
+                        np.copyto(s.view[slot], frame)
+                        self._tasks[s.worker].put(("frame", s.name, slot, seq, time.time(), s.epoch))
+                if slot is None:
+                    # the worker is behind: drop instead of queueing stale frames
+                    s.stats["dropped"] += 1
+        finally:
+            cap.release()
+
+    def _open_slots(self, s, shape):
+        nbytes = int(np.prod(shape)) * s.slots
+        s.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        s.view = np.ndarray((s.slots,) + tuple(shape), dtype=np.uint8, buffer=s.shm.buf)
+        self._tasks[s.worker].put(("open", s.name, s.shm.name, tuple(shape), s.slots))
+
+    def _collect(self):
+        while not self._stop.is_set():
+            try:
+                msg = self._results.get(timeout=0.2)
+            except Exception:
+                continue
+            name, slot, seq, captured_at, label, conf, bbox, changed, worker, epoch, error = msg
+            s = self.streams[name]
+            with s.lock:
+                if epoch == s.epoch:
+                    s.free.append(slot)
+            if error is not None:
+                s.stats["errors"] += 1
+                if s.stats["errors"] == 1 or s.stats["errors"] % 100 == 0:
+                    print(f"[{name}] frame {seq} failed on worker {worker} ({s.stats['errors']} so far): {error}")
+                continue
+            s.stats["processed"] += 1
+            event = StreamEvent(name, seq, captured_at, label, conf, bbox, changed,
+                                1000.0 * (time.time() - captured_at), worker)
+            if self.on_event is not None:
+                self.on_event(event)
+
+    def run(self, duration=None):
+        t_end = time.time() + duration if duration else None
+        try:
+            while not self._stop.is_set() and (t_end is None or time.time() < t_end):
+                if not any(t.is_alive() for t in self._threads if t.name != "serve-results"):
+                    break
+                if not self._check_workers():
+                    break
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _check_workers(self):
+        # restarts dead worker processes; False once one has died more than max_restarts times
+        for i, p in enumerate(self._procs):
+            if p.is_alive():
+                continue
+            n = self.restarts.get(i, 0)
+            if n >= self.max_restarts:
+                self.error = f"worker {i} died {n + 1} times (exit code {p.exitcode}); giving up"
+                print(self.error)
+                return False
+            self.restarts[i] = n + 1
+            print(f"worker {i} died (exit code {p.exitcode}); restarting")
+            q, self._procs[i] = self._start_worker(i)
+            for s in self.streams.values():
+                if s.worker != i:
+                    continue
+                with s.lock:
+                    # frames the dead worker held are lost: all of the stream's slots are free again
+                    s.free = list(range(s.slots))
+                    s.epoch += 1
+                    self._tasks[i] = q
+                    if s.shm is not None:
+                        q.put(("open", s.name, s.shm.name, s.view.shape[1:], s.slots))
+            self._tasks[i] = q
+        return True
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=2.0)
+        for q in self._tasks:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        for s in self.streams.values():
+            if s.shm is not None:
+                s.view = None
+                s.shm.close()
+                s.shm.unlink()
+                s.shm = None
+        self._procs, self._tasks, self._threads = [], [], []
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve emotion events for many video streams.")
+    ap.add_argument("streams", nargs="+", help="name=source, where source is a device index, file or URL")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--mode", choices=["mediapipe", "keras", "hybrid"], default="mediapipe")
+    ap.add_argument("--model", default="models/trained_model.h5")
+    ap.add_argument("--loop", action="store_true", help="loop video files (stand-ins for live feeds)")
+    ap.add_argument("--all-frames", action="store_true", help="print every frame, not only label changes")
+    ap.add_argument("--duration", type=float, default=None)
+    ap.add_argument("--max-restarts", type=int, default=3, help="per worker, before the server gives up")
+    args = ap.parse_args()
+
+    def emit(ev):
+        if args.all_frames or ev.changed:
+            print(json.dumps(ev._asdict()), flush=True)
+
+    server = EmotionServer(workers=args.workers, mode=args.mode,
+                           keras_model_path=args.model if args.mode != "mediapipe" else None, on_event=emit,
+                           max_restarts=args.max_restarts, track=True)
+    for spec in args.streams:
+        name, _, source = spec.partition("=")
+        server.add_stream(name if source else f"stream{len(server.streams)}", source or name, loop=args.loop)
+    server.start().run(duration=args.duration)
+    for s in server.streams.values():
+        print(json.dumps({"stream": s.name, "worker": s.worker, **s.stats}))
+    return 1 if server.error else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,154 @@
+# startup_profile.py
+# Cold-start measurements for the Streamlit entry points.
+#   python startup_profile.py imports                  # import-time profile of what app.py imports
+#   python startup_profile.py imports --modules emotion_detector mediapipe --top 15
+#   python startup_profile.py first-frame --mode mediapipe --runs 3
+#   python startup_profile.py first-frame --source 0   # webcam instead of the benchmark clip
+# `imports` runs a fresh interpreter under `python -X importtime` and lists the slowest
+# top-level imports (cumulative). `first-frame` spawns fresh processes that do what app.py
+# does on Start -- import, build and warm the detector, open the source, read and classify
+# one frame -- and reports the median wall time per phase, measured from process spawn.
+# Results are appended to cache/startup_history.jsonl (with the git revision) so the numbers
+# can be tracked over time.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HISTORY_PATH = os.path.join("cache", "startup_history.jsonl")
+# what `streamlit run app.py` imports before the first frame, minus streamlit itself
+APP_MODULES = ["emotion_detector", "detector_registry", "emotion_stream", "recommender", "scheduler", "metrics"]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def record(kind, data, path=HISTORY_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps({"kind": kind, "time": time.time(), "rev": git_revision(), **data}) + "\n")
+
+
+def import_profile(modules):
+    # [(cumulative_us, self_us, name, depth)] from a fresh interpreter's -X importtime output
+    code = "import " + ", ".join(modules)
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cum_us), int(self_us), name.strip(), depth))
+    return rows, wall
+
+
+def cmd_imports(args):
+    rows, wall = import_profile(args.modules)
+    top_level = [r for r in rows if r[3] == 0]
+    total_us = sum(r[0] for r in top_level)
+    print(f"import {' '.join(args.modules)}: {total_us / 1e6:.2f} s of imports "
+          f"({wall:.2f} s wall incl. interpreter start)\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cum, own, name, depth in sorted(rows, key=lambda r: -r[0])[:args.top]:
+        print(f"{cum / 1000:14.1f} {own / 1000:9.1f}  {'  ' * depth}{name}")
+    heavy = {name: cum / 1000 for cum, _, name, _ in rows
+             if name in ("tensorflow", "mediapipe", "googleapiclient.discovery", "streamlit")}
+    print("\nheavy dependencies loaded: " + (", ".join(f"{k} ({v:.0f} ms)" for k, v in heavy.items()) or "none"))
+    result = {"modules": args.modules, "imports_s": total_us / 1e6, "wall_s": wall, "heavy_ms": heavy}
+    if args.json:
+        print(json.dumps(result))
+    if not args.no_record:
+        record("imports", result)
+
+
+def _first_frame_child(spawned_at, mode, source, model):
+    # runs in a fresh interpreter; phase times are seconds since the parent spawned us
+    marks = {"interpreter": time.time() - spawned_at}
+    from detector_registry import get_detector
+    from emotion_stream import EmotionStream
+    from scheduler import LatestFrameReader
+    marks["imports"] = time.time() - spawned_at
+    keras = mode != "mediapipe"
+    detector = get_detector(mode=mode, keras_model_path=model if keras else None, track=True, wait=True)
+    marks["detector_ready"] = time.time() - spawned_at
+    reader = LatestFrameReader(source).start()
+    item = reader.read(timeout=10.0)
+    marks["first_capture"] = time.time() - spawned_at
+    if item is None:
+        reader.release()
+        raise SystemExit("no frame from source")
+    result = EmotionStream(detector).update(item.frame)
+    marks["first_result"] = time.time() - spawned_at
+    reader.release()
+    print(json.dumps({"marks": marks, "label": result.label}))
+
+
+def cmd_first_frame(args):
+    source = args.source
+    if source is None:
+        from benchmark import ensure_clip
+        source = ensure_clip()
+    runs = []
+    for i in range(args.runs):
+        proc = subprocess.run([sys.executable, __file__, "_child", str(time.time()), args.mode, str(source),
+                               args.model], capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr.strip() or proc.stdout.strip())
+            return 1
+        marks = json.loads(proc.stdout.strip().splitlines()[-1])["marks"]
+        runs.append(marks)
+        print(f"run {i + 1}: first result after {marks['first_result']:.2f} s")
+    phases = list(runs[0])
+    median = {p: statistics.median(r[p] for r in runs) for p in phases}
+    print(f"\ntime to first frame ({args.mode}, source {source}), median of {len(runs)} cold starts:")
+    prev = 0.0
+    for p in phases:
+        print(f"  {p:<15} {median[p]:6.2f} s  (+{median[p] - prev:.2f})")
+        prev = median[p]
+    result = {"mode": args.mode, "source": str(source), "runs": len(runs), "median_s": median}
+    if args.json:
+        print(json.dumps(result))
+    if not args.no_record:
+        record("first_frame", result)
+    return 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_child":
+        spawned_at, mode, source, model = sys.argv[2:6]
+        _first_frame_child(float(spawned_at), mode, source, model)
+        return 0
+    ap = argparse.ArgumentParser(description="Profile cold-start import time and time to first frame.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("imports", help="import-time profile")
+    imp.add_argument("--modules", nargs="+", default=APP_MODULES)
+    imp.add_argument("--top", type=int, default=25)
+    ff = sub.add_parser("first-frame", help="time from process start to the first classified frame")
+    ff.add_argument("--mode", choices=["mediapipe", "keras", "hybrid"], default="mediapipe")
+    ff.add_argument("--model", default="models/trained_model.h5")
+    ff.add_argument("--source", default=None, help="camera index or video (default: benchmarks/clip.avi)")
+    ff.add_argument("--runs", type=int, default=3)
+    for p in (imp, ff):
+        p.add_argument("--json", action="store_true", help="also print the result as JSON")
+        p.add_argument("--no-record", action="store_true", help=f"do not append to {HISTORY_PATH}")
+    args = ap.parse_args()
+    if args.command == "imports":
+        return cmd_imports(args)
+    return cmd_first_frame(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,73 +1,281 @@
 # train_emotion.py
 # Training script using transfer learning (MobileNetV2).
 # Prepare your dataset in data/train/<label>/ and data/val/<label>/ folders.
+# Input pipeline: tf.data with parallel JPEG decode + resize, cache() so decoding happens
+# once, batched on-device augmentation (Keras preprocessing layers) and prefetch.
+# With --cache-features the frozen MobileNetV2 embeddings are computed once into a
+# memory-mapped array and the dense head is trained on them (seconds instead of epochs
+# of full forward passes); its weights are then copied into the full model for fine-tuning.
+#   python train_emotion.py --cache-features --mixed-precision --threads 8
+# With --faces the images come from prepare_faces.py's memory-mapped face crops instead of
+# the image folders: no decoding at all, and the model is trained on the same Haar crops
+# EmotionDetector classifies at inference time.
+#   python prepare_faces.py && python train_emotion.py --faces cache/faces
+import argparse
+import hashlib
 import os
+import numpy as np
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Input
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 
 IMG_SIZE = (224,224)
 BATCH = 32
 EPOCHS = 15
+HEAD_EPOCHS = 5
 NUM_CLASSES = 5  # adjust if you have different labels
 TRAIN_DIR = "data/train"
 VAL_DIR = "data/val"
 SAVE_PATH = "models/trained_model.h5"
+CACHE_DIR = os.path.join("cache", "train")
+EXPORT_TFLITE = True  # also write models/trained_model.tflite for the lightweight runtime
+EXPORT_INT8 = False   # int8-quantize the TFLite export using data/val as representative data
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+AUTOTUNE = tf.data.AUTOTUNE
 
 def build_model(num_classes):
     base = MobileNetV2(weights='imagenet', include_top=False, input_shape=(IMG_SIZE[0], IMG_SIZE[1], 3))
     x = base.output
     x = GlobalAveragePooling2D()(x)
     x = Dropout(0.4)(x)
-    preds = Dense(num_classes, activation='softmax')(x)
+    # keep the softmax in float32 under mixed precision
+    preds = Dense(num_classes, activation='softmax', dtype='float32')(x)
     model = Model(inputs=base.input, outputs=preds)
     return model, base
 
+def build_head(feature_dim, num_classes):
+    # the same Dropout + Dense head as build_model, fed with cached GAP embeddings
+    inp = Input(shape=(feature_dim,))
+    x = Dropout(0.4)(inp)
+    preds = Dense(num_classes, activation='softmax', dtype='float32')(x)
+    return Model(inputs=inp, outputs=preds)
+
+def list_files(data_dir, classes=None):
+    # (paths, labels, classes) with labels in sorted-folder order, like flow_from_directory
+    if classes is None:
+        classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    paths, labels = [], []
+    for idx, label in enumerate(classes):
+        folder = os.path.join(data_dir, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTS):
+                paths.append(os.path.join(folder, name))
+                labels.append(idx)
+    return paths, np.array(labels, dtype=np.int32), classes
+
+def _decode(path, label, num_classes):
+    img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    img = tf.image.resize(img, IMG_SIZE, antialias=True)
+    # cached as uint8: a quarter of the memory of float32
+    return tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8), tf.one_hot(label, num_classes)
+
+def make_augmenter():
+    # vectorized equivalents of the old ImageDataGenerator settings, run per batch
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomFlip("horizontal"),
+        tf.keras.layers.RandomRotation(20 / 360),
+        tf.keras.layers.RandomTranslation(0.12, 0.12),
+        tf.keras.layers.RandomZoom(0.15),
+        tf.keras.layers.RandomBrightness((-0.3, 0.3), value_range=(0.0, 1.0)),
+    ], name="augment")
+
+def make_dataset(paths, labels, num_classes, training, cache=""):
+    # cache="" keeps decoded images in memory; a file path caches them on disk instead
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(lambda p, l: _decode(p, l, num_classes), num_parallel_calls=AUTOTUNE)
+    ds = ds.cache(cache)
+    if training:
+        ds = ds.shuffle(min(len(paths), 4096), reshuffle_each_iteration=True)
+    ds = ds.batch(BATCH, num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda x, y: (tf.cast(x, tf.float32) / 255.0, y), num_parallel_calls=AUTOTUNE)
+    if training:
+        augment = make_augmenter()
+        ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
+
+def make_face_dataset(faces, rows, labels, num_classes, training):
+    # batches gathered straight from the uint8 memmap; rows are read in file order per batch
+    def batches():
+        order = np.random.permutation(len(rows)) if training else np.arange(len(rows))
+        for i in range(0, len(order), BATCH):
+            sel = order[i:i+BATCH]
+            sel = sel[np.argsort(rows[sel])]
+            yield faces[rows[sel]], labels[sel].astype(np.int32)
+    size = faces.shape[1]
+    ds = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec((None, size, size, 3), tf.uint8), tf.TensorSpec((None,), tf.int32)))
+
+    def to_model(x, y):
+        # crops are stored BGR, as cv2 read them; the model is fed RGB like KerasEmotionModel does
+        x = tf.cast(tf.reverse(x, axis=[-1]), tf.float32) / 255.0
+        if size != IMG_SIZE[0]:
+            x = tf.image.resize(x, IMG_SIZE, antialias=True)
+        return x, tf.one_hot(y, num_classes)
+
+    ds = ds.map(to_model, num_parallel_calls=AUTOTUNE)
+    if training:
+        augment = make_augmenter()
+        ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
+
+def _fingerprint(paths):
+    h = hashlib.sha1()
+    for p in paths:
+        st = os.stat(p)
+        h.update(f"{p}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+def cached_features(base, ds, count, name, fingerprint):
+    # frozen-base GAP embeddings of a (non-augmented) dataset, computed once into a
+    # memory-mapped float32 array
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    dim = int(base.output.shape[-1])
+    path = os.path.join(CACHE_DIR, f"{name}-{fingerprint}-{dim}.f32")
+    if os.path.exists(path):
+        print("Using cached features:", path)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(count, dim))
+    extractor = Model(inputs=base.input, outputs=GlobalAveragePooling2D()(base.output))
+    feats = np.memmap(path + ".tmp", dtype=np.float32, mode="w+", shape=(count, dim))
+    i = 0
+    for x, _ in ds:
+        f = extractor(x, training=False).numpy()
+        feats[i:i+len(f)] = f
+        i += len(f)
+    feats.flush()
+    del feats
+    os.replace(path + ".tmp", path)
+    print("Cached features to", path)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(count, dim))
+
+def feature_dataset(feats, labels, num_classes, training, batch=256):
+    # batches gathered from the memmap on demand; from_tensor_slices would copy all of it into memory
+    labels = np.asarray(labels)
+    def batches():
+        order = np.random.permutation(len(labels)) if training else np.arange(len(labels))
+        for i in range(0, len(order), batch):
+            sel = np.sort(order[i:i+batch])
+            yield np.asarray(feats[sel]), labels[sel].astype(np.int32)
+    ds = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec((None, feats.shape[1]), tf.float32), tf.TensorSpec((None,), tf.int32)))
+    return ds.map(lambda x, y: (x, tf.one_hot(y, num_classes))).prefetch(AUTOTUNE)
+
+def train_head_on_features(model, base, train, val, num_classes, epochs=HEAD_EPOCHS):
+    # train/val: (plain dataset, labels, cache fingerprint)
+    (tr_plain, tr_labels, tr_key), (va_plain, va_labels, va_key) = train, val
+    tr_x = cached_features(base, tr_plain, len(tr_labels), "train", tr_key)
+    va_x = cached_features(base, va_plain, len(va_labels), "val", va_key)
+    head = build_head(tr_x.shape[1], num_classes)
+    head.compile(optimizer=Adam(1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+    tr_ds = feature_dataset(tr_x, tr_labels, num_classes, training=True)
+    va_ds = feature_dataset(va_x, va_labels, num_classes, training=False)
+    head.fit(tr_ds, epochs=epochs, validation_data=va_ds)
+    # the head's Dense is the full model's final layer
+    model.layers[-1].set_weights(head.layers[-1].get_weights())
+
+def configure(threads=None, mixed_precision=False):
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+    if mixed_precision:
+        tf.keras.mixed_precision.set_global_policy("mixed_float16")
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Train the keras-mode emotion classifier.")
+    ap.add_argument("--train", default=TRAIN_DIR)
+    ap.add_argument("--val", default=VAL_DIR)
+    ap.add_argument("--epochs", type=int, default=EPOCHS)
+    ap.add_argument("--head-epochs", type=int, default=HEAD_EPOCHS)
+    ap.add_argument("--cache-features", action="store_true",
+                    help="train the head on memory-mapped frozen-base embeddings (no augmentation in that phase)")
+    ap.add_argument("--faces", default=None,
+                    help="train on prepare_faces.py crops from this directory instead of the image folders")
+    ap.add_argument("--disk-cache", action="store_true", help="cache decoded images on disk instead of in memory")
+    ap.add_argument("--mixed-precision", action="store_true")
+    ap.add_argument("--threads", type=int, default=None)
+    return ap.parse_args()
+
+def folder_datasets(args):
+    if not os.path.exists(args.train) or not os.path.exists(args.val):
+        print(f"Please prepare dataset in '{args.train}' and '{args.val}' with subfolders per class.")
+        return None, None, None, 0
+    tr_paths, tr_labels, classes = list_files(args.train)
+    va_paths, va_labels, _ = list_files(args.val, classes)
+    num_classes = len(classes)
+    print(f"Classes: {classes}  train: {len(tr_paths)}  val: {len(va_paths)}")
+
+    tr_cache = va_cache = ""
+    if args.disk_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tr_cache = os.path.join(CACHE_DIR, f"train-{_fingerprint(tr_paths)}.tfcache")
+        va_cache = os.path.join(CACHE_DIR, f"val-{_fingerprint(va_paths)}.tfcache")
+    train_ds = make_dataset(tr_paths, tr_labels, num_classes, training=True, cache=tr_cache)
+    val_ds = make_dataset(va_paths, va_labels, num_classes, training=False, cache=va_cache)
+    plain = ((make_dataset(tr_paths, tr_labels, num_classes, training=False), tr_labels, _fingerprint(tr_paths)),
+             (val_ds, va_labels, _fingerprint(va_paths)))
+    return train_ds, val_ds, plain, num_classes
+
+def face_datasets(root):
+    from prepare_faces import FaceStore
+    tr_store, va_store = FaceStore(root, "train"), FaceStore(root, "val")
+    tr_faces, tr_rows, tr_labels, classes = tr_store.load()
+    va_faces, va_rows, va_labels, va_classes = va_store.load()
+    if not len(tr_rows) or not len(va_rows):
+        print(f"No face crops in {root}; run prepare_faces.py first.")
+        return None, None, None, 0
+    if va_classes != classes:
+        print(f"train classes {classes} != val classes {va_classes}; re-run prepare_faces.py.")
+        return None, None, None, 0
+    num_classes = len(classes)
+    print(f"Classes: {classes}  train: {len(tr_rows)}  val: {len(va_rows)}  (face crops from {root})")
+    train_ds = make_face_dataset(tr_faces, tr_rows, tr_labels, num_classes, training=True)
+    val_ds = make_face_dataset(va_faces, va_rows, va_labels, num_classes, training=False)
+    plain = ((make_face_dataset(tr_faces, tr_rows, tr_labels, num_classes, training=False), tr_labels,
+              "faces-" + tr_store.fingerprint()),
+             (val_ds, va_labels, "faces-" + va_store.fingerprint()))
+    return train_ds, val_ds, plain, num_classes
+
 def main():
-    if not os.path.exists(TRAIN_DIR) or not os.path.exists(VAL_DIR):
-        print("Please prepare dataset in 'data/train' and 'data/val' with subfolders per class.")
+    args = parse_args()
+    configure(args.threads, args.mixed_precision)
+    if args.faces:
+        train_ds, val_ds, plain, num_classes = face_datasets(args.faces)
+    else:
+        train_ds, val_ds, plain, num_classes = folder_datasets(args)
+    if train_ds is None:
         return
 
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.12,
-        height_shift_range=0.12,
-        horizontal_flip=True,
-        brightness_range=(0.7,1.3),
-        zoom_range=0.15
-    )
-    val_datagen = ImageDataGenerator(rescale=1./255)
-
-    train_gen = train_datagen.flow_from_directory(TRAIN_DIR, target_size=IMG_SIZE, batch_size=BATCH, class_mode='categorical')
-    val_gen = val_datagen.flow_from_directory(VAL_DIR, target_size=IMG_SIZE, batch_size=BATCH, class_mode='categorical')
-
-    num_classes = len(train_gen.class_indices)
     model, base = build_model(num_classes)
 
     # Freeze base
     for layer in base.layers:
         layer.trainable = False
 
-    model.compile(optimizer=Adam(1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
-    print(model.summary())
-
     # Train head
-    model.fit(train_gen, epochs=5, validation_data=val_gen)
+    if args.cache_features:
+        train_head_on_features(model, base, *plain, num_classes, epochs=args.head_epochs)
+    else:
+        model.compile(optimizer=Adam(1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+        print(model.summary())
+        model.fit(train_ds, epochs=args.head_epochs, validation_data=val_ds)
 
     # Unfreeze some layers and fine-tune
     for layer in base.layers[-40:]:
         layer.trainable = True
 
     model.compile(optimizer=Adam(1e-4), loss='categorical_crossentropy', metrics=['accuracy'])
-    model.fit(train_gen, epochs=EPOCHS, validation_data=val_gen)
+    model.fit(train_ds, epochs=args.epochs, validation_data=val_ds)
 
     os.makedirs(os.path.dirname(SAVE_PATH), exist_ok=True)
     model.save(SAVE_PATH)
     print("Saved model to", SAVE_PATH)
 
+    if EXPORT_TFLITE:
+        from export_model import export_all
+        export_all(model, SAVE_PATH, int8=EXPORT_INT8, data_dir=args.val)
+
 if __name__ == "__main__":
     main()
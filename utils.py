@@ -1,5 +1,6 @@
-from googleapiclient.discovery import build
-import streamlit as st
+# googleapiclient and streamlit are imported on first use: without an API key the
+# recommendation path never needs them, and they dominate this module's import time.
+from metrics import timer
 
 FALLBACK = {
     "happy": [("Upbeat Pop Mix", "https://www.youtube.com/results?search_query=upbeat+happy+songs")],
@@ -19,23 +20,35 @@ def emotion_to_query(emotion):
     }
     return mapping.get(emotion.lower(), f"{emotion} mood songs")
 
-def get_youtube_recommendations(emotion, api_key, max_results=5):
-    if not api_key:
+def build_youtube_client(api_key):
+    from googleapiclient.discovery import build
+    return build("youtube", "v3", developerKey=api_key)
+
+def search_youtube(youtube, emotion, max_results=5):
+    # raises on API/network errors; callers decide how to fall back
+    q = emotion_to_query(emotion)
+    req = youtube.search().list(part="snippet", q=q, type="video", maxResults=max_results)
+    with timer("youtube.search"):
+        res = req.execute()
+    videos = []
+    for item in res.get("items", []):
+        title = item["snippet"]["title"]
+        vid = item["id"]["videoId"]
+        videos.append((title, f"https://www.youtube.com/watch?v={vid}"))
+    return videos
+
+def get_youtube_recommendations(emotion, api_key, max_results=5, youtube=None):
+    if not api_key and youtube is None:
         # return fallback links
         return FALLBACK.get(emotion.lower(), FALLBACK["neutral"])
     try:
-        youtube = build("youtube", "v3", developerKey=api_key)
-        q = emotion_to_query(emotion)
-        req = youtube.search().list(part="snippet", q=q, type="video", maxResults=max_results)
-        res = req.execute()
-        videos = []
-        for item in res.get("items", []):
-            title = item["snippet"]["title"]
-            vid = item["id"]["videoId"]
-            videos.append((title, f"https://www.youtube.com/watch?v={vid}"))
+        if youtube is None:
+            youtube = build_youtube_client(api_key)
+        videos = search_youtube(youtube, emotion, max_results)
         if not videos:
             return FALLBACK.get(emotion.lower(), FALLBACK["neutral"])
         return videos
     except Exception as e:
+        import streamlit as st
         st.warning(f"Could not fetch YouTube results: {e}")
         return FALLBACK.get(emotion.lower(), FALLBACK["neutral"])